@@ -0,0 +1,168 @@
+import math
+import numpy as np
+
+from japanmeteorologicalagency import AmedasStation, AmedasStationInfo
+
+
+class AmedasStationIndex:
+    # uniform lon/lat grid over all amedas stations
+
+    def __init__(self, data: dict[str, dict[str, AmedasStation]], cell_size: float = 0.5) -> None:
+
+        # flatten {prec_name: {name: station}}
+        self._names: list[str] = []
+        self._stations: list[AmedasStation] = []
+        for prec_name, blocks in data.items():
+            for name, station in blocks.items():
+                self._names.append(name)
+                self._stations.append(station)
+
+        self._lon = np.array([station.lon for station in self._stations], dtype=np.float64)
+        self._lat = np.array([station.lat for station in self._stations], dtype=np.float64)
+        self._active_temperature = np.array([station.is_valid and station.has_temperature for station in self._stations], dtype=bool)
+
+        # cell -> station indices
+        self._cell_size = cell_size
+        cell_x = np.floor(self._lon / cell_size).astype(np.int64)
+        cell_y = np.floor(self._lat / cell_size).astype(np.int64)
+        cells: dict[tuple[int, int], list[int]] = {}
+        for i in range(len(self._stations)):
+            cells.setdefault((int(cell_x[i]), int(cell_y[i])), []).append(i)
+        self._cells = {key: np.array(indices, dtype=np.int64) for key, indices in cells.items()}
+
+        if len(self._stations) > 0:
+            self._cell_x_range = (int(cell_x.min()), int(cell_x.max()))
+            self._cell_y_range = (int(cell_y.min()), int(cell_y.max()))
+        else:
+            self._cell_x_range = (0, -1)
+            self._cell_y_range = (0, -1)
+
+    @staticmethod
+    def from_station_info(station_info: AmedasStationInfo, cell_size: float = 0.5) -> "AmedasStationIndex":
+        return AmedasStationIndex(station_info.get_all_amedas_stations(), cell_size)
+
+    def _get_cell_indices(self, x_min: int, y_min: int, x_max: int, y_max: int) -> np.ndarray:
+        x_min = max(x_min, self._cell_x_range[0])
+        x_max = min(x_max, self._cell_x_range[1])
+        y_min = max(y_min, self._cell_y_range[0])
+        y_max = min(y_max, self._cell_y_range[1])
+
+        indices: list[np.ndarray] = []
+        for x in range(x_min, x_max + 1):
+            for y in range(y_min, y_max + 1):
+                if (x, y) in self._cells:
+                    indices.append(self._cells[(x, y)])
+
+        if len(indices) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(indices)
+
+    def _get_bbox_indices(self, lon_min: float, lat_min: float, lon_max: float, lat_max: float, active_temperature: bool) -> np.ndarray:
+        candidates = self._get_cell_indices(
+            math.floor(lon_min / self._cell_size),
+            math.floor(lat_min / self._cell_size),
+            math.floor(lon_max / self._cell_size),
+            math.floor(lat_max / self._cell_size),
+        )
+
+        lon = self._lon[candidates]
+        lat = self._lat[candidates]
+        mask = (lon >= lon_min) & (lon <= lon_max) & (lat >= lat_min) & (lat <= lat_max)
+        if active_temperature:
+            mask &= self._active_temperature[candidates]
+
+        return candidates[mask]
+
+    def _to_result(self, indices: np.ndarray) -> list[tuple[str, AmedasStation]]:
+        return [(self._names[i], self._stations[i]) for i in indices]
+
+    def _get_distances(self, lon: float, lat: float, indices: np.ndarray) -> np.ndarray:
+        # haversine, meter
+        r = 6371000
+        lon1 = math.radians(lon)
+        lat1 = math.radians(lat)
+        lon2 = np.radians(self._lon[indices])
+        lat2 = np.radians(self._lat[indices])
+        a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        return 2 * r * np.arcsin(np.sqrt(a))
+
+    def get_active_temperature_stations(self) -> list[tuple[str, AmedasStation]]:
+        return self._to_result(np.nonzero(self._active_temperature)[0])
+
+    def query_bbox(self, lon_min: float, lat_min: float, lon_max: float, lat_max: float, active_temperature: bool = False) -> list[tuple[str, AmedasStation]]:
+        return self._to_result(self._get_bbox_indices(lon_min, lat_min, lon_max, lat_max, active_temperature))
+
+    def query_polygon(self, rings: list[list[tuple[float, float]]], active_temperature: bool = False) -> list[tuple[str, AmedasStation]]:
+        # rings of (lon, lat), holes are handled by even-odd rule
+        all_points = np.array([point for ring in rings for point in ring], dtype=np.float64)
+        if len(all_points) == 0:
+            return []
+
+        lon_min, lat_min = all_points.min(axis=0)
+        lon_max, lat_max = all_points.max(axis=0)
+        candidates = self._get_bbox_indices(lon_min, lat_min, lon_max, lat_max, active_temperature)
+
+        # ray casting for all candidates at once
+        x = self._lon[candidates]
+        y = self._lat[candidates]
+        inside = np.zeros(len(candidates), dtype=bool)
+        for ring in rings:
+            ring_points = np.asarray(ring, dtype=np.float64)
+            x1, y1 = ring_points[:, 0], ring_points[:, 1]
+            x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+            for j in range(len(ring_points)):
+                crossing = (y1[j] > y) != (y2[j] > y)
+                if not crossing.any():
+                    continue
+                x_cross = x1[j] + (y - y1[j]) * (x2[j] - x1[j]) / np.where(y2[j] == y1[j], 1.0, y2[j] - y1[j])
+                inside ^= crossing & (x < x_cross)
+
+        return self._to_result(candidates[inside])
+
+    def query_nearest(self, lon: float, lat: float, k: int = 1, active_temperature: bool = False) -> list[tuple[str, AmedasStation, float]]:
+        # (name, station, distance in meter), searching rings of cells until k stations are surely found
+        center_x = math.floor(lon / self._cell_size)
+        center_y = math.floor(lat / self._cell_size)
+        max_radius = max(
+            abs(center_x - self._cell_x_range[0]),
+            abs(center_x - self._cell_x_range[1]),
+            abs(center_y - self._cell_y_range[0]),
+            abs(center_y - self._cell_y_range[1]),
+        )
+
+        radius = 0
+        while True:
+            candidates = self._get_cell_indices(center_x - radius, center_y - radius, center_x + radius, center_y + radius)
+            if active_temperature:
+                candidates = candidates[self._active_temperature[candidates]]
+            distances = self._get_distances(lon, lat, candidates)
+
+            if radius >= max_radius:
+                break
+
+            if len(candidates) >= k:
+                # stations outside of searched cells are at least this far
+                edge_lat = min(abs(lat) + (radius + 1) * self._cell_size, 89.0)
+                bound = radius * self._cell_size * 111195 * math.cos(math.radians(edge_lat))
+                if np.partition(distances, k - 1)[k - 1] <= bound:
+                    break
+
+            radius += 1
+
+        order = np.argsort(distances)[:k]
+        return [(self._names[candidates[i]], self._stations[candidates[i]], float(distances[i])) for i in order]
+
+
+def test():
+    amedas = AmedasStationInfo("workspace")
+    index = AmedasStationIndex.from_station_info(amedas)
+
+    # minato, nagoya
+    for name, station, distance in index.query_nearest(136.8855, 35.1077, 3, active_temperature=True):
+        print(name, station, distance)
+
+    for name, station in index.query_bbox(136.6, 34.9, 137.2, 35.3, active_temperature=True):
+        print(name, station)
+
+
+# test()
@@ -0,0 +1,177 @@
+import numpy as np
+from datetime import datetime, date, timezone, timedelta
+
+from japanmeteorologicalagency import AmedasStation, AmedasDailyInfo, AmedasSeries
+
+
+class AmedasTimeMatcher:
+    # amedas observations at arbitrary times for many (station, time) pairs at once
+
+    _slot = np.timedelta64(10, "m")
+
+    def __init__(self, amedas_daily_info: AmedasDailyInfo) -> None:
+        self._amedas_daily_info = amedas_daily_info
+
+    def _to_jst_datetime64(self, timestamps: list[datetime]) -> np.ndarray:
+        # amedas tables are jst, aware datetimes are converted
+        jst = timezone(timedelta(hours=9))
+        naive: list[datetime] = []
+        for timestamp in timestamps:
+            if timestamp.tzinfo is not None:
+                timestamp = timestamp.astimezone(jst).replace(tzinfo=None)
+            naive.append(timestamp)
+        return np.array(naive, dtype="datetime64[s]")
+
+    @staticmethod
+    def sample(
+        values: np.ndarray,
+        station_indices: np.ndarray,
+        positions: np.ndarray,
+        method: str = "linear",
+        window_slots: float = 1.0,
+        max_gap_slots: float = 3.0,
+    ) -> np.ndarray:
+        # values: (stations, slots) on a regular grid, positions: fractional slot of each pair
+
+        station_count, slot_count = values.shape
+        slots = np.arange(slot_count)
+        valid = ~np.isnan(values)
+        result = np.full(len(positions), np.nan, dtype=np.float64)
+        if slot_count == 0 or len(positions) == 0:
+            return result
+
+        if method == "mean":
+            # mean of valid slots within +-window_slots
+            filled = np.where(valid, values, 0.0).astype(np.float64)
+            value_sums = np.concatenate([np.zeros((station_count, 1)), np.cumsum(filled, axis=1)], axis=1)
+            valid_counts = np.concatenate([np.zeros((station_count, 1)), np.cumsum(valid, axis=1)], axis=1)
+
+            first = np.clip(np.ceil(positions - window_slots).astype(np.int64), 0, slot_count)
+            last = np.clip(np.floor(positions + window_slots).astype(np.int64) + 1, 0, slot_count)
+            last = np.maximum(first, last)
+
+            counts = valid_counts[station_indices, last] - valid_counts[station_indices, first]
+            sums = value_sums[station_indices, last] - value_sums[station_indices, first]
+            has_value = counts > 0
+            result[has_value] = sums[has_value] / counts[has_value]
+            return result
+
+        # nearest valid slot at or before / at or after each slot
+        previous_valid = np.maximum.accumulate(np.where(valid, slots, -1), axis=1)
+        next_valid = np.minimum.accumulate(np.where(valid, slots, slot_count)[:, ::-1], axis=1)[:, ::-1]
+
+        in_range = (positions >= 0) & (positions <= slot_count - 1)
+        clipped = np.clip(positions, 0, slot_count - 1)
+        left = previous_valid[station_indices, np.floor(clipped).astype(np.int64)]
+        right = next_valid[station_indices, np.ceil(clipped).astype(np.int64)]
+        has_left = in_range & (left >= 0)
+        has_right = in_range & (right < slot_count)
+        left_safe = np.clip(left, 0, slot_count - 1)
+        right_safe = np.clip(right, 0, slot_count - 1)
+        left_values = values[station_indices, left_safe].astype(np.float64)
+        right_values = values[station_indices, right_safe].astype(np.float64)
+
+        if method == "nearest":
+            left_distance = np.where(has_left, positions - left, np.inf)
+            right_distance = np.where(has_right, right - positions, np.inf)
+            use_left = left_distance <= right_distance
+            distance = np.where(use_left, left_distance, right_distance)
+            nearest_values = np.where(use_left, left_values, right_values)
+            ok = distance <= max_gap_slots
+            result[ok] = nearest_values[ok]
+            return result
+
+        if method == "linear":
+            # both neighbours must exist and not be too far apart
+            ok = has_left & has_right & ((right - left) <= max_gap_slots)
+            span = np.where(right > left, right - left, 1)
+            weight = np.where(right > left, (positions - left) / span, 0.0)
+            interpolated = left_values + (right_values - left_values) * weight
+            result[ok] = interpolated[ok]
+            return result
+
+        raise Exception("unknown method: " + method)
+
+    def match(
+        self,
+        stations: list[AmedasStation],
+        timestamps: list[datetime],
+        column: str,
+        method: str = "linear",
+        window_minutes: float = 10.0,
+        max_gap_minutes: float = 30.0,
+    ) -> np.ndarray:
+        # stations[i] observed at timestamps[i], nan if not available
+        if len(stations) != len(timestamps):
+            raise Exception("stations and timestamps mismatched!")
+        if len(stations) == 0:
+            return np.empty(0, dtype=np.float64)
+
+        times = self._to_jst_datetime64(timestamps)
+
+        # unique stations
+        station_keys: dict[tuple[int, int], int] = {}
+        unique_stations: list[AmedasStation] = []
+        station_indices = np.empty(len(stations), dtype=np.int64)
+        for i, station in enumerate(stations):
+            key = (station.prec_no, station.block_no)
+            if not key in station_keys:
+                station_keys[key] = len(unique_stations)
+                unique_stations.append(station)
+            station_indices[i] = station_keys[key]
+
+        # days around each time, "00:00" is the last line of the previous day
+        margin = np.timedelta64(int(max(window_minutes, max_gap_minutes)) + 10, "m")
+        first_days = (times - margin).astype("datetime64[D]")
+        last_days = (times + margin).astype("datetime64[D]")
+        start: date = first_days.min().item()
+        end: date = last_days.max().item()
+
+        station_days: set[tuple[int, date]] = set()
+        for i in range(len(times)):
+            day = first_days[i]
+            while day <= last_days[i]:
+                station_days.add((int(station_indices[i]), day.item()))
+                day += np.timedelta64(1, "D")
+        dailies = self._amedas_daily_info.prefetch_amedas_daily([(unique_stations[index], day) for index, day in station_days])
+
+        # (stations, slots) grid shared by all stations
+        dailies_per_station: list[list] = [[] for _ in unique_stations]
+        for (prec_no, block_no, day), daily in dailies.items():
+            dailies_per_station[station_keys[(prec_no, block_no)]].append(daily)
+
+        values = None
+        series_start = None
+        for index, station_dailies in enumerate(dailies_per_station):
+            series = AmedasSeries.from_dailies(station_dailies, start, end, [column])
+            if values is None:
+                values = np.empty((len(unique_stations), len(series.times)), dtype=np.float32)
+                series_start = series.times[0]
+            values[index] = series.values[:, 0]
+
+        positions = (times - series_start) / self._slot
+        slot_minutes = self._slot / np.timedelta64(1, "m")
+
+        return self.sample(
+            values,
+            station_indices,
+            positions.astype(np.float64),
+            method,
+            window_minutes / slot_minutes,
+            max_gap_minutes / slot_minutes,
+        )
+
+
+def test():
+    from japanmeteorologicalagency import AmedasStationInfo
+
+    amedas = AmedasStationInfo("workspace")
+    nagoya = amedas.get_amedas_station("愛知県", "名古屋")
+
+    matcher = AmedasTimeMatcher(AmedasDailyInfo("workspace"))
+    timestamps = [datetime(2024, 8, 1, 10, 33), datetime(2024, 8, 1, 23, 58), datetime(2024, 8, 2, 0, 4)]
+    for method in ["linear", "nearest", "mean"]:
+        print(method, matcher.match([nagoya] * len(timestamps), timestamps, "気温", method))
+
+
+# test()
@@ -0,0 +1,6 @@
+import sys
+
+from benchmark.suite import main
+
+# python -m benchmark
+sys.exit(main())
@@ -0,0 +1,40 @@
+import os, glob, time
+
+from japanmeteorologicalagency import AmedasDailyInfo
+
+# python -m benchmark.amedas_parse
+# fixtures are saved 10 minute pages (10min_s1 / 10min_a1) of www.data.jma.go.jp
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "fixtures", "jma")
+
+
+def measure(func, html: str, repeat: int) -> tuple[float, tuple[list[str], list[list[str]]]]:
+    result = func(html)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(html)
+    elapsed = (time.perf_counter() - start) / repeat
+    return elapsed, result
+
+
+def main(repeat: int = 20):
+    daily_info = AmedasDailyInfo("workspace")
+
+    for path in sorted(glob.glob(os.path.join(FIXTURE_DIR, "10min_*.html"))):
+        with open(path, "r", encoding="utf-8") as f:
+            html = f.read()
+
+        bs4_time, bs4_result = measure(daily_info._parse_amedas_daily_table_bs4, html, repeat)
+        lxml_time, lxml_result = measure(daily_info._parse_amedas_daily_table_lxml, html, repeat)
+
+        if bs4_result != lxml_result:
+            raise Exception("lxml result differs from html.parser: " + path)
+
+        print(os.path.basename(path))
+        print(f"  html.parser: {bs4_time * 1000:.2f} ms")
+        print(f"  lxml       : {lxml_time * 1000:.2f} ms")
+        print(f"  speedup    : {bs4_time / lxml_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+import os, json, math, struct
+from datetime import datetime, timedelta
+
+# python -m benchmark.make_fixtures
+# synthetic stand-ins for the pages and files of the live services, small but with the real structure.
+# html, json and shapefile are checked in, the hdf5 needs h5py and is written on demand by ensure_hdf5().
+# mockserver replays the same files
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+PREFECTURE_NAMES = [
+    "北海道", "青森県", "岩手県", "宮城県", "秋田県", "山形県", "福島県", "茨城県", "栃木県", "群馬県",
+    "埼玉県", "千葉県", "東京都", "神奈川県", "新潟県", "富山県", "石川県", "福井県", "山梨県", "長野県",
+    "岐阜県", "静岡県", "愛知県", "三重県", "滋賀県", "京都府", "大阪府", "兵庫県", "奈良県", "和歌山県",
+    "鳥取県", "島根県", "岡山県", "広島県", "山口県", "徳島県", "香川県", "愛媛県", "高知県", "福岡県",
+    "佐賀県", "長崎県", "熊本県", "大分県", "宮崎県", "鹿児島県", "沖縄県",
+]  # fmt: skip
+
+HDF5_FILENAME = "GC1SG1_20240115D01D_T0529_L2SG_LST_Q_3000.h5"
+
+
+def write_ksj_index(path: str) -> None:
+    # nlftp.mlit.go.jp/ksj/index.html, categories are collapsibles of sub categories of links
+    categories = [
+        ("1. 国土（水・土地）", ["指定地域", "沿岸域", "自然", "土地関連", "国土骨格"]),
+        ("2. 政策区域", ["行政地域", "大都市圏", "産業振興", "その他"]),
+        ("3. 地域", ["施設", "地域資源・観光", "交通"]),
+        ("4. 交通", ["交通"]),
+        ("5. 各種統計", ["統計"]),
+    ]
+
+    lines = [
+        "<!DOCTYPE html>",
+        '<html lang="ja">',
+        '<head><meta charset="UTF-8"><title>国土数値情報ダウンロードサイト</title></head>',
+        "<body>",
+        "<header><nav><a href=\"../index.html\">トップ</a></nav></header>",
+        "<main>",
+    ]
+    item_number = 0
+    for category_name, sub_category_names in categories:
+        # one collapsible per category
+        lines.append('<ul class="collapsible"><li>')
+        lines.append(f'<div class="collapsible-header"><p>{category_name}<i class="material-icons">expand_more</i></p></div>')
+        lines.append('<div class="collapsible-body">')
+        for sub_category_name in sub_category_names:
+            lines.append(f'<div class="paddingAll"><span>{sub_category_name}</span></div>')
+            lines.append('<div class="row">')
+            for i in range(8):
+                item_number += 1
+                if sub_category_name == "行政地域" and i == 0:
+                    # AdministrativeDivisionInfo follows the first item of the second category
+                    lines.append('<div class="col s12 m6"><a href="./gml/datalist/KsjTmplt-N03-2024.html">行政区域</a></div>')
+                    continue
+                lines.append(f'<div class="col s12 m6"><a href="./gml/datalist/KsjTmplt-A{item_number:02d}.html">{sub_category_name} データ{i + 1}</a></div>')
+            lines.append("</div>")
+        lines.append("</div>")
+        lines.append("</li></ul>")
+    lines.extend(["</main>", "<footer>国土交通省</footer>", "</body>", "</html>"])
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+# (name, as_type, block_no, lat, lon, has temperature, end year), 9999 is active
+AICHI_STATIONS = [
+    ("名古屋", "s", 47636, 35.1667, 136.9650, True, 9999),
+    ("伊良湖", "s", 47678, 34.6267, 137.0933, True, 9999),
+    ("愛西", "a", 451, 35.1683, 136.7283, True, 9999),
+    ("稲武", "a", 452, 35.2117, 137.5050, True, 9999),
+    ("豊田", "a", 453, 35.0783, 137.1733, True, 9999),
+    ("岡崎", "a", 454, 34.9233, 137.1833, True, 9999),
+    ("新城", "a", 455, 34.9017, 137.5283, True, 9999),
+    ("蒲郡", "a", 456, 34.8200, 137.2117, True, 9999),
+    ("豊橋", "a", 457, 34.7500, 137.3417, True, 9999),
+    ("大府", "a", 458, 35.0117, 136.9633, True, 9999),
+    ("南知多", "a", 459, 34.7150, 136.9417, True, 9999),
+    ("セントレア", "a", 460, 34.8583, 136.8050, True, 9999),
+    ("一宮", "a", 461, 35.3000, 136.8000, False, 9999),
+    ("瀬戸", "a", 462, 35.2250, 137.0883, False, 2010),
+]
+
+
+def _to_degree_minute(value: float) -> tuple[str, str]:
+    degree = int(value)
+    return str(degree), f"{(value - degree) * 60:.1f}"
+
+
+def write_jma_prefecture00(path: str) -> None:
+    # www.data.jma.go.jp/obd/stats/etrn/select/prefecture00.php, clickable map of prefectures
+    lines = [
+        '<html lang="ja"><head><meta charset="UTF-8"><title>気象庁｜過去の気象データ検索</title></head><body>',
+        '<div id="main">',
+        '<img src="../../images/map/japan.gif" usemap="#point" alt="地図">',
+        '<map name="point">',
+    ]
+    for prec_index, prec_name in enumerate(PREFECTURE_NAMES):
+        # aichi is 51 as on the real page, the others are made up
+        prec_no = 51 if prec_name == "愛知県" else 11 + prec_index
+        lines.append(f'<area shape="rect" alt="{prec_name}" coords="{prec_index * 10},0,{prec_index * 10 + 9},9" href="prefecture.php?prec_no={prec_no}&block_no=&year=&month=&day=&view=">')
+    lines.extend(["</map>", "</div>", "</body></html>"])
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def write_jma_prefecture(path: str, prec_no: int) -> None:
+    # www.data.jma.go.jp/obd/stats/etrn/select/prefecture.php?prec_no=51, stations are viewPoint() arguments
+    lines = [
+        '<html lang="ja"><head><meta charset="UTF-8"><title>気象庁｜過去の気象データ検索 愛知県</title></head><body>',
+        '<div id="contents_area2">',
+        '<img src="../../images/map/51.gif" usemap="#point" alt="地図">',
+        '<map name="point">',
+    ]
+    for i, (name, as_type, block_no, lat, lon, has_temperature, end_year) in enumerate(AICHI_STATIONS):
+        lat_d, lat_m = _to_degree_minute(lat)
+        lon_d, lon_m = _to_degree_minute(lon)
+        flag = "1" if has_temperature else "0"
+        values = [as_type, str(block_no).zfill(4), name, "", lat_d, lat_m, lon_d, lon_m, "10.0", "1", "1", flag, "1", "0", flag, str(end_year), "99", "99", "", "", "", "", ""]
+        arguments = ",".join(f"'{value}'" for value in values)
+        href = f"../index.php?prec_no={prec_no}&block_no={str(block_no).zfill(4)}&year=&month=&day=&view="
+        # the real page has an area without onmouseover for each station too
+        lines.append(f'<area shape="rect" alt="{name}" coords="{i * 10},0,{i * 10 + 9},9" href="{href}" onmouseover="javascript:viewPoint({arguments});" onmouseout="javascript:initPoint();">')
+        lines.append(f'<area shape="rect" alt="{name}" coords="{i * 10},10,{i * 10 + 9},19" href="{href}">')
+    lines.extend(["</map>", "</div>", "</body></html>"])
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def write_ksj_n03(path: str) -> None:
+    # nlftp.mlit.go.jp/ksj/gml/datalist/KsjTmplt-N03-2024.html, one row per prefecture and year, the latest last
+    lines = [
+        "<!DOCTYPE html>",
+        '<html lang="ja">',
+        '<head><meta charset="UTF-8"><title>行政区域データ</title></head>',
+        "<body>",
+        "<main>",
+        '<div id="Jmap"><img src="../../images/jmap.png" alt="map"></div>',
+        '<table class="responsive-table">',
+        "<tr><th>地域</th><th>測地系</th><th>年度</th><th>容量</th><th>ファイル名</th><th>ダウンロード</th></tr>",
+    ]
+    for prec_index, prec_name in enumerate(PREFECTURE_NAMES):
+        prec_code = f"{prec_index + 1:02d}"
+        for year in [2022, 2023, 2024]:
+            filename = f"N03-{year}0101_{prec_code}_GML.zip"
+            size_str = f"{(prec_index * 7 + year) % 90 + 5}.{prec_index % 10}MB"
+            onclick = f"javascript:DownLd('{size_str}','{filename}','../../data/N03/N03-{year}/{filename}',this);"
+            lines.append(
+                f"<tr><td>{prec_name}</td><td>世界測地系</td><td>{year}年（令和{year - 2018}年）</td>"
+                f"<td>{size_str}</td><td>{filename}</td>"
+                f'<td><a href="#" onclick="{onclick}">ダウンロード</a></td></tr>'
+            )
+    lines.extend(["</table>", "</main>", "</body>", "</html>"])
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def write_csw_response(path: str) -> None:
+    # gportal.jaxa.jp/csw/csw GetRecords in json, one feature per granule with its footprint
+    features = []
+    start = datetime(2024, 1, 1, 1, 30)
+    for day in range(3):
+        for h, v in [(28, 5), (29, 5), (30, 5), (29, 4), (29, 6)]:
+            utc_start = start + timedelta(days=day, minutes=h * 2)
+            utc_end = utc_start + timedelta(minutes=2)
+
+            # tile footprint, 10 degree cells of the sinusoidal grid, x = lon * cos(lat)
+            lat_max = 90 - v * 10
+            lat_min = lat_max - 10
+            x_min = h * 10 - 180
+            x_max = x_min + 10
+            cos_min = math.cos(math.radians(lat_min))
+            cos_max = math.cos(math.radians(lat_max))
+            ring = [
+                [x_min / cos_min, lat_min],
+                [x_max / cos_min, lat_min],
+                [x_max / cos_max, lat_max],
+                [x_min / cos_max, lat_max],
+                [x_min / cos_min, lat_min],
+            ]
+
+            date_str = utc_start.strftime("%Y%m%d")
+            granule_id = f"GC1SG1_{date_str}D01D_T{v:02d}{h:02d}_L2SG_LST_Q_3000"
+            features.append(
+                {
+                    "type": "Feature",
+                    "id": granule_id,
+                    "geometry": {"type": "Polygon", "coordinates": [ring]},
+                    "properties": {
+                        "identifier": granule_id,
+                        "acquisitionInformation": {"platform": {"id": "GCOM-C"}, "instrument": {"id": "SGLI"}},
+                        "product": {
+                            "fileName": f"https://gportal.jaxa.jp/download/standard/GCOM-C/GCOM-C.SGLI/L2.LAND.LST/3/{utc_start:%Y/%m/%d}/{granule_id}.h5",
+                            "size": 4096000 + h * 1000 + v,
+                            "version": "3",
+                        },
+                        "beginPosition": utc_start.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                        "endPosition": utc_end.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+                    },
+                }
+            )
+
+    data = {
+        "type": "FeatureCollection",
+        "properties": {"totalResults": len(features), "startIndex": 1, "itemsPerPage": len(features)},
+        "features": features,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+
+
+def write_shapefile(path_without_extension: str) -> None:
+    # N03-like polygons (a 3x3 grid of municipalities around nagoya), shp/shx/dbf/prj without gdal
+    fields = [("N03_001", 20), ("N03_002", 20), ("N03_003", 20), ("N03_004", 20), ("N03_007", 5)]
+    cities = ["名古屋市千種区", "名古屋市東区", "名古屋市北区", "名古屋市西区", "名古屋市中村区", "名古屋市中区", "名古屋市昭和区", "名古屋市瑞穂区", "名古屋市熱田区"]
+
+    polygons: list[tuple[list[str], list[tuple[float, float]]]] = []
+    for i, city in enumerate(cities):
+        x0 = 136.85 + (i % 3) * 0.05
+        y0 = 35.10 + (i // 3) * 0.05
+        # clockwise outer ring
+        ring = [(x0, y0), (x0, y0 + 0.05), (x0 + 0.05, y0 + 0.05), (x0 + 0.05, y0), (x0, y0)]
+        polygons.append((["愛知県", "", "名古屋市", city[len("名古屋市") :], f"{23101 + i}"], ring))
+
+    all_points = [point for attributes, ring in polygons for point in ring]
+    bbox = (
+        min(x for x, y in all_points),
+        min(y for x, y in all_points),
+        max(x for x, y in all_points),
+        max(y for x, y in all_points),
+    )
+
+    records: list[bytes] = []
+    for attributes, ring in polygons:
+        content = struct.pack("<i4d2i", 5, *_get_bbox(ring), 1, len(ring))
+        content += struct.pack("<i", 0)
+        content += b"".join(struct.pack("<2d", x, y) for x, y in ring)
+        records.append(content)
+
+    def header(file_length_words: int) -> bytes:
+        return struct.pack(">7i", 9994, 0, 0, 0, 0, 0, file_length_words) + struct.pack("<2i4d4d", 1000, 5, *bbox, 0.0, 0.0, 0.0, 0.0)
+
+    shp_body = b""
+    shx_body = b""
+    offset_words = 50
+    for record_number, content in enumerate(records, start=1):
+        shx_body += struct.pack(">2i", offset_words, len(content) // 2)
+        shp_body += struct.pack(">2i", record_number, len(content) // 2) + content
+        offset_words += 4 + len(content) // 2
+
+    with open(path_without_extension + ".shp", "wb") as f:
+        f.write(header(50 + len(shp_body) // 2) + shp_body)
+    with open(path_without_extension + ".shx", "wb") as f:
+        f.write(header(50 + len(shx_body) // 2) + shx_body)
+
+    # dbase III, utf-8 text as gdal reads with the .cpg
+    record_length = 1 + sum(length for name, length in fields)
+    dbf = struct.pack("<4BIHH20x", 3, 124, 1, 1, len(polygons), 32 + 32 * len(fields) + 1, record_length)
+    for name, length in fields:
+        dbf += struct.pack("<11sc4xB15x", name.encode("ascii"), b"C", length)
+    dbf += b"\r"
+    for attributes, ring in polygons:
+        dbf += b" "
+        for (name, length), value in zip(fields, attributes):
+            encoded = value.encode("utf-8")[:length]
+            dbf += encoded + b" " * (length - len(encoded))
+    dbf += b"\x1a"
+    with open(path_without_extension + ".dbf", "wb") as f:
+        f.write(dbf)
+
+    with open(path_without_extension + ".cpg", "w", encoding="ascii") as f:
+        f.write("UTF-8")
+    with open(path_without_extension + ".prj", "w", encoding="ascii") as f:
+        f.write(
+            'GEOGCS["JGD2011",DATUM["Japanese_Geodetic_Datum_2011",SPHEROID["GRS 1980",6378137,298.257222101]],'
+            'PRIMEM["Greenwich",0],UNIT["degree",0.0174532925199433]]'
+        )
+
+
+def _get_bbox(ring: list[tuple[float, float]]) -> tuple[float, float, float, float]:
+    return min(x for x, y in ring), min(y for x, y in ring), max(x for x, y in ring), max(y for x, y in ring)
+
+
+def ensure_hdf5(directory: str, size: int = 1200) -> str:
+    # GCOM-C L2 LST tile around nagoya (T0529), the layout GcomHdf5 reads through gdal, "" without h5py
+    path = os.path.join(directory, HDF5_FILENAME)
+    if os.path.exists(path):
+        return path
+
+    try:
+        import h5py
+        import numpy as np
+    except ImportError:
+        return ""
+
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(0)
+    with h5py.File(path + ".tmp", "w") as f:
+        image_data = f.create_group("Image_data")
+        # kelvin / 0.02, 65535 is no data
+        lst = (rng.normal(280.0, 5.0, (size, size)) / 0.02).astype(np.uint16)
+        lst[:16, :] = 65535
+        image_data.create_dataset("LST", data=lst, compression="gzip")
+        qa_flag = np.zeros((size, size), dtype=np.uint16)
+        qa_flag[rng.random((size, size)) < 0.3] |= 1 << 12  # cloudy
+        qa_flag[:16, :] |= 1  # no input data
+        image_data.create_dataset("QA_flag", data=qa_flag, compression="gzip")
+
+        geometry_data = f.create_group("Geometry_data")
+        # corners of tile 05/29 in the sinusoidal grid
+        geometry_data.attrs["Upper_left_longitude"] = np.float32(110 / math.cos(math.radians(40)))
+        geometry_data.attrs["Upper_left_latitude"] = np.float32(40.0)
+        geometry_data.attrs["Lower_right_longitude"] = np.float32(120 / math.cos(math.radians(30)))
+        geometry_data.attrs["Lower_right_latitude"] = np.float32(30.0)
+
+        global_attributes = f.create_group("Global_attributes")
+        global_attributes.attrs["Image_start_time"] = np.bytes_("20240115 01:40:12.000")
+        global_attributes.attrs["Image_end_time"] = np.bytes_("20240115 01:42:03.000")
+    os.replace(path + ".tmp", path)
+
+    return path
+
+
+def main():
+    os.makedirs(os.path.join(FIXTURE_DIR, "mlit"), exist_ok=True)
+    os.makedirs(os.path.join(FIXTURE_DIR, "gportal"), exist_ok=True)
+    os.makedirs(os.path.join(FIXTURE_DIR, "shp"), exist_ok=True)
+
+    write_jma_prefecture00(os.path.join(FIXTURE_DIR, "jma", "prefecture00.html"))
+    write_jma_prefecture(os.path.join(FIXTURE_DIR, "jma", "prefecture_51.html"), 51)
+    write_ksj_index(os.path.join(FIXTURE_DIR, "mlit", "ksj_index.html"))
+    write_ksj_n03(os.path.join(FIXTURE_DIR, "mlit", "KsjTmplt-N03-2024.html"))
+    write_csw_response(os.path.join(FIXTURE_DIR, "gportal", "csw_10002019.json"))
+    write_shapefile(os.path.join(FIXTURE_DIR, "shp", "N03-20240101_23"))
+
+
+if __name__ == "__main__":
+    main()
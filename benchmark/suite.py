@@ -0,0 +1,276 @@
+import os, sys, json, time, glob, shutil, argparse, tempfile, importlib.util
+from dataclasses import dataclass
+from typing import Callable
+
+from benchmark.make_fixtures import FIXTURE_DIR, ensure_hdf5
+
+# python -m benchmark [--update-baseline] [--threshold 0.2] [--filter name]
+# every case runs on fixtures only, cases whose modules are not installed are skipped
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+@dataclass
+class BenchmarkCase:
+    name: str
+    requires: list[str]  # importable modules
+    setup: Callable[[str], Callable[[], object]]  # setup(work_dir) returns the function to time
+    repeat: int = 20
+
+
+def _read_fixture(*names: str) -> str:
+    with open(os.path.join(FIXTURE_DIR, *names), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def setup_csw_parse(work_dir: str) -> Callable[[], object]:
+    from gcom import CSWWrapper
+
+    text = _read_fixture("gportal", "csw_10002019.json")
+    csw_wrapper = CSWWrapper()
+    return lambda: csw_wrapper._parse_hdf5_footprints(json.loads(text))
+
+
+def setup_jma_table_parse(work_dir: str) -> Callable[[], object]:
+    from japanmeteorologicalagency import AmedasDailyInfo
+
+    htmls: list[str] = []
+    for path in sorted(glob.glob(os.path.join(FIXTURE_DIR, "jma", "10min_*.html"))):
+        with open(path, "r", encoding="utf-8") as f:
+            htmls.append(f.read())
+    daily_info = AmedasDailyInfo(work_dir)
+    return lambda: [daily_info._parse_amedas_daily_table(html) for html in htmls]
+
+
+def setup_mlit_index_parse(work_dir: str) -> Callable[[], object]:
+    from japanmlitnlftp import TopInfo
+
+    html = _read_fixture("mlit", "ksj_index.html")
+    top_info = TopInfo()
+    return lambda: top_info._parse(html, "https://nlftp.mlit.go.jp/ksj/index.html")
+
+
+def setup_mlit_n03_parse(work_dir: str) -> Callable[[], object]:
+    from japanmlitnlftp import AdministrativeDivisionInfo
+
+    html = _read_fixture("mlit", "KsjTmplt-N03-2024.html")
+    division_info = AdministrativeDivisionInfo(work_dir, work_dir)
+    return lambda: division_info._parse_prefecture_html(html, "https://nlftp.mlit.go.jp/ksj/gml/datalist/KsjTmplt-N03-2024.html")
+
+
+def _get_synthetic_stations() -> dict:
+    from japanmeteorologicalagency import AmedasStation
+
+    # about the size of the real catalog, 47 prefectures x 28 stations
+    data: dict[str, dict[str, AmedasStation]] = {}
+    for prec_index in range(47):
+        stations: dict[str, AmedasStation] = {}
+        for i in range(28):
+            as_type = "s" if i % 7 == 0 else "a"
+            block_no = 47600 + i if as_type == "s" else prec_index * 100 + i
+            stations[f"地点{prec_index:02d}_{i:02d}"] = AmedasStation(as_type, 11 + prec_index, block_no, i % 13 != 0, i % 3 != 2, 128.0 + prec_index * 0.3 + i * 0.01, 26.0 + prec_index * 0.4 + i * 0.01)
+        data[f"県{prec_index:02d}"] = stations
+    return data
+
+
+def setup_station_json_save(work_dir: str) -> Callable[[], object]:
+    from japanmeteorologicalagency import AmedasStationJson
+
+    data = _get_synthetic_stations()
+    path = os.path.join(work_dir, "prec_block.json")
+    return lambda: AmedasStationJson.save_to_json(data, path)
+
+
+def setup_station_json_load(work_dir: str) -> Callable[[], object]:
+    from japanmeteorologicalagency import AmedasStationJson
+
+    path = os.path.join(work_dir, "prec_block.json")
+    AmedasStationJson.save_to_json(_get_synthetic_stations(), path)
+    return lambda: AmedasStationJson.load_from_json(path)
+
+
+def setup_station_binary_load(work_dir: str) -> Callable[[], object]:
+    from japanmeteorologicalagency import AmedasStationBinary
+
+    path = os.path.join(work_dir, "prec_block.bin")
+    AmedasStationBinary.save(_get_synthetic_stations(), path)
+    return lambda: AmedasStationBinary.load(path)
+
+
+def setup_boundary_build(work_dir: str) -> Callable[[], object]:
+    from japanmlitnlftp import AdministrativeDivision
+    from boundarycache import BoundaryCache
+
+    division = AdministrativeDivision("愛知県", os.path.join(FIXTURE_DIR, "shp", "N03-20240101_23.shp"))
+
+    def run():
+        gpkg_path = os.path.join(work_dir, "boundary.gpkg")
+        if os.path.exists(gpkg_path):
+            os.remove(gpkg_path)
+        return BoundaryCache(work_dir).build(division)
+
+    return run
+
+
+def _get_converted_geotiff_paths(work_dir: str) -> tuple[str, str]:
+    from hdf5togeotiff import GcomHdf5
+
+    hdf5_path = ensure_hdf5(work_dir)
+    if len(hdf5_path) == 0:
+        raise Exception("h5py is required for the synthetic hdf5")
+
+    lst_path = os.path.join(work_dir, "sample_LST.tif")
+    qa_flag_path = os.path.join(work_dir, "sample_QA_flag.tif")
+    gcom_hdf5 = GcomHdf5(hdf5_path)
+    gcom_hdf5.get_sub_image_path("Image_data/LST", lst_path)
+    gcom_hdf5.get_sub_image_path("Image_data/QA_flag", qa_flag_path)
+    return lst_path, qa_flag_path
+
+
+def setup_hdf5_convert(work_dir: str) -> Callable[[], object]:
+    from hdf5togeotiff import GcomHdf5
+
+    hdf5_path = ensure_hdf5(work_dir)
+    if len(hdf5_path) == 0:
+        raise Exception("h5py is required for the synthetic hdf5")
+    output_path = os.path.join(work_dir, "convert_LST.tif")
+
+    def run():
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        return GcomHdf5(hdf5_path).get_sub_image_path("Image_data/LST", output_path)
+
+    return run
+
+
+def setup_point_sampling(work_dir: str) -> Callable[[], object]:
+    from qgiswrapper import QGisWrapper
+    from qgis.core import QgsPointXY
+
+    lst_path, qa_flag_path = _get_converted_geotiff_paths(work_dir)
+    qgis_wrapper = QGisWrapper()
+    lst_index = qgis_wrapper.add_geotiff(lst_path)
+    qa_flag_index = qgis_wrapper.add_geotiff(qa_flag_path)
+
+    # 20 x 20 points over aichi
+    points = [QgsPointXY(136.7 + i * 0.05, 34.6 + j * 0.05) for i in range(20) for j in range(20)]
+
+    def run():
+        # keeps the wrapper alive as long as the case
+        return [(qgis_wrapper.get_geotiff_layer_value(point, lst_index), qgis_wrapper.get_geotiff_layer_value(point, qa_flag_index)) for point in points]
+
+    return run
+
+
+def setup_qa_decode(work_dir: str) -> Callable[[], object]:
+    import numpy as np
+    from lstqaflag import decode, get_usable_mask, LST_QA_FLAG_NAMES
+
+    # one tile of random flags
+    rng = np.random.default_rng(0)
+    qa_flag_values = rng.integers(0, 1 << 14, (1200, 1200)).astype(np.float32)
+    policy = ["no input data", "Probably Cloudy", "Cloudy", "Sensor zenith angle > 43"]
+    return lambda: (decode(qa_flag_values, list(LST_QA_FLAG_NAMES.keys())), get_usable_mask(qa_flag_values, policy))
+
+
+CASES = [
+    BenchmarkCase("csw_parse", ["selenium", "requests"], setup_csw_parse),
+    BenchmarkCase("jma_table_parse", ["bs4", "numpy", "requests"], setup_jma_table_parse),
+    BenchmarkCase("mlit_index_parse", ["bs4", "requests"], setup_mlit_index_parse),
+    BenchmarkCase("mlit_n03_parse", ["bs4", "requests"], setup_mlit_n03_parse),
+    BenchmarkCase("station_json_save", ["bs4", "numpy", "requests"], setup_station_json_save, 5),
+    BenchmarkCase("station_json_load", ["bs4", "numpy", "requests"], setup_station_json_load, 5),
+    BenchmarkCase("station_binary_load", ["bs4", "numpy", "requests"], setup_station_binary_load),
+    BenchmarkCase("boundary_build", ["osgeo", "bs4", "requests"], setup_boundary_build, 5),
+    BenchmarkCase("hdf5_convert", ["osgeo", "h5py", "numpy"], setup_hdf5_convert, 3),
+    BenchmarkCase("point_sampling", ["qgis", "osgeo", "h5py", "numpy"], setup_point_sampling, 5),
+    BenchmarkCase("qa_decode", ["numpy"], setup_qa_decode, 5),
+]
+
+
+def measure(func: Callable[[], object], repeat: int) -> float:
+    # median seconds, after one warm up run
+    func()
+    elapsed: list[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed.append(time.perf_counter() - start)
+    elapsed.sort()
+    return elapsed[len(elapsed) // 2]
+
+
+def run_cases(cases: list[BenchmarkCase], repeat_scale: float = 1.0) -> dict[str, float]:
+    # {name: seconds}, skipped and failed cases are left out
+    results: dict[str, float] = {}
+    for case in cases:
+        missing = [module for module in case.requires if importlib.util.find_spec(module) is None]
+        if len(missing) > 0:
+            print(f"{case.name:<20} skipped, not installed: {', '.join(missing)}")
+            continue
+
+        work_dir = tempfile.mkdtemp(prefix="benchmark_")
+        try:
+            func = case.setup(work_dir)
+            results[case.name] = measure(func, max(1, int(case.repeat * repeat_scale)))
+            print(f"{case.name:<20} {results[case.name] * 1000:10.3f} ms")
+        except Exception as e:
+            print(f"{case.name:<20} failed: {e}")
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return results
+
+
+def load_baseline(path: str) -> dict[str, float]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_baseline(path: str, results: dict[str, float]) -> None:
+    # cases not run this time keep their baseline
+    baseline = load_baseline(path)
+    baseline.update(results)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(baseline, f, indent=4, sort_keys=True)
+
+
+def compare(results: dict[str, float], baseline: dict[str, float], threshold: float) -> list[str]:
+    # names of cases slower than baseline * (1 + threshold)
+    regressions: list[str] = []
+    print("")
+    for name, seconds in results.items():
+        if not name in baseline:
+            print(f"{name:<20} no baseline")
+            continue
+
+        ratio = seconds / baseline[name] if baseline[name] > 0 else float("inf")
+        status = "REGRESSION" if ratio > 1 + threshold else "ok"
+        print(f"{name:<20} {ratio:6.2f}x baseline  {status}")
+        if status != "ok":
+            regressions.append(name)
+
+    return regressions
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="offline benchmarks on recorded fixtures")
+    parser.add_argument("--filter", default="", help="run cases whose name contains this")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown against the baseline, 0.2 is 20%%")
+    parser.add_argument("--repeat-scale", type=float, default=1.0, help="multiplier of the repeat count of every case")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline json path")
+    parser.add_argument("--update-baseline", action="store_true", help="store the results as the new baseline")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    cases = [case for case in CASES if args.filter in case.name]
+    results = run_cases(cases, args.repeat_scale)
+
+    if args.update_baseline:
+        save_baseline(args.baseline, results)
+        print("baseline updated: " + args.baseline)
+        return 0
+
+    regressions = compare(results, load_baseline(args.baseline), args.threshold)
+    return 1 if len(regressions) > 0 else 0
@@ -0,0 +1,239 @@
+import os
+from osgeo import ogr, osr
+
+from japanmlitnlftp import AdministrativeDivision
+
+
+class BoundaryCache:
+    # dissolved prefecture and municipality boundaries at several simplification tolerances
+    # in one geopackage, each layer has an rtree spatial index
+
+    # degree, 0.0 is the original geometry
+    default_tolerances = [0.0, 0.0005, 0.002, 0.01]
+
+    def __init__(self, workspace_dir: str, tolerances: list[float] = None) -> None:
+        self._gpkg_path = os.path.join(workspace_dir, "boundary.gpkg")
+        self._tolerances = sorted(tolerances if tolerances is not None else self.default_tolerances)
+
+    def _get_layer_name(self, level: str, tolerance: float) -> str:
+        # "prefecture" or "municipality"
+        return f"{level}_{tolerance:g}".replace(".", "_")
+
+    def _open(self, update: bool) -> ogr.DataSource:
+        if not os.path.exists(self._gpkg_path):
+            if not update:
+                return None
+            driver: ogr.Driver = ogr.GetDriverByName("GPKG")
+            return driver.CreateDataSource(self._gpkg_path)
+
+        return ogr.Open(self._gpkg_path, 1 if update else 0)
+
+    def _get_or_create_layer(self, data_source: ogr.DataSource, layer_name: str) -> ogr.Layer:
+        layer = data_source.GetLayerByName(layer_name)
+        if layer is not None:
+            return layer
+
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(6668)
+        layer = data_source.CreateLayer(layer_name, srs, ogr.wkbMultiPolygon, ["SPATIAL_INDEX=YES"])
+        layer.CreateField(ogr.FieldDefn("prec_name", ogr.OFTString))
+        layer.CreateField(ogr.FieldDefn("city_name", ogr.OFTString))
+        layer.CreateField(ogr.FieldDefn("city_code", ogr.OFTString))
+        return layer
+
+    def _union(self, geometries: list[ogr.Geometry]) -> ogr.Geometry:
+        collection = ogr.Geometry(ogr.wkbMultiPolygon)
+        for geometry in geometries:
+            if geometry.GetGeometryType() == ogr.wkbPolygon:
+                collection.AddGeometry(geometry)
+            else:
+                for i in range(geometry.GetGeometryCount()):
+                    collection.AddGeometry(geometry.GetGeometryRef(i))
+
+        union = collection.UnionCascaded()
+        if union is None:
+            # invalid rings in the source
+            union = collection.Buffer(0)
+        return ogr.ForceToMultiPolygon(union)
+
+    def _get_layer_names(self) -> list[str]:
+        return [self._get_layer_name(level, tolerance) for tolerance in self._tolerances for level in ["municipality", "prefecture"]]
+
+    def _has_rows(self, data_source: ogr.DataSource, layer_name: str, prec_name: str) -> bool:
+        layer = data_source.GetLayerByName(layer_name)
+        if layer is None:
+            return False
+
+        layer.SetAttributeFilter(f"prec_name = '{prec_name}'")
+        has_rows = layer.GetFeatureCount() > 0
+        layer.SetAttributeFilter(None)
+        return has_rows
+
+    def has_division(self, prec_name: str) -> bool:
+        # every level at every tolerance, a build may have been interrupted or tolerances added since
+        data_source = self._open(False)
+        if data_source is None:
+            return False
+
+        return all(self._has_rows(data_source, layer_name, prec_name) for layer_name in self._get_layer_names())
+
+    def build(self, division: AdministrativeDivision) -> bool:
+        # only layers without the prefecture are written
+
+        data_source = self._open(False)
+        if data_source is None:
+            missing_layer_names = set(self._get_layer_names())
+        else:
+            missing_layer_names = set(layer_name for layer_name in self._get_layer_names() if not self._has_rows(data_source, layer_name, division.prec_name))
+        data_source = None
+        if len(missing_layer_names) == 0:
+            return True
+
+        source = ogr.Open(division.shp_path)
+        if source is None:
+            print("failed to open: " + division.shp_path)
+            return False
+
+        # N03_003: county / city, N03_004: city / ward, N03_007: code
+        municipalities: dict[str, tuple[str, list[ogr.Geometry]]] = {}
+        source_layer: ogr.Layer = source.GetLayer(0)
+        for feature in source_layer:
+            geometry = feature.GetGeometryRef()
+            if geometry is None:
+                continue
+            code = feature.GetField("N03_007") or ""
+            city_name = "".join(feature.GetField(key) or "" for key in ["N03_003", "N03_004"])
+            municipalities.setdefault(code, (city_name, []))[1].append(geometry.Clone())
+
+        municipality_geometries: dict[str, tuple[str, ogr.Geometry]] = {}
+        for code, (city_name, geometries) in municipalities.items():
+            municipality_geometries[code] = (city_name, self._union(geometries))
+        prefecture_geometry = self._union([geometry for city_name, geometry in municipality_geometries.values()])
+
+        data_source = self._open(True)
+        for tolerance in self._tolerances:
+
+            def simplify(geometry: ogr.Geometry) -> ogr.Geometry:
+                if tolerance == 0.0:
+                    return geometry
+                return ogr.ForceToMultiPolygon(geometry.SimplifyPreserveTopology(tolerance))
+
+            # one transaction per layer, a layer holds all rows of the prefecture or none
+            layer_name = self._get_layer_name("municipality", tolerance)
+            if layer_name in missing_layer_names:
+                layer = self._get_or_create_layer(data_source, layer_name)
+                layer.StartTransaction()
+                for code, (city_name, geometry) in municipality_geometries.items():
+                    feature = ogr.Feature(layer.GetLayerDefn())
+                    feature.SetField("prec_name", division.prec_name)
+                    feature.SetField("city_name", city_name)
+                    feature.SetField("city_code", code)
+                    feature.SetGeometry(simplify(geometry))
+                    layer.CreateFeature(feature)
+                layer.CommitTransaction()
+
+            layer_name = self._get_layer_name("prefecture", tolerance)
+            if layer_name in missing_layer_names:
+                layer = self._get_or_create_layer(data_source, layer_name)
+                layer.StartTransaction()
+                feature = ogr.Feature(layer.GetLayerDefn())
+                feature.SetField("prec_name", division.prec_name)
+                feature.SetGeometry(simplify(prefecture_geometry))
+                layer.CreateFeature(feature)
+                layer.CommitTransaction()
+
+        data_source = None
+        return True
+
+    def get_tolerance(self, max_error: float) -> float:
+        # cheapest tolerance which is still accurate enough
+        tolerance = self._tolerances[0]
+        for candidate in self._tolerances:
+            if candidate <= max_error:
+                tolerance = candidate
+        return tolerance
+
+    def get_layer_uri(self, prec_name: str, level: str, tolerance: float) -> str:
+        # for QgsVectorLayer(uri, name, "ogr")
+        layer_name = self._get_layer_name(level, tolerance)
+        return f"{self._gpkg_path}|layername={layer_name}|subset=\"prec_name\" = '{prec_name}'"
+
+    def get_geometry(self, prec_name: str, tolerance: float) -> ogr.Geometry:
+        data_source = self._open(False)
+        if data_source is None:
+            return None
+
+        layer = data_source.GetLayerByName(self._get_layer_name("prefecture", tolerance))
+        if layer is None:
+            return None
+
+        layer.SetAttributeFilter(f"prec_name = '{prec_name}'")
+        feature = layer.GetNextFeature()
+        if feature is None:
+            return None
+        return feature.GetGeometryRef().Clone()
+
+    def get_extent(self, prec_name: str) -> tuple[float, float, float, float]:
+        # (lon_min, lat_min, lon_max, lat_max) of the original geometry
+        geometry = self.get_geometry(prec_name, self._tolerances[0])
+        if geometry is None:
+            return None
+
+        lon_min, lon_max, lat_min, lat_max = geometry.GetEnvelope()
+        return lon_min, lat_min, lon_max, lat_max
+
+    def find_municipality(self, lon: float, lat: float, tolerance: float) -> tuple[str, str]:
+        # (prec_name, city_name), None if outside
+        data_source = self._open(False)
+        if data_source is None:
+            return None
+
+        layer = data_source.GetLayerByName(self._get_layer_name("municipality", tolerance))
+        if layer is None:
+            return None
+
+        point = ogr.Geometry(ogr.wkbPoint)
+        point.AddPoint_2D(lon, lat)
+        layer.SetSpatialFilter(point)
+        for feature in layer:
+            if feature.GetGeometryRef().Contains(point):
+                return feature.GetField("prec_name"), feature.GetField("city_name")
+        return None
+
+    def contains_points(self, prec_name: str, points: list[tuple[float, float]], tolerance: float, margin: float = 0.0) -> list[bool]:
+        # (lon, lat) points within margin degrees of the prefecture, the geometry is read once
+        geometry = self.get_geometry(prec_name, tolerance)
+        if geometry is None:
+            return [False] * len(points)
+
+        results: list[bool] = []
+        for lon, lat in points:
+            point = ogr.Geometry(ogr.wkbPoint)
+            point.AddPoint_2D(lon, lat)
+            # distance is 0 inside
+            results.append(geometry.Contains(point) or (margin > 0 and geometry.Distance(point) <= margin))
+        return results
+
+    def contains(self, prec_name: str, lon: float, lat: float, tolerance: float) -> bool:
+        geometry = self.get_geometry(prec_name, tolerance)
+        if geometry is None:
+            return False
+
+        point = ogr.Geometry(ogr.wkbPoint)
+        point.AddPoint_2D(lon, lat)
+        return geometry.Contains(point)
+
+
+def test():
+    from japanmlitnlftp import AdministrativeDivisionInfo
+
+    info = AdministrativeDivisionInfo("download", "workspace")
+    division = info.get_administrative_division("愛知県")
+
+    cache = BoundaryCache("workspace")
+    print(cache.build(division))
+    print(cache.get_extent("愛知県"))
+    print(cache.find_municipality(136.8855, 35.1077, cache.get_tolerance(0.001)))  # minato, nagoya
+
+
+# test()
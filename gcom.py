@@ -1,13 +1,26 @@
-import os, requests, time, json
+import os, time, json
 from urllib.parse import urlencode
 from datetime import datetime, timezone, timedelta
+from dataclasses import dataclass
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 
+from httpclient import http_client
+
+GPORTAL_BASE_URL = "https://gportal.jaxa.jp"
+
+
+@dataclass
+class GranuleFootprint:
+    url: str
+    begin_position: datetime  # utc
+    end_position: datetime
+    rings: list[list[tuple[float, float]]]  # (lon, lat), exterior ring of each polygon, empty if unknown
+
 
 class CSWWrapper:
-    def __init__(self) -> None:
-        self._base_url = "https://gportal.jaxa.jp/csw/csw"
+    def __init__(self, base_url: str = GPORTAL_BASE_URL) -> None:
+        self._base_url = base_url + "/csw/csw"
 
     def _create_query_url(self, dataset_id: str, start_time: str, end_time: str, bbox: str):
 
@@ -26,7 +39,7 @@ class CSWWrapper:
         return full_url
 
     def _fetch_data(self, url) -> json:
-        response = requests.get(url)
+        response = http_client.get(url)
         if response.status_code == 200:
             return response.json()
         else:
@@ -51,16 +64,19 @@ class CSWWrapper:
         return intervals
 
     def get_hdf5_urls(self, dataset_id: str, utc_start: datetime, utc_end: datetime, bbox: list[float]) -> list[str]:
+        return [footprint.url for footprint in self.get_hdf5_footprints(dataset_id, utc_start, utc_end, bbox)]
+
+    def get_hdf5_footprints(self, dataset_id: str, utc_start: datetime, utc_end: datetime, bbox: list[float]) -> list[GranuleFootprint]:
 
         if len(bbox) != 4:
             print("error: bbox is [left-down lon, left-down, lat, right-up lon, right-up lat]")
-            return ""
+            return []
 
         # intervals
         intervals = self._split_intervals(utc_start, utc_end, 3)
 
         # query by intervals
-        h5_urls: list[str] = []
+        footprints: list[GranuleFootprint] = []
         for start, end in intervals:
             # query
             start_str = self._get_string_from_date(start)
@@ -72,16 +88,38 @@ class CSWWrapper:
             data = self._fetch_data(url)
 
             # parse
-            for feature in data["features"]:
-                h5_url = feature["properties"]["product"]["fileName"]
-                h5_urls.append(h5_url)
-
-        return h5_urls
+            footprints.extend(self._parse_hdf5_footprints(data))
+
+        return footprints
+
+    def _parse_hdf5_footprints(self, data: dict) -> list[GranuleFootprint]:
+        footprints: list[GranuleFootprint] = []
+        for feature in data["features"]:
+            properties = feature["properties"]
+            geometry = feature.get("geometry") or {}
+            # exterior rings only, holes do not occur in scene footprints
+            if geometry.get("type") == "Polygon":
+                polygons = [geometry["coordinates"]]
+            elif geometry.get("type") == "MultiPolygon":
+                polygons = geometry["coordinates"]
+            else:
+                polygons = []
+            rings = [[(point[0], point[1]) for point in polygon[0]] for polygon in polygons]
+
+            footprints.append(
+                GranuleFootprint(
+                    properties["product"]["fileName"],
+                    self._get_date_from_string(properties["beginPosition"]),
+                    self._get_date_from_string(properties["endPosition"]),
+                    rings,
+                )
+            )
+        return footprints
 
 
 class JPortalLogin:
-    def __init__(self) -> None:
-        self._login_url = "https://gportal.jaxa.jp/gpr/auth?"
+    def __init__(self, base_url: str = GPORTAL_BASE_URL) -> None:
+        self._login_url = base_url + "/gpr/auth?"
 
     def login(self, driver: webdriver.Chrome, username: str, password: str) -> bool:
 
@@ -126,7 +164,7 @@ def test():
 
 # test()
 
-from seleniumchrome import SeleniumChromeWrapper
+from seleniumchrome import SeleniumChromeWrapper, CHROME_LABS_URL
 
 
 class GcomDownloader:
@@ -137,11 +175,13 @@ class GcomDownloader:
         workspace_dir: str,
         username: str,
         password: str,
+        base_url: str = GPORTAL_BASE_URL,
+        chrome_labs_url: str = CHROME_LABS_URL,
     ) -> None:
-        self._selenium = SeleniumChromeWrapper(download_dir, workspace_dir)
+        self._selenium = SeleniumChromeWrapper(download_dir, workspace_dir, chrome_labs_url)
         self._driver = self._selenium.get_driver()
 
-        login = JPortalLogin()
+        login = JPortalLogin(base_url)
         if not login.login(self._driver, username, password):
             print("failed to login to jportal")
 
@@ -0,0 +1,105 @@
+import re, math
+from datetime import date
+
+# GCOM-C L2 tiles: 18 x 36 tiles of 10 x 10 degrees in the sinusoidal grid (x = lon * cos(lat))
+#   v = floor((90 - lat) / 10), h = floor((lon * cos(lat) + 180) / 10)
+# the tile is "Tvvhh" in the file names, nagoya is T0529:
+#   GC1SG1_20240801A01D_T0529_L2SG_LST_Q_3000.h5
+# scene products have no tile in the name, filters keep them
+
+TILE_PATTERN = re.compile(r"_T(\d{2})(\d{2})_")
+
+NUMBER_OF_V_TILES = 18
+NUMBER_OF_H_TILES = 36
+TILE_DEGREE = 10.0
+
+
+def get_tile_id(lon: float, lat: float) -> str:
+    # "vvhh"
+    v = min(int(math.floor((90.0 - lat) / TILE_DEGREE)), NUMBER_OF_V_TILES - 1)
+    h = min(int(math.floor((lon * math.cos(math.radians(lat)) + 180.0) / TILE_DEGREE)), NUMBER_OF_H_TILES - 1)
+    return f"{max(v, 0):02d}{max(h, 0):02d}"
+
+
+def get_tile_ids_from_points(points: list[tuple[float, float]]) -> list[str]:
+    # (lon, lat)
+    return sorted(set(get_tile_id(lon, lat) for lon, lat in points))
+
+
+def _contains(rings: list[list[tuple[float, float]]], lon: float, lat: float) -> bool:
+    # even-odd rule over all rings, holes included
+    inside = False
+    for ring in rings:
+        for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]):
+            if (y0 > lat) != (y1 > lat) and lon < x0 + (lat - y0) * (x1 - x0) / (y1 - y0):
+                inside = not inside
+    return inside
+
+
+def get_tile_ids_from_rings(rings: list[list[tuple[float, float]]], step: float = 0.05) -> list[str]:
+    # tiles touched by the boundary, sampled every step degrees, and tiles whose center is inside
+    tile_ids: set[str] = set()
+    for ring in rings:
+        for (lon0, lat0), (lon1, lat1) in zip(ring, ring[1:] + ring[:1]):
+            count = max(1, int(math.ceil(max(abs(lon1 - lon0), abs(lat1 - lat0)) / step)))
+            for i in range(count + 1):
+                t = i / count
+                tile_ids.add(get_tile_id(lon0 + (lon1 - lon0) * t, lat0 + (lat1 - lat0) * t))
+
+    # polygons larger than a tile
+    for v in range(NUMBER_OF_V_TILES):
+        lat = 90.0 - (v + 0.5) * TILE_DEGREE
+        for h in range(NUMBER_OF_H_TILES):
+            lon = ((h + 0.5) * TILE_DEGREE - 180.0) / math.cos(math.radians(lat))
+            if -180.0 <= lon <= 180.0 and _contains(rings, lon, lat):
+                tile_ids.add(f"{v:02d}{h:02d}")
+
+    return sorted(tile_ids)
+
+
+def get_tile_id_from_filename(filename: str) -> str:
+    # "vvhh", None for scene products
+    match = TILE_PATTERN.search(filename)
+    if match is None:
+        return None
+    return match.group(1) + match.group(2)
+
+
+def filter_by_tiles(urls: list[str], tile_ids: list[str]) -> list[str]:
+    # urls or file names, names without a tile are kept
+    tile_id_set = set(tile_ids)
+    kept: list[str] = []
+    for url in urls:
+        tile_id = get_tile_id_from_filename(url.split("/")[-1])
+        if tile_id is None or tile_id in tile_id_set:
+            kept.append(url)
+    return kept
+
+
+def get_expected_granule_name(day: date, tile_id: str, orbit: str = "D", product: str = "L2SG_LST_Q", version: str = "3000", period: str = "01D") -> str:
+    # orbit "D" is the daytime (descending) pass, "A" the nighttime one
+    return f"GC1SG1_{day:%Y%m%d}{orbit}{period}_T{tile_id}_{product}_{version}.h5"
+
+
+def get_expected_granule_urls(directory_url: str, days: list[date], tile_ids: list[str], **kwargs) -> list[str]:
+    # directory_url like https://gportal.jaxa.jp/download/standard/GCOM-C/GCOM-C.SGLI/L2.LAND.LST/3
+    # kwargs go to get_expected_granule_name
+    urls: list[str] = []
+    for day in days:
+        for tile_id in tile_ids:
+            urls.append(f"{directory_url}/{day:%Y/%m/%d}/{get_expected_granule_name(day, tile_id, **kwargs)}")
+    return urls
+
+
+def test():
+    nagoya = (136.965, 35.166)
+    print(get_tile_id(*nagoya))
+
+    # rough aichi
+    aichi = [[(136.67, 34.58), (137.84, 34.58), (137.84, 35.42), (136.67, 35.42)]]
+    tile_ids = get_tile_ids_from_rings(aichi)
+    print(tile_ids)
+    print(get_expected_granule_urls("https://gportal.jaxa.jp/download/standard/GCOM-C/GCOM-C.SGLI/L2.LAND.LST/3", [date(2024, 8, 1)], tile_ids))
+
+
+# test()
@@ -0,0 +1,87 @@
+import math
+from osgeo import ogr
+
+from gcom import GranuleFootprint
+from instrumentation import metrics
+
+# granules are kept only if their footprint covers the targets, before download and conversion
+# footprints of GCOM-C tiles have the 4 corners only, but the tile edges are straight lines
+# in the sinusoidal grid (x = lon * cos(lat)), not in lon / lat, e.g. the west edge of T0529
+# is 1 degree west of the corner to corner line at 35N. edges are densified in that grid
+
+
+def _densify_ring(ring: list[tuple[float, float]], points_per_edge: int) -> list[tuple[float, float]]:
+    densified: list[tuple[float, float]] = []
+    for (lon0, lat0), (lon1, lat1) in zip(ring[:-1], ring[1:]):
+        x0 = lon0 * math.cos(math.radians(lat0))
+        x1 = lon1 * math.cos(math.radians(lat1))
+        for i in range(points_per_edge):
+            t = i / points_per_edge
+            lat = lat0 + (lat1 - lat0) * t
+            x = x0 + (x1 - x0) * t
+            densified.append((x / math.cos(math.radians(lat)), lat))
+    densified.append(ring[-1])
+    return densified
+
+
+def get_footprint_geometry(footprint: GranuleFootprint, points_per_edge: int = 16) -> ogr.Geometry:
+    # multipolygon in lon / lat, None if the footprint is unknown
+    if len(footprint.rings) == 0:
+        return None
+
+    geometry = ogr.Geometry(ogr.wkbMultiPolygon)
+    for ring in footprint.rings:
+        if len(ring) < 4:
+            continue
+        if ring[0] != ring[-1]:
+            ring = ring + [ring[0]]
+
+        ogr_ring = ogr.Geometry(ogr.wkbLinearRing)
+        for lon, lat in _densify_ring(ring, points_per_edge):
+            ogr_ring.AddPoint_2D(lon, lat)
+        polygon = ogr.Geometry(ogr.wkbPolygon)
+        polygon.AddGeometry(ogr_ring)
+        geometry.AddGeometry(polygon)
+
+    return geometry if geometry.GetGeometryCount() > 0 else None
+
+
+def get_points_geometry(points: list[tuple[float, float]]) -> ogr.Geometry:
+    # (lon, lat)
+    geometry = ogr.Geometry(ogr.wkbMultiPoint)
+    for lon, lat in points:
+        point = ogr.Geometry(ogr.wkbPoint)
+        point.AddPoint_2D(lon, lat)
+        geometry.AddGeometry(point)
+    return geometry
+
+
+def filter_footprints(footprints: list[GranuleFootprint], target: ogr.Geometry, margin: float = 0.01) -> list[GranuleFootprint]:
+    # footprints intersecting the target grown by margin degrees, unknown footprints are kept
+    if margin > 0:
+        target = target.Buffer(margin)
+
+    kept: list[GranuleFootprint] = []
+    for footprint in footprints:
+        geometry = get_footprint_geometry(footprint)
+        if geometry is None or geometry.Intersects(target):
+            kept.append(footprint)
+
+    metrics.count("granules_skipped", len(footprints) - len(kept), reason="footprint")
+    return kept
+
+
+def test():
+    from datetime import datetime
+
+    # T0529 and a station near its west edge, outside the corner to corner polygon
+    footprint = GranuleFootprint(
+        "GC1SG1_20240101D01D_T0529_L2SG_LST_Q_3000.h5",
+        datetime(2024, 1, 1, 2, 26),
+        datetime(2024, 1, 1, 2, 28),
+        [[(127.017, 30.0), (138.564, 30.0), (156.649, 40.0), (143.595, 40.0), (127.017, 30.0)]],
+    )
+    print(filter_footprints([footprint], get_points_geometry([(134.8, 35.0)])))
+
+
+# test()
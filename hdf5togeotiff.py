@@ -1,7 +1,9 @@
-import os, math
+import os, math, threading
 from datetime import datetime, timezone, timedelta
 from osgeo import gdal
 
+from instrumentation import metrics
+
 
 class GcomHdf5:
 
@@ -48,7 +50,8 @@ class GcomHdf5:
         if not os.path.exists(path):
             raise Exception("file not found")
 
-        self._dataset: gdal.Dataset = gdal.Open(path)
+        with metrics.span("gdal_open"):
+            self._dataset: gdal.Dataset = gdal.Open(path)
         metadata = self._dataset.GetMetadata()
         self._rect = self._get_rect(metadata)
 
@@ -58,6 +61,7 @@ class GcomHdf5:
 
     def get_sub_image_path(self, sub_key: str, output_geotiff_path: str) -> bool:
 
+        metrics.cache("geotiff", os.path.exists(output_geotiff_path))
         if os.path.exists(output_geotiff_path):
             print("geotiff already exists: ", output_geotiff_path)
             return True
@@ -73,25 +77,42 @@ class GcomHdf5:
             print("couldn't find sub_key: ", sub_key)
             return False
 
-        # translate to 53008
-        gdal.Translate(
-            "temp.tif",
-            target_sub_dataset_name,
-            format="GTiff",
-            outputSRS="ESRI:53008",
-            outputBounds=self._rect,
-            noData=65535,
-            creationOptions=["COMPRESS=LZW"],
-        )
-
-        # warp to 6668
-        gdal.Warp(
-            output_geotiff_path,
-            "temp.tif",
-            dstSRS="EPSG:6668",
-        )
-
-        os.remove("temp.tif")
+        # translate to 53008 and warp into temporary files unique per process and thread,
+        # the output only appears by the final rename, so an existing output is always complete
+        temp_prefix = f"{output_geotiff_path}.{os.getpid()}_{threading.get_ident()}"
+        translate_path = temp_prefix + ".translate.tif"
+        warp_path = temp_prefix + ".warp.tif"
+        item = os.path.basename(output_geotiff_path)
+        try:
+            with metrics.span("gdal_translate", item=item):
+                gdal.Translate(
+                    translate_path,
+                    target_sub_dataset_name,
+                    format="GTiff",
+                    outputSRS="ESRI:53008",
+                    outputBounds=self._rect,
+                    noData=65535,
+                    creationOptions=["COMPRESS=LZW"],
+                )
+
+            # warp to 6668
+            with metrics.span("gdal_warp", item=item):
+                warped = gdal.Warp(
+                    warp_path,
+                    translate_path,
+                    dstSRS="EPSG:6668",
+                )
+            if warped is None:
+                print("failed to warp: ", output_geotiff_path)
+                return False
+            # flush and close before the rename
+            warped = None
+
+            os.replace(warp_path, output_geotiff_path)
+        finally:
+            for path in [translate_path, warp_path]:
+                if os.path.exists(path):
+                    os.remove(path)
 
         return True
 
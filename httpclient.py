@@ -0,0 +1,193 @@
+import os, time, random, threading
+from dataclasses import dataclass
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from instrumentation import metrics, get_host
+
+# one keep-alive session per process shared by the fetchers
+# - timeouts on every request, a hung socket fails instead of stalling the run
+# - retry with jittered exponential backoff on connection errors and 429 / 5xx, Retry-After is honored
+# - per host caps: concurrent requests and minimum interval between request starts,
+#   worker processes each have a client, divide_host_policies() splits the caps between them
+# the final response is returned as is, callers keep checking status_code
+
+
+@dataclass
+class HostPolicy:
+    max_concurrency: int = 4
+    min_interval: float = 0.0  # seconds between request starts
+
+
+# polite defaults for the scraped sites
+HOST_POLICIES = {
+    "www.data.jma.go.jp": HostPolicy(4, 0.5),
+    "nlftp.mlit.go.jp": HostPolicy(2, 0.5),
+    "gportal.jaxa.jp": HostPolicy(4, 0.0),
+}
+
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+
+class _HostLimiter:
+    def __init__(self, policy: HostPolicy) -> None:
+        self._policy = policy
+        self._semaphore = threading.BoundedSemaphore(policy.max_concurrency)
+        self._lock = threading.Lock()
+        self._next_time = 0.0
+
+    def get_policy(self) -> HostPolicy:
+        return self._policy
+
+    def __enter__(self) -> "_HostLimiter":
+        self._semaphore.acquire()
+        with self._lock:
+            now = time.monotonic()
+            wait_time = self._next_time - now
+            self._next_time = max(now, self._next_time) + self._policy.min_interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self._semaphore.release()
+
+
+class HttpClient:
+    def __init__(
+        self,
+        connect_timeout: float = 10.0,
+        read_timeout: float = 60.0,
+        max_retries: int = 3,
+        backoff_seconds: float = 1.0,
+        max_backoff_seconds: float = 30.0,
+        pool_size: int = 16,
+    ) -> None:
+        self._timeout = (connect_timeout, read_timeout)
+        self._max_retries = max_retries
+        self._backoff_seconds = backoff_seconds
+        self._max_backoff_seconds = max_backoff_seconds
+        self._pool_size = pool_size
+
+        self._lock = threading.Lock()
+        self._session: requests.Session = None
+        self._session_pid = 0
+        self._policies: dict[str, HostPolicy] = dict(HOST_POLICIES)
+        self._default_policy = HostPolicy()
+        self._limiters: dict[str, _HostLimiter] = {}
+
+    def _get_session(self) -> requests.Session:
+        # sessions are not shared with forked workers
+        with self._lock:
+            if self._session is None or self._session_pid != os.getpid():
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=self._pool_size, pool_maxsize=self._pool_size)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+                self._session_pid = os.getpid()
+            return self._session
+
+    def _get_limiter(self, host: str) -> _HostLimiter:
+        with self._lock:
+            limiter = self._limiters.get(host)
+            if limiter is None:
+                limiter = _HostLimiter(self._policies.get(host, self._default_policy))
+                self._limiters[host] = limiter
+            return limiter
+
+    def set_host_policy(self, host: str, policy: HostPolicy) -> None:
+        # host is the netloc, e.g. get_host(base_url), set before requests start, threads in flight keep the old limiter
+        with self._lock:
+            self._policies[host] = policy
+            limiter = self._limiters.get(host)
+            if limiter is None or limiter.get_policy() != policy:
+                self._limiters[host] = _HostLimiter(policy)
+
+    def divide_host_policies(self, divisor: int) -> None:
+        # this client is one of divisor processes, the request rate of all of them together stays as configured,
+        # concurrency is at least 1 per process
+        def divide(policy: HostPolicy) -> HostPolicy:
+            return HostPolicy(max(1, policy.max_concurrency // divisor), policy.min_interval * divisor)
+
+        with self._lock:
+            self._policies = {host: divide(policy) for host, policy in self._policies.items()}
+            self._default_policy = divide(self._default_policy)
+            self._limiters = {}
+
+    def _get_backoff(self, attempt: int, response: requests.Response) -> float:
+        retry_after = response.headers.get("Retry-After", "") if response is not None else ""
+        if retry_after.isdigit():
+            return min(float(retry_after), self._max_backoff_seconds)
+
+        # full jitter
+        return random.uniform(0, min(self._max_backoff_seconds, self._backoff_seconds * 2**attempt))
+
+    def get(self, url: str, stream: bool = False, **kwargs) -> requests.Response:
+        # kwargs go to requests, e.g. params or headers
+        host = get_host(url)
+        limiter = self._get_limiter(host)
+        session = self._get_session()
+
+        for attempt in range(self._max_retries + 1):
+            response = None
+            try:
+                with limiter:
+                    with metrics.span("http_get", host=host):
+                        response = session.get(url, timeout=self._timeout, stream=stream, **kwargs)
+                        if not stream:
+                            # the body is read inside the timeout and the host cap too
+                            response.content
+            except (requests.ConnectionError, requests.Timeout) as e:
+                metrics.count("http_errors", 1, host=host, error=type(e).__name__)
+                if attempt == self._max_retries:
+                    raise
+
+            if response is not None:
+                metrics.http(url, response.status_code, 0 if stream else len(response.content))
+                if not response.status_code in RETRY_STATUS_CODES or attempt == self._max_retries:
+                    return response
+                response.close()
+
+            metrics.count("http_retries", 1, host=host)
+            time.sleep(self._get_backoff(attempt, response))
+
+    def download(self, url: str, save_path: str, chunk_size: int = 1024 * 1024) -> bool:
+        # streamed to a temp file, save_path only appears when complete
+        response = self.get(url, stream=True)
+        if response.status_code != 200:
+            response.close()
+            return False
+
+        # unique per process and thread, workers share the download directory
+        temp_path = f"{save_path}.{os.getpid()}_{threading.get_ident()}.part"
+        num_bytes = 0
+        try:
+            with open(temp_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size):
+                    f.write(chunk)
+                    num_bytes += len(chunk)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        finally:
+            response.close()
+        os.replace(temp_path, save_path)
+
+        metrics.count("http_bytes", num_bytes, host=get_host(url))
+        return True
+
+
+http_client = HttpClient()
+
+
+def test():
+    http_client.set_host_policy("www.data.jma.go.jp", HostPolicy(2, 1.0))
+    response = http_client.get("https://www.data.jma.go.jp/obd/stats/etrn/select/prefecture00.php")
+    print(response.status_code, len(response.content))
+    print(metrics.to_prometheus())
+
+
+# test()
@@ -0,0 +1,193 @@
+import os, json, time, threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+# process wide metrics, cheap enough to stay on in every run
+# - counters: count("name", value, label=...) e.g. bytes downloaded, cache hits
+# - spans: with span("name", label=...) summarizes durations per name and labels,
+#          each span is also kept as an item (start, seconds) up to max_items
+# worker processes send get_snapshot(reset=True) back to the parent which merge()s it
+
+
+def get_host(url: str) -> str:
+    return urlparse(url).netloc
+
+
+def _get_key(name: str, labels: dict[str, str]) -> tuple:
+    return (name,) + tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Metrics:
+    def __init__(self, max_items: int = 100000) -> None:
+        self._lock = threading.Lock()
+        self._max_items = max_items
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters: dict[tuple, float] = {}
+            # key -> [count, total seconds, max seconds]
+            self._spans: dict[tuple, list[float]] = {}
+            # (name, labels, start unix time, seconds)
+            self._items: list[tuple[str, dict[str, str], float, float]] = []
+            self._dropped_items = 0
+            self._started_at = time.time()
+
+    def count(self, name: str, value: float = 1, **labels) -> None:
+        key = _get_key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, start: float = None, item: str = None, **labels) -> None:
+        # item names one unit of work (a file, a day), it is kept in the items only
+        key = _get_key(name, labels)
+        with self._lock:
+            stats = self._spans.get(key)
+            if stats is None:
+                self._spans[key] = [1, seconds, seconds]
+            else:
+                stats[0] += 1
+                stats[1] += seconds
+                stats[2] = max(stats[2], seconds)
+
+            if item is not None:
+                if len(self._items) < self._max_items:
+                    item_labels = {key: str(value) for key, value in labels.items()}
+                    item_labels["item"] = item
+                    self._items.append((name, item_labels, start if start is not None else time.time() - seconds, seconds))
+                else:
+                    self._dropped_items += 1
+
+    @contextmanager
+    def span(self, name: str, item: str = None, **labels):
+        start = time.time()
+        start_counter = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start_counter, start, item, **labels)
+
+    def cache(self, cache_name: str, hit: bool) -> None:
+        self.count("cache_hits" if hit else "cache_misses", 1, cache=cache_name)
+
+    def http(self, url: str, status_code: int, num_bytes: int) -> None:
+        host = get_host(url)
+        self.count("http_requests", 1, host=host, status=status_code)
+        self.count("http_bytes", num_bytes, host=host)
+
+    def get_snapshot(self, reset: bool = False) -> dict:
+        # json serializable
+        with self._lock:
+            snapshot = {
+                "started_at": self._started_at,
+                "finished_at": time.time(),
+                "counters": [{"name": key[0], "labels": dict(key[1:]), "value": value} for key, value in self._counters.items()],
+                "spans": [
+                    {"name": key[0], "labels": dict(key[1:]), "count": stats[0], "total_seconds": stats[1], "max_seconds": stats[2]}
+                    for key, stats in self._spans.items()
+                ],
+                "items": [{"name": name, "labels": labels, "start": start, "seconds": seconds} for name, labels, start, seconds in self._items],
+                "dropped_items": self._dropped_items,
+            }
+        if reset:
+            self.reset()
+        return snapshot
+
+    def merge(self, snapshot: dict) -> None:
+        with self._lock:
+            self._started_at = min(self._started_at, snapshot["started_at"])
+            for counter in snapshot["counters"]:
+                key = _get_key(counter["name"], counter["labels"])
+                self._counters[key] = self._counters.get(key, 0) + counter["value"]
+            for span_stats in snapshot["spans"]:
+                key = _get_key(span_stats["name"], span_stats["labels"])
+                stats = self._spans.setdefault(key, [0, 0.0, 0.0])
+                stats[0] += span_stats["count"]
+                stats[1] += span_stats["total_seconds"]
+                stats[2] = max(stats[2], span_stats["max_seconds"])
+            for item in snapshot["items"]:
+                if len(self._items) < self._max_items:
+                    self._items.append((item["name"], item["labels"], item["start"], item["seconds"]))
+                else:
+                    self._dropped_items += 1
+            self._dropped_items += snapshot["dropped_items"]
+
+    def get_cache_hit_rates(self) -> dict[str, float]:
+        # {cache name: hit rate}
+        hits: dict[str, float] = {}
+        totals: dict[str, float] = {}
+        with self._lock:
+            for key, value in self._counters.items():
+                if key[0] in ["cache_hits", "cache_misses"]:
+                    cache_name = dict(key[1:])["cache"]
+                    totals[cache_name] = totals.get(cache_name, 0) + value
+                    if key[0] == "cache_hits":
+                        hits[cache_name] = hits.get(cache_name, 0) + value
+        return {cache_name: hits.get(cache_name, 0) / total for cache_name, total in totals.items() if total > 0}
+
+    def to_json(self) -> str:
+        snapshot = self.get_snapshot()
+        snapshot["cache_hit_rates"] = self.get_cache_hit_rates()
+        return json.dumps(snapshot, ensure_ascii=False, indent=1)
+
+    def to_prometheus(self, prefix: str = "jaxa_") -> str:
+        # text exposition format, items are left out
+
+        def format_labels(labels: dict[str, str]) -> str:
+            if len(labels) == 0:
+                return ""
+            escaped = [f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for key, value in sorted(labels.items())]
+            return "{" + ",".join(escaped) + "}"
+
+        snapshot = self.get_snapshot()
+        lines: list[str] = []
+
+        counter_names = sorted(set(counter["name"] for counter in snapshot["counters"]))
+        for name in counter_names:
+            lines.append(f"# TYPE {prefix}{name}_total counter")
+            for counter in snapshot["counters"]:
+                if counter["name"] == name:
+                    lines.append(f"{prefix}{name}_total{format_labels(counter['labels'])} {counter['value']:g}")
+
+        span_names = sorted(set(span_stats["name"] for span_stats in snapshot["spans"]))
+        for name in span_names:
+            lines.append(f"# TYPE {prefix}{name}_seconds summary")
+            for span_stats in snapshot["spans"]:
+                if span_stats["name"] == name:
+                    labels = format_labels(span_stats["labels"])
+                    lines.append(f"{prefix}{name}_seconds_count{labels} {span_stats['count']}")
+                    lines.append(f"{prefix}{name}_seconds_sum{labels} {span_stats['total_seconds']:.6f}")
+            lines.append(f"# TYPE {prefix}{name}_seconds_max gauge")
+            for span_stats in snapshot["spans"]:
+                if span_stats["name"] == name:
+                    lines.append(f"{prefix}{name}_seconds_max{format_labels(span_stats['labels'])} {span_stats['max_seconds']:.6f}")
+
+        return "\n".join(lines) + "\n"
+
+    def save(self, path: str) -> None:
+        # prometheus text for .prom / .txt, json otherwise
+        directory = os.path.dirname(path)
+        if len(directory) > 0:
+            os.makedirs(directory, exist_ok=True)
+
+        text = self.to_prometheus() if os.path.splitext(path)[1] in [".prom", ".txt"] else self.to_json()
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+metrics = Metrics()
+
+
+def test():
+    with metrics.span("stage", stage="download"):
+        for i in range(3):
+            with metrics.span("gdal_translate", item=f"granule_{i}.h5"):
+                time.sleep(0.01)
+            metrics.http("https://www.data.jma.go.jp/obd/stats/etrn/view/10min_s1.php", 200, 50000)
+            metrics.cache("amedas_daily", i > 0)
+
+    print(metrics.to_prometheus())
+    print(metrics.get_cache_hit_rates())
+
+
+# test()
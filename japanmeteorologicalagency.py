@@ -1,8 +1,19 @@
-import os, requests, json
-from datetime import datetime
+import os, re, json, sqlite3, zlib, struct, time, threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, date, timedelta, timezone
+from urllib.parse import urlparse, parse_qs
 from dataclasses import dataclass, asdict
 from bs4 import BeautifulSoup, element
 
+from instrumentation import metrics
+from rawcache import RawResponseCache
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
 
 @dataclass
 class AmedasStation:
@@ -62,8 +73,75 @@ class AmedasStationJson:
         return convert_to_dataclass(data)
 
 
+class AmedasStationBinary:
+    # header, fixed size records and "prec_name\tname\n" strings
+    # records are decoded in one pass into AmedasStation, the same type as the json and scraped catalogs
+    _magic = b"AMST"
+    _header_struct = struct.Struct("<4sHII")
+    _version = 1
+
+    # prec_no, block_no, flags (1: is_valid, 2: has_temperature), as_type, lon, lat
+    _record_struct = struct.Struct("<HIBcdd")
+
+    @staticmethod
+    def save(data: dict[str, dict[str, AmedasStation]], filename):
+        records = bytearray()
+        names: list[str] = []
+        for prec_name, blocks in data.items():
+            for name, station in blocks.items():
+                flags = (1 if station.is_valid else 0) | (2 if station.has_temperature else 0)
+                records += AmedasStationBinary._record_struct.pack(
+                    station.prec_no,
+                    station.block_no,
+                    flags,
+                    station.as_type.encode("ascii"),
+                    station.lon,
+                    station.lat,
+                )
+                names.append(prec_name + "\t" + name + "\n")
+
+        names_bytes = "".join(names).encode("utf-8")
+        header = AmedasStationBinary._header_struct.pack(AmedasStationBinary._magic, AmedasStationBinary._version, len(names), len(names_bytes))
+
+        temp_filename = filename + ".tmp"
+        with open(temp_filename, "wb") as f:
+            f.write(header)
+            f.write(records)
+            f.write(names_bytes)
+        os.replace(temp_filename, filename)
+
+    @staticmethod
+    def load(filename) -> dict[str, dict[str, AmedasStation]]:
+        with open(filename, "rb") as f:
+            buffer = f.read()
+
+        magic, version, count, names_len = AmedasStationBinary._header_struct.unpack_from(buffer, 0)
+        if magic != AmedasStationBinary._magic or version != AmedasStationBinary._version:
+            raise Exception("unsupported station binary: " + filename)
+
+        records_offset = AmedasStationBinary._header_struct.size
+        names_offset = records_offset + count * AmedasStationBinary._record_struct.size
+        lines = buffer[names_offset : names_offset + names_len].decode("utf-8").split("\n")
+        records = AmedasStationBinary._record_struct.iter_unpack(buffer[records_offset:names_offset])
+
+        data: dict[str, dict[str, AmedasStation]] = {}
+        for line, (prec_no, block_no, flags, as_type, lon, lat) in zip(lines, records):
+            prec_name, name = line.split("\t")
+            data.setdefault(prec_name, {})[name] = AmedasStation(as_type.decode("ascii"), prec_no, block_no, bool(flags & 1), bool(flags & 2), lon, lat)
+
+        return data
+
+
+# past weather data pages, replaced by a local server in load tests
+JMA_ETRN_BASE_URL = "https://www.data.jma.go.jp/obd/stats/etrn"
+
+
 class AmedasStationInfo:
 
+    # raw station pages younger than this are parsed again instead of downloaded,
+    # removing prec_block.json / .bin rebuilds the catalog from disk after a parser fix
+    _raw_max_age = 30 * 24 * 3600
+
     def _assign_values(self, data_str: str):
         # カンマで区切られた値をリストとして取得
         values = data_str.split(",")
@@ -99,13 +177,12 @@ class AmedasStationInfo:
     def _get_all_prec_no(self) -> dict[str, int]:
 
         # get page
-        url = "https://www.data.jma.go.jp/obd/stats/etrn/select/prefecture00.php"
-        response = requests.get(url)
-        if response.status_code != 200:
-            print(f"Failed to access page: {url} {response.status_code}")
+        url = f"{self._base_url}/select/prefecture00.php"
+        status_code, html = self._raw_cache.fetch(url, self._raw_max_age)
+        if status_code != 200:
+            print(f"Failed to access page: {url} {status_code}")
             return {}
-        response.encoding = response.apparent_encoding
-        soup = BeautifulSoup(response.text, "html.parser")
+        soup = BeautifulSoup(html, "html.parser")
 
         # areas
         div_main = soup.find("div", id="main")
@@ -126,13 +203,12 @@ class AmedasStationInfo:
 
     def _get_all_block_no(self, prec_no: int) -> dict[str, AmedasStation]:
 
-        url = f"https://www.data.jma.go.jp/obd/stats/etrn/select/prefecture.php?prec_no={prec_no}"
-        response = requests.get(url)
-        if response.status_code != 200:
-            print(f"Failed to access page: {url} {response.status_code}")
+        url = f"{self._base_url}/select/prefecture.php?prec_no={prec_no}"
+        status_code, html = self._raw_cache.fetch(url, self._raw_max_age)
+        if status_code != 200:
+            print(f"Failed to access page: {url} {status_code}")
             return {}
-        response.encoding = response.apparent_encoding
-        soup = BeautifulSoup(response.text, "html.parser")
+        soup = BeautifulSoup(html, "html.parser")
 
         # areas
         div_main = soup.find("div", id="contents_area2")
@@ -166,11 +242,18 @@ class AmedasStationInfo:
 
         return all_block_no
 
-    def __init__(self, workspace: str) -> None:
+    def __init__(self, workspace: str, base_url: str = JMA_ETRN_BASE_URL) -> None:
 
+        self._base_url = base_url
+        self._raw_cache = RawResponseCache(os.path.join(workspace, "raw"))
         self._prec_block_json_path = os.path.join(workspace, "prec_block.json")
+        self._prec_block_binary_path = os.path.join(workspace, "prec_block.bin")
 
-        if not os.path.exists(self._prec_block_json_path):
+        metrics.cache("amedas_stations", os.path.exists(self._prec_block_binary_path) or os.path.exists(self._prec_block_json_path))
+        if os.path.exists(self._prec_block_binary_path):
+            self._data = AmedasStationBinary.load(self._prec_block_binary_path)
+
+        elif not os.path.exists(self._prec_block_json_path):
             # parse
             self._data: dict[str, dict[str, AmedasStation]] = {}
             prec_nos = self._get_all_prec_no()
@@ -179,13 +262,18 @@ class AmedasStationInfo:
                 self._data[prec_name] = blocks
                 print(blocks)
 
-            # save as json
+            # save as json and binary
             AmedasStationJson.save_to_json(self._data, self._prec_block_json_path)
+            AmedasStationBinary.save(self._data, self._prec_block_binary_path)
 
         else:
             self._data = AmedasStationJson.load_from_json(self._prec_block_json_path)
+            AmedasStationBinary.save(self._data, self._prec_block_binary_path)
             # print(self._data)
 
+    def get_all_amedas_stations(self) -> dict[str, dict[str, AmedasStation]]:
+        return self._data
+
     def get_amedas_stations(self, prec_name: str) -> dict[str, AmedasStation]:
         if not prec_name in self._data:
             raise Exception("couldn't find prec_name")
@@ -201,67 +289,381 @@ class AmedasStationInfo:
         return blocks[block_name]
 
 
+# quality of each value in the 10 minute table
+# https://www.data.jma.go.jp/obd/stats/data/mdrr/man/remark.html
+AMEDAS_QUALITY_NORMAL = 0
+AMEDAS_QUALITY_QUASI_NORMAL = 1  # "12.3 )"
+AMEDAS_QUALITY_INSUFFICIENT = 2  # "12.3 ]"
+AMEDAS_QUALITY_QUESTIONABLE = 3  # "12.3 #"
+AMEDAS_QUALITY_DEFECTIVE = 4  # "×"
+AMEDAS_QUALITY_NOT_OBSERVED = 5  # "///"
+AMEDAS_QUALITY_NO_PHENOMENON = 6  # "--"
+AMEDAS_QUALITY_CALM = 7  # "静穏"
+AMEDAS_QUALITY_MISSING = 8  # empty or unparsable
+
+_AMEDAS_QUALITY_MARKS = {
+    ")": AMEDAS_QUALITY_QUASI_NORMAL,
+    "]": AMEDAS_QUALITY_INSUFFICIENT,
+    "#": AMEDAS_QUALITY_QUESTIONABLE,
+}
+
+_AMEDAS_QUALITY_SYMBOLS = {
+    "×": AMEDAS_QUALITY_DEFECTIVE,
+    "///": AMEDAS_QUALITY_NOT_OBSERVED,
+    "--": AMEDAS_QUALITY_NO_PHENOMENON,
+    "静穏": AMEDAS_QUALITY_CALM,
+}
+
+# 16 wind directions to degree
+_AMEDAS_WIND_DIRECTIONS = {
+    name: index * 22.5
+    for index, name in enumerate(
+        ["北", "北北東", "北東", "東北東", "東", "東南東", "南東", "南南東", "南", "南南西", "南西", "西南西", "西", "西北西", "北西", "北北西"]
+    )
+}
+
+
+def parse_amedas_value(text: str) -> tuple[float, int]:
+    value_str = text.strip()
+
+    if value_str in _AMEDAS_QUALITY_SYMBOLS:
+        return np.nan, _AMEDAS_QUALITY_SYMBOLS[value_str]
+
+    if value_str in _AMEDAS_WIND_DIRECTIONS:
+        return _AMEDAS_WIND_DIRECTIONS[value_str], AMEDAS_QUALITY_NORMAL
+
+    # marked values are not used as observations
+    if len(value_str) > 0 and value_str[-1] in _AMEDAS_QUALITY_MARKS:
+        return np.nan, _AMEDAS_QUALITY_MARKS[value_str[-1]]
+
+    try:
+        return float(value_str), AMEDAS_QUALITY_NORMAL
+    except ValueError:
+        return np.nan, AMEDAS_QUALITY_MISSING
+
+
+def parse_amedas_time(text: str) -> int:
+    # "hh:mm" to minutes of day, "24:00" is 1440
+    match = re.fullmatch(r"(\d{1,2}):(\d{2})", text.strip())
+    if match is None:
+        raise ValueError(f"invalid time: {text}")
+    return int(match.group(1)) * 60 + int(match.group(2))
+
+
+@dataclass
+class AmedasDailyColumns:
+    headings: list[str]
+    minutes: np.ndarray  # (lines,) int16, time of day of each line, ascending
+    values: np.ndarray  # (lines, headings) float32, nan if missing or marked
+    quality: np.ndarray  # (lines, headings) uint8, AMEDAS_QUALITY_*
+
+    # headings length, lines
+    _header_struct = struct.Struct("<II")
+
+    @staticmethod
+    def from_table(table_headings: list[str], table_lines: list[list[str]]) -> "AmedasDailyColumns":
+        # first column is time of day, short lines keep their time and the missing cells are AMEDAS_QUALITY_MISSING
+        headings = table_headings[1:]
+        lines = [line for line in table_lines if len(line) > 0]
+
+        minutes = np.empty(len(lines), dtype=np.int16)
+        values = np.full((len(lines), len(headings)), np.nan, dtype=np.float32)
+        quality = np.full((len(lines), len(headings)), AMEDAS_QUALITY_MISSING, dtype=np.uint8)
+        for i, line in enumerate(lines):
+            if len(line) > len(table_headings):
+                raise ValueError(f"line longer than headings: {line}")
+            minutes[i] = parse_amedas_time(line[0])
+            for j, text in enumerate(line[1:]):
+                values[i, j], quality[i, j] = parse_amedas_value(text)
+
+        order = np.argsort(minutes, kind="stable")
+        return AmedasDailyColumns(headings, minutes[order], values[order], quality[order])
+
+    def merge(self, other: "AmedasDailyColumns") -> "AmedasDailyColumns":
+        # lines of other replace lines of the same time, lines only in self are kept
+        minutes = np.concatenate([other.minutes, self.minutes])
+        unique_minutes, indices = np.unique(minutes, return_index=True)
+        values = np.concatenate([other.values, self.values])
+        quality = np.concatenate([other.quality, self.quality])
+        return AmedasDailyColumns(other.headings, unique_minutes.astype(np.int16), values[indices], quality[indices])
+
+    def to_bytes(self) -> bytes:
+        headings_bytes = json.dumps(self.headings, ensure_ascii=False).encode("utf-8")
+        header = self._header_struct.pack(len(headings_bytes), len(self.minutes))
+        return header + headings_bytes + self.minutes.astype("<i2").tobytes() + self.values.astype("<f4").tobytes() + self.quality.tobytes()
+
+    @staticmethod
+    def from_bytes(buffer: bytes) -> "AmedasDailyColumns":
+        headings_len, line_count = AmedasDailyColumns._header_struct.unpack_from(buffer, 0)
+        offset = AmedasDailyColumns._header_struct.size
+        headings = json.loads(buffer[offset : offset + headings_len].decode("utf-8"))
+        offset += headings_len
+
+        minutes = np.frombuffer(buffer, dtype="<i2", count=line_count, offset=offset).astype(np.int16)
+        offset += minutes.nbytes
+        values = np.frombuffer(buffer, dtype="<f4", count=line_count * len(headings), offset=offset).astype(np.float32).reshape(line_count, len(headings))
+        offset += values.nbytes
+        quality = np.frombuffer(buffer, dtype=np.uint8, count=line_count * len(headings), offset=offset).copy().reshape(line_count, len(headings))
+        return AmedasDailyColumns(headings, minutes, values, quality)
+
+    def get_column_index(self, heading_name: str) -> int:
+        for index, heading in enumerate(self.headings):
+            if heading_name in heading:
+                return index
+        return -1
+
+    def get_values(self, heading_name: str) -> np.ndarray:
+        index = self.get_column_index(heading_name)
+        if index < 0:
+            return None
+        return self.values[:, index]
+
+    def get_quality(self, heading_name: str) -> np.ndarray:
+        index = self.get_column_index(heading_name)
+        if index < 0:
+            return None
+        return self.quality[:, index]
+
+
 @dataclass
 class AmedasDaily:
+    # typed columns only, the page text stays in the raw response cache
     dt: datetime
-    table_headings: list[str]
-    table_lines: list[list[str]]
+    columns: AmedasDailyColumns
 
+    @staticmethod
+    def from_table(dt: datetime, table_headings: list[str], table_lines: list[list[str]]) -> "AmedasDaily":
+        return AmedasDaily(dt, AmedasDailyColumns.from_table(table_headings, table_lines))
 
-class AmedasDailyJson:
+    def is_complete(self) -> bool:
+        # all lines up to 24:00 and the last line has values
+        minutes = self.columns.minutes
+        if len(minutes) != 144 or minutes[-1] != 1440:
+            return False
+        return bool((self.columns.quality[-1] != AMEDAS_QUALITY_MISSING).any())
 
-    @staticmethod
-    def save_as_json(data: AmedasDaily, filename):
-        def custom_encoder(obj):
-            if isinstance(obj, datetime):
-                return obj.isoformat()
-            raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
 
-        dict_data = asdict(data)
-        with open(filename, "w", encoding="utf-8") as f:
-            json.dump(dict_data, f, default=custom_encoder, ensure_ascii=False, indent=4)
+@dataclass
+class AmedasSeries:
+    times: np.ndarray  # (times,) datetime64[m] jst, end of each 10 minute interval
+    columns: list[str]
+    values: np.ndarray  # (times, columns) float32, nan if missing or marked
+    quality: np.ndarray  # (times, columns) uint8, AMEDAS_QUALITY_*
 
     @staticmethod
-    def load_from_json(filename):
-        def custom_decoder(dict_obj):
-            if "dt" in dict_obj:
-                dict_obj["dt"] = datetime.fromisoformat(dict_obj["dt"])
-            return dict_obj
+    def from_dailies(dailies: list[AmedasDaily], start: date, end: date, columns: list[str]) -> "AmedasSeries":
+        # start and end are inclusive, days without daily stay nan
+        lines_per_day = 144
+        day_count = (end - start).days + 1
+
+        times = np.datetime64(start.isoformat(), "m") + np.arange(1, day_count * lines_per_day + 1) * np.timedelta64(10, "m")
+        values = np.full((len(times), len(columns)), np.nan, dtype=np.float32)
+        quality = np.full((len(times), len(columns)), AMEDAS_QUALITY_MISSING, dtype=np.uint8)
+
+        for daily in dailies:
+            daily_columns = daily.columns
+            rows = (daily.dt.date() - start).days * lines_per_day + daily_columns.minutes.astype(np.int64) // 10 - 1
+            in_range = (rows >= 0) & (rows < len(times))
+            rows = rows[in_range]
+
+            for k, column in enumerate(columns):
+                index = daily_columns.get_column_index(column)
+                if index < 0:
+                    continue
+                values[rows, k] = daily_columns.values[in_range, index]
+                quality[rows, k] = daily_columns.quality[in_range, index]
+
+        return AmedasSeries(times, columns, values, quality)
+
+    def get_values(self, column: str) -> np.ndarray:
+        if not column in self.columns:
+            return None
+        return self.values[:, self.columns.index(column)]
+
+    def get_quality(self, column: str) -> np.ndarray:
+        if not column in self.columns:
+            return None
+        return self.quality[:, self.columns.index(column)]
+
 
+class AmedasDailyJson:
+    # per day json files of older versions, only read to import them into AmedasDailyStore
+
+    @staticmethod
+    def load_from_json(filename) -> AmedasDaily:
         with open(filename, "r", encoding="utf-8") as f:
-            data = json.load(f, object_hook=custom_decoder)
-        return AmedasDaily(**data)
+            data = json.load(f)
+        return AmedasDaily.from_table(datetime.fromisoformat(data["dt"]), data["table_headings"], data["table_lines"])
+
+
+class AmedasDailyStore:
+    # all station-days in one sqlite file, rows are clustered by (prec_no, block_no, day)
+    # so a range of days of one station is a single sequential read
+
+    _json_filename_pattern = re.compile(r"^(\d+)_(\d+)_(\d+)_(\d+)_(\d+)\.json$")
+
+    # a day fetched this long after its end is final even if incomplete
+    _final_lag = timedelta(hours=1)
+
+    def __init__(self, path: str) -> None:
+        self._connection = sqlite3.connect(path, timeout=60)
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS amedas_daily (
+                prec_no INTEGER NOT NULL,
+                block_no INTEGER NOT NULL,
+                day TEXT NOT NULL,
+                data BLOB NOT NULL,
+                complete INTEGER NOT NULL DEFAULT 0,
+                fetched_at TEXT,
+                PRIMARY KEY (prec_no, block_no, day)
+            ) WITHOUT ROWID
+            """
+        )
+        self._connection.commit()
+
+    def _encode(self, daily: AmedasDaily) -> bytes:
+        # columns as arrays, loading does not parse cells again
+        return zlib.compress(daily.columns.to_bytes())
+
+    def _decode(self, day_str: str, data: bytes) -> AmedasDaily:
+        return AmedasDaily(datetime.fromisoformat(day_str), AmedasDailyColumns.from_bytes(zlib.decompress(data)))
+
+    def save(self, prec_no: int, block_no: int, daily: AmedasDaily, fetched_at: datetime = None) -> None:
+        self.save_many([(prec_no, block_no, daily)], fetched_at)
+
+    def save_many(self, items: list[tuple[int, int, AmedasDaily]], fetched_at: datetime = None) -> None:
+        # fetched_at is jst, None if unknown
+        fetched_at_str = fetched_at.strftime("%Y-%m-%d %H:%M:%S") if fetched_at is not None else None
+        rows = [
+            (
+                prec_no,
+                block_no,
+                daily.dt.date().isoformat(),
+                self._encode(daily),
+                int(daily.is_complete()),
+                fetched_at_str,
+            )
+            for prec_no, block_no, daily in items
+        ]
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO amedas_daily (prec_no, block_no, day, data, complete, fetched_at) VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def merge(self, prec_no: int, block_no: int, daily: AmedasDaily, fetched_at: datetime = None) -> AmedasDaily:
+        # new lines replace old lines of the same time, old lines missing in the new table are kept
+        old_daily = self.load(prec_no, block_no, daily.dt.date())
+        if old_daily is not None and old_daily.columns.headings == daily.columns.headings:
+            daily = AmedasDaily(daily.dt, old_daily.columns.merge(daily.columns))
+
+        self.save(prec_no, block_no, daily, fetched_at)
+        return daily
+
+    def get_refresh_days(self, prec_no: int, block_no: int, start: date, end: date, ended_before: datetime = None) -> set[date]:
+        # incomplete days fetched before their end, only days ended before ended_before (jst) if given
+        query = """
+            SELECT day FROM amedas_daily
+            WHERE prec_no = ? AND block_no = ? AND day BETWEEN ? AND ? AND complete = 0
+            AND (fetched_at IS NULL OR fetched_at < datetime(day, '+1 day', ?))
+        """
+        params = [prec_no, block_no, start.isoformat(), end.isoformat(), f"+{int(self._final_lag.total_seconds())} seconds"]
+        if ended_before is not None:
+            query += " AND day <= ?"
+            params.append((ended_before - timedelta(days=1) - self._final_lag).date().isoformat())
+
+        rows = self._connection.execute(query, params).fetchall()
+        return {date.fromisoformat(day_str) for (day_str,) in rows}
+
+    def load(self, prec_no: int, block_no: int, day: date) -> AmedasDaily:
+        row = self._connection.execute(
+            "SELECT day, data FROM amedas_daily WHERE prec_no = ? AND block_no = ? AND day = ?",
+            (prec_no, block_no, day.isoformat()),
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        return self._decode(*row)
+
+    def load_range(self, prec_no: int, block_no: int, start: date, end: date) -> list[AmedasDaily]:
+        # start and end are inclusive
+        rows = self._connection.execute(
+            "SELECT day, data FROM amedas_daily WHERE prec_no = ? AND block_no = ? AND day BETWEEN ? AND ? ORDER BY day",
+            (prec_no, block_no, start.isoformat(), end.isoformat()),
+        ).fetchall()
+
+        return [self._decode(day_str, data) for day_str, data in rows]
+
+    def get_days(self, prec_no: int, block_no: int, start: date, end: date) -> set[date]:
+        rows = self._connection.execute(
+            "SELECT day FROM amedas_daily WHERE prec_no = ? AND block_no = ? AND day BETWEEN ? AND ?",
+            (prec_no, block_no, start.isoformat(), end.isoformat()),
+        ).fetchall()
+
+        return {date.fromisoformat(day_str) for (day_str,) in rows}
+
+    def import_json_dir(self, directory: str, remove: bool = False) -> int:
+        # {prec_no}_{block_no}_{year}_{month}_{day}.json written by AmedasDailyJson
+        imported_paths: list[str] = []
+        items: list[tuple[int, int, AmedasDaily]] = []
+        for filename in sorted(os.listdir(directory)):
+            match = self._json_filename_pattern.match(filename)
+            if match is None:
+                continue
+
+            path = os.path.join(directory, filename)
+            prec_no, block_no = int(match.group(1)), int(match.group(2))
+            items.append((prec_no, block_no, AmedasDailyJson.load_from_json(path)))
+            imported_paths.append(path)
+
+        self.save_many(items)
+
+        if remove:
+            for path in imported_paths:
+                os.remove(path)
+
+        return len(items)
 
 
 class AmedasDailyInfo:
-    def __init__(self, workspace: str) -> None:
+    def __init__(self, workspace: str, base_url: str = JMA_ETRN_BASE_URL) -> None:
         self._workspace = workspace
+        self._base_url = base_url
+        self._store = AmedasDailyStore(os.path.join(workspace, "amedas_daily.sqlite3"))
+        # every downloaded page, see reparse_raw_cache()
+        self._raw_cache = RawResponseCache(os.path.join(workspace, "raw"))
 
     def _get_table_headings(self, headings: list[element.Tag]) -> list[str]:
+        # (text, rowspan, colspan) per th
+        heading_cells: list[list[tuple[str, int, int]]] = []
+        for heading in headings:
+            cells: list[tuple[str, int, int]] = []
+            for th in heading.find_all("th"):
+                rowspan = int(th["rowspan"]) if th.has_attr("rowspan") else 1
+                colspan = int(th["colspan"]) if th.has_attr("colspan") else 1
+                cells.append((th.text, rowspan, colspan))
+            heading_cells.append(cells)
+
+        return self._resolve_table_headings(heading_cells)
+
+    def _resolve_table_headings(self, heading_cells: list[list[tuple[str, int, int]]]) -> list[str]:
         # check heading level
-        def check_heading_level(heading: element.Tag) -> int:
-            time_head = heading.find("th")
-            level = 1
-            if time_head.has_attr("rowspan"):
-                level = int(time_head["rowspan"])
-            return level
+        level = heading_cells[0][0][1]
 
         # check if level mismatched
-        level = check_heading_level(headings[0])
-        if level != len(headings):
+        if level != len(heading_cells):
             raise Exception("level and heading mismatched!")
 
         # construct headings per level
         level_headings: list[list[dict]] = []
         for i in range(level):
             level_heading = []
-            for th in headings[i].find_all("th"):
+            for text, rowspan, colspan in heading_cells[i]:
                 item = {}
-                item["text"] = th.text
-                item_len = 1
-                if th.has_attr("colspan"):
-                    item_len = int(th["colspan"])
-                item["len"] = item_len
+                item["text"] = text
+                item["len"] = colspan
                 item["used"] = False
                 level_heading.append(item)
             level_headings.append(level_heading)
@@ -305,14 +707,26 @@ class AmedasDailyInfo:
 
         # 0 padding
         block_no_str = str(block_no).zfill(4)
-        url = f"https://www.data.jma.go.jp/obd/stats/etrn/view/10min_{as_type}1.php?prec_no={prec_no}&block_no={block_no_str}&year={year}&month={month}&day={day}&view="
+        url = f"{self._base_url}/view/10min_{as_type}1.php?prec_no={prec_no}&block_no={block_no_str}&year={year}&month={month}&day={day}&view="
 
-        response = requests.get(url)
-        if response.status_code != 200:
-            print(f"Failed to access page: {url} {response.status_code}")
-            return {}
-        response.encoding = response.apparent_encoding
-        soup = BeautifulSoup(response.text, "html.parser")
+        # always revalidated, the day may have been in progress at the last download
+        status_code, html = self._raw_cache.fetch(url)
+        if status_code != 200:
+            print(f"Failed to access page: {url} {status_code}")
+            return None
+
+        with metrics.span("amedas_parse"):
+            table_headings, table_lines = self._parse_amedas_daily_table(html)
+            return AmedasDaily.from_table(datetime(year, month, day), table_headings, table_lines)
+
+    def _parse_amedas_daily_table(self, html: str) -> tuple[list[str], list[list[str]]]:
+        # lxml is much faster than html.parser, both give the same table
+        if lxml is not None:
+            return self._parse_amedas_daily_table_lxml(html)
+        return self._parse_amedas_daily_table_bs4(html)
+
+    def _parse_amedas_daily_table_bs4(self, html: str) -> tuple[list[str], list[list[str]]]:
+        soup = BeautifulSoup(html, "html.parser")
 
         # areas
         div_main = soup.find("div", id="main")
@@ -337,21 +751,229 @@ class AmedasDailyInfo:
             table_lines.append(table_line)
             # print(table_line)
 
-        dt = datetime(year, month, day)
+        return table_headings, table_lines
 
-        return AmedasDaily(dt, table_headings, table_lines)
+    def _parse_amedas_daily_table_lxml(self, html: str) -> tuple[list[str], list[list[str]]]:
+        root = lxml.html.document_fromstring(html)
+
+        # areas
+        tables = root.xpath('//div[@id="main"]//table[@id="tablefix1"]')
+        if len(tables) == 0:
+            raise Exception("couldn't find tablefix1")
+
+        # obtain headings and lines
+        heading_cells: list[list[tuple[str, int, int]]] = []
+        table_lines: list[list[str]] = []
+        for tr in tables[0].iter("tr"):
+            if "style" not in tr.attrib:
+                cells: list[tuple[str, int, int]] = []
+                for th in tr.iter("th"):
+                    rowspan = int(th.get("rowspan", "1"))
+                    colspan = int(th.get("colspan", "1"))
+                    cells.append((str(th.text_content()), rowspan, colspan))
+                heading_cells.append(cells)
+            else:
+                table_lines.append([str(td.text_content()) for td in tr.iter("td")])
+
+        table_headings = self._resolve_table_headings(heading_cells)
+
+        return table_headings, table_lines
+
+    def _get_jst_now(self) -> datetime:
+        return datetime.now(timezone(timedelta(hours=9))).replace(tzinfo=None)
 
     def get_amedas_daily(self, as_type: str, prec_no: int, block_no: int, year: int, month: int, day: int) -> AmedasDaily:
 
+        target_day = date(year, month, day)
+        daily = self._store.load(prec_no, block_no, target_day)
+        if daily is not None:
+            # fetched while the day was in progress
+            if len(self._store.get_refresh_days(prec_no, block_no, target_day, target_day, self._get_jst_now())) == 0:
+                metrics.cache("amedas_daily", True)
+                return daily
+
+            fetched_at = self._get_jst_now()
+            new_daily = self._download_amedas_daily(as_type, prec_no, block_no, year, month, day)
+            if new_daily is None:
+                return daily
+            return self._store.merge(prec_no, block_no, new_daily, fetched_at)
+
+        # cache of older versions
         file_path = os.path.join(self._workspace, f"{prec_no}_{block_no}_{year}_{month}_{day}.json")
-
         if os.path.exists(file_path):
-            return AmedasDailyJson.load_from_json(file_path)
+            daily = AmedasDailyJson.load_from_json(file_path)
+            self._store.save(prec_no, block_no, daily)
+            metrics.cache("amedas_daily", True)
+            return daily
 
+        metrics.cache("amedas_daily", False)
+        fetched_at = self._get_jst_now()
         daily = self._download_amedas_daily(as_type, prec_no, block_no, year, month, day)
-        AmedasDailyJson.save_as_json(daily, file_path)
+        if daily is None:
+            return None
+
+        self._store.save(prec_no, block_no, daily, fetched_at)
         return daily
 
+    def _download_and_merge(
+        self,
+        station_days: list[tuple[AmedasStation, date]],
+        max_workers: int,
+        request_interval: float,
+    ) -> dict[tuple[int, int, date], AmedasDaily]:
+
+        # download in threads, save in this thread
+        # max_workers and request_interval pace this call only, the http client adds its per host cap on top
+        pace_lock = threading.Lock()
+        next_times = [0.0]
+
+        def wait_interval() -> None:
+            with pace_lock:
+                now = time.monotonic()
+                wait_time = next_times[0] - now
+                next_times[0] = max(now, next_times[0]) + request_interval
+            if wait_time > 0:
+                time.sleep(wait_time)
+
+        def download(station: AmedasStation, day: date) -> tuple[datetime, AmedasDaily]:
+            wait_interval()
+            fetched_at = self._get_jst_now()
+            with metrics.span("amedas_download", item=f"{station.prec_no}_{station.block_no}_{day.isoformat()}"):
+                return fetched_at, self._download_amedas_daily(station.as_type, station.prec_no, station.block_no, day.year, day.month, day.day)
+
+        result: dict[tuple[int, int, date], AmedasDaily] = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(download, station, day): (station, day) for station, day in station_days}
+            for future in as_completed(futures):
+                station, day = futures[future]
+                try:
+                    fetched_at, daily = future.result()
+                except Exception as e:
+                    # one failed day does not stop the others
+                    print(f"failed to download amedas daily: {station.prec_no}_{station.block_no}_{day.isoformat()} {e}")
+                    metrics.count("amedas_download_errors", 1, error=type(e).__name__)
+                    continue
+                if daily is None:
+                    continue
+
+                result[(station.prec_no, station.block_no, day)] = self._store.merge(station.prec_no, station.block_no, daily, fetched_at)
+
+        return result
+
+    def prefetch_amedas_daily(
+        self,
+        station_days: list[tuple[AmedasStation, date]],
+        max_workers: int = 4,
+        request_interval: float = 0.5,
+    ) -> dict[tuple[int, int, date], AmedasDaily]:
+
+        # dedupe by (prec_no, block_no, day)
+        stations: dict[tuple[int, int], AmedasStation] = {}
+        days: dict[tuple[int, int], set[date]] = {}
+        for station, day in station_days:
+            station_key = (station.prec_no, station.block_no)
+            stations[station_key] = station
+            days.setdefault(station_key, set()).add(day)
+
+        # cached days, one query per station
+        now = self._get_jst_now()
+        result: dict[tuple[int, int, date], AmedasDaily] = {}
+        missing: list[tuple[AmedasStation, date]] = []
+        for station_key, station_days_set in days.items():
+            prec_no, block_no = station_key
+            first_day, last_day = min(station_days_set), max(station_days_set)
+            for daily in self._store.load_range(prec_no, block_no, first_day, last_day):
+                if daily.dt.date() in station_days_set:
+                    result[(prec_no, block_no, daily.dt.date())] = daily
+
+            # fetched while the day was in progress, cached one is used if download fails
+            refresh_days = self._store.get_refresh_days(prec_no, block_no, first_day, last_day, now)
+
+            for day in sorted(station_days_set):
+                if (prec_no, block_no, day) in result:
+                    if day in refresh_days:
+                        missing.append((stations[station_key], day))
+                    continue
+
+                # cache of older versions
+                file_path = os.path.join(self._workspace, f"{prec_no}_{block_no}_{day.year}_{day.month}_{day.day}.json")
+                if os.path.exists(file_path):
+                    daily = AmedasDailyJson.load_from_json(file_path)
+                    self._store.save(prec_no, block_no, daily)
+                    result[(prec_no, block_no, day)] = daily
+                    continue
+
+                missing.append((stations[station_key], day))
+
+        # days to be refreshed are in both
+        refreshed = sum(1 for station, day in missing if (station.prec_no, station.block_no, day) in result)
+        metrics.count("cache_hits", len(result) - refreshed, cache="amedas_daily")
+        metrics.count("cache_misses", len(missing), cache="amedas_daily")
+        if len(missing) == 0:
+            return result
+
+        print(f"prefetch amedas daily: {len(missing)} days")
+        result.update(self._download_and_merge(missing, max_workers, request_interval))
+
+        return result
+
+    def refresh_amedas_daily(
+        self,
+        stations: list[AmedasStation],
+        start: date,
+        end: date,
+        max_workers: int = 4,
+        request_interval: float = 0.5,
+    ) -> dict[tuple[int, int, date], AmedasDaily]:
+        # re-fetch only incomplete days including today, complete days are never downloaded again
+        refresh: list[tuple[AmedasStation, date]] = []
+        for station in {(station.prec_no, station.block_no): station for station in stations}.values():
+            for day in sorted(self._store.get_refresh_days(station.prec_no, station.block_no, start, end)):
+                refresh.append((station, day))
+
+        if len(refresh) == 0:
+            return {}
+
+        print(f"refresh amedas daily: {len(refresh)} days")
+        return self._download_and_merge(refresh, max_workers, request_interval)
+
+    def get_amedas_range(self, station: AmedasStation, start: date, end: date, columns: list[str]) -> AmedasSeries:
+        # start and end are inclusive, columns are matched by substring of headings like "気温"
+        day_count = (end - start).days + 1
+
+        # missing days are downloaded together
+        station_days = [(station, start + timedelta(days=i)) for i in range(day_count)]
+        dailies = self.prefetch_amedas_daily(station_days)
+
+        return AmedasSeries.from_dailies(list(dailies.values()), start, end, columns)
+
+    def get_amedas_daily_range(self, prec_no: int, block_no: int, start: date, end: date) -> list[AmedasDaily]:
+        # cached days only
+        return self._store.load_range(prec_no, block_no, start, end)
+
+    def import_json_cache(self, remove: bool = False) -> int:
+        return self._store.import_json_dir(self._workspace, remove)
+
+    def reparse_raw_cache(self) -> int:
+        # parse every cached 10min page again and replace the stored days, no network
+        count = 0
+        for url in self._raw_cache.get_urls(f"{self._base_url}/view/10min_"):
+            raw_response = self._raw_cache.load(url)
+            if raw_response is None:
+                continue
+
+            query = {key: values[0] for key, values in parse_qs(urlparse(url).query).items()}
+            with metrics.span("amedas_parse"):
+                table_headings, table_lines = self._parse_amedas_daily_table(raw_response.get_text())
+                daily = AmedasDaily.from_table(datetime(int(query["year"]), int(query["month"]), int(query["day"])), table_headings, table_lines)
+
+            # completeness is judged by the time the page was fetched
+            fetched_at = datetime.fromtimestamp(raw_response.fetched_at, timezone(timedelta(hours=9))).replace(tzinfo=None)
+            self._store.save(int(query["prec_no"]), int(query["block_no"]), daily, fetched_at)
+            count += 1
+
+        return count
+
 
 def test():
 
@@ -1,22 +1,90 @@
-import requests, os, zipfile
+import os, zipfile, json, time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from urllib.parse import urljoin
 from bs4 import BeautifulSoup, element
 from dataclasses import dataclass, asdict
+import requests
+
+from httpclient import http_client
+from rawcache import RawResponseCache
 
 # 国土数値情報ダウンロードサイト
+KSJ_BASE_URL = "https://nlftp.mlit.go.jp/ksj"
+
+
+class CatalogCache:
+    # json file with fetched time, used instead of scraping while it is fresh
+
+    def __init__(self, path: str, ttl_seconds: float) -> None:
+        self._path = path
+        self._ttl_seconds = ttl_seconds
+
+    def load(self, allow_stale: bool = False):
+        if self._path is None or not os.path.exists(self._path):
+            return None
+
+        with open(self._path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+
+        if not allow_stale and not self.is_fresh(cache["fetched_at"]):
+            return None
+
+        return cache["data"]
+
+    def is_fresh(self, fetched_at: float = None) -> bool:
+        if fetched_at is None:
+            if self._path is None or not os.path.exists(self._path):
+                return False
+            with open(self._path, "r", encoding="utf-8") as f:
+                fetched_at = json.load(f)["fetched_at"]
+
+        return time.time() - fetched_at < self._ttl_seconds
+
+    def save(self, data) -> None:
+        if self._path is None:
+            return
+
+        temp_path = self._path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"fetched_at": time.time(), "data": data}, f, ensure_ascii=False)
+        os.replace(temp_path, self._path)
+
+
+def _fetch_html(raw_cache: RawResponseCache, url: str, max_age: float) -> tuple[int, str]:
+    # (status code, text), through the raw cache if there is one
+    if raw_cache is not None:
+        return raw_cache.fetch(url, max_age)
+
+    response = http_client.get(url)
+    if response.status_code != 200:
+        return response.status_code, None
+    response.encoding = response.apparent_encoding
+    return 200, response.text
 
 
 class TopInfo:
-    def __init__(self) -> None:
-        url = "https://nlftp.mlit.go.jp/ksj/index.html"
+    def __init__(self, cache_path: str = None, ttl_seconds: float = 30 * 24 * 3600, base_url: str = KSJ_BASE_URL) -> None:
+        self._url = base_url + "/index.html"
+        self._cache = CatalogCache(cache_path, ttl_seconds)
+        # raw page next to the parsed cache, removing the json re-parses it while younger than ttl
+        self._raw_cache = RawResponseCache(os.path.join(os.path.dirname(cache_path), "raw")) if cache_path is not None else None
+        self._ttl_seconds = ttl_seconds
+
+        # loaded on first access
+        self._data: dict[str, dict[str, list[tuple[str, str]]]] = None
+
+    def _fetch(self) -> dict[str, dict[str, list[tuple[str, str]]]]:
+        url = self._url
 
         # get html
-        response = requests.get(url)
-        if response.status_code != 200:
-            print(f"Failed to access page: {url} {response.status_code}")
+        status_code, html = _fetch_html(self._raw_cache, url, self._ttl_seconds)
+        if status_code != 200:
+            print(f"Failed to access page: {url} {status_code}")
             return {}
-        response.encoding = response.apparent_encoding
-        soup = BeautifulSoup(response.text, "html.parser")
+        return self._parse(html, url)
+
+    def _parse(self, html: str, url: str) -> dict[str, dict[str, list[tuple[str, str]]]]:
+        soup = BeautifulSoup(html, "html.parser")
 
         # get categories
         main_tag = soup.find("main")
@@ -56,24 +124,94 @@ class TopInfo:
             data[category_name] = sub_data
 
         # {category, {sub_category, [(name, url)]}}
+        return data
+
+    def _get_data(self) -> dict[str, dict[str, list[tuple[str, str]]]]:
+        if self._data is not None:
+            return self._data
+
+        data = self._cache.load()
+        if data is not None:
+            # json has lists instead of tuples
+            self._data = {
+                category_name: {sub_category_name: [tuple(item) for item in items] for sub_category_name, items in sub_data.items()}
+                for category_name, sub_data in data.items()
+            }
+            return self._data
+
+        try:
+            data = self._fetch()
+        except requests.RequestException as e:
+            print(f"Failed to access page: {self._url} {e}")
+            data = {}
+        if len(data) > 0:
+            self._cache.save(data)
+        else:
+            # stale cache is better than nothing
+            data = self._cache.load(allow_stale=True) or {}
+            data = {
+                category_name: {sub_category_name: [tuple(item) for item in items] for sub_category_name, items in sub_data.items()}
+                for category_name, sub_data in data.items()
+            }
+
         self._data = data
+        return self._data
 
     def get_category_names(self) -> list[str]:
-        return list(self._data.keys())
+        return list(self._get_data().keys())
 
     def get_sub_category_names(self, category_name: str) -> list[str]:
-        if not category_name in self._data:
+        data = self._get_data()
+        if not category_name in data:
             print("category_name not found: ", category_name)
             return []
 
-        return list(self._data[category_name].keys())
+        return list(data[category_name].keys())
 
     def get_items(self, category_name: str, sub_category_name: str) -> list[tuple[str, str]]:
         if not sub_category_name in self.get_sub_category_names(category_name):
             print("sub_category_name not found: ", sub_category_name)
             return []
 
-        return self._data[category_name][sub_category_name]
+        return self._get_data()[category_name][sub_category_name]
+
+
+# shapefile and its sidecar files
+SHP_MEMBER_EXTENSIONS = [".shp", ".shx", ".dbf", ".prj", ".cpg"]
+
+
+def get_shp_member_names(zip_path: str) -> list[str]:
+    with zipfile.ZipFile(zip_path, "r") as zip:
+        return [name for name in zip.namelist() if os.path.splitext(name)[1].lower() in SHP_MEMBER_EXTENSIONS]
+
+
+def extract_shp_members(zip_path: str, extract_path: str, extract_mode: str) -> str:
+    # returns the path of the first shp, "" if failed
+    # extract_mode: "all" extracts everything, "shp" only shapefile members, "vsizip" nothing (gdal reads the zip)
+
+    if not os.path.exists(zip_path):
+        print("zip file doesn't exist: " + zip_path)
+        return ""
+
+    member_names = get_shp_member_names(zip_path)
+    shp_member_names = sorted(name for name in member_names if name.lower().endswith(".shp"))
+    if len(shp_member_names) == 0:
+        print("doesn't contain shp file: " + zip_path)
+        return ""
+
+    if extract_mode == "vsizip":
+        return "/vsizip/" + os.path.abspath(zip_path) + "/" + shp_member_names[0]
+
+    with zipfile.ZipFile(zip_path, "r") as zip:
+        if extract_mode == "all":
+            zip.extractall(extract_path)
+        elif extract_mode == "shp":
+            for name in member_names:
+                zip.extract(name, extract_path)
+        else:
+            raise Exception("unknown extract_mode: " + extract_mode)
+
+    return os.path.join(extract_path, shp_member_names[0])
 
 
 @dataclass
@@ -103,12 +241,14 @@ class AdministrativeDivisionInfo:
         return url
 
     def _parse_prefecture_urls(self, url) -> dict[str, ZipFileInfo]:
-        response = requests.get(url)
-        if response.status_code != 200:
-            print(f"Failed to access page: {url} {response.status_code}")
+        status_code, html = _fetch_html(self._raw_cache, url, self._ttl_seconds)
+        if status_code != 200:
+            print(f"Failed to access page: {url} {status_code}")
             return {}
-        response.encoding = response.apparent_encoding
-        soup = BeautifulSoup(response.text, "html.parser")
+        return self._parse_prefecture_html(html, url)
+
+    def _parse_prefecture_html(self, html: str, url: str) -> dict[str, ZipFileInfo]:
+        soup = BeautifulSoup(html, "html.parser")
 
         # table
         main = soup.find("main")
@@ -148,21 +288,75 @@ class AdministrativeDivisionInfo:
 
         return zip_files
 
-    def __init__(self, download_dir: str, workspace_dir: str) -> None:
+    def __init__(
+        self,
+        download_dir: str,
+        workspace_dir: str,
+        ttl_seconds: float = 30 * 24 * 3600,
+        extract_mode: str = "shp",
+        base_url: str = KSJ_BASE_URL,
+    ) -> None:
 
+        self._base_url = base_url
         self._download_dir = download_dir
         self._workspace_dir = workspace_dir
+        self._extract_mode = extract_mode
+        self._ttl_seconds = ttl_seconds
+        self._catalog_cache = CatalogCache(os.path.join(workspace_dir, "ksj_n03_catalog.json"), ttl_seconds)
+        self._raw_cache = RawResponseCache(os.path.join(workspace_dir, "raw"))
+
+        # loaded on first access, network is used only if there is no cache
+        self._zip_files: dict[str, AdministrativeDivisionInfo.ZipFileInfo] = None
+
+        # {prec_name: {"filename": zip filename, "shp_path": path}}
+        self._manifest_path = os.path.join(workspace_dir, "ksj_n03_manifest.json")
+        self._manifest: dict[str, dict[str, str]] = None
 
-        top_info = TopInfo()
+    def _fetch_zip_files(self) -> dict[str, ZipFileInfo]:
+        top_info = TopInfo(os.path.join(self._workspace_dir, "ksj_top.json"), self._ttl_seconds, self._base_url)
+        # {} if the catalog is empty, so the stale cache is used
         category_names = top_info.get_category_names()
+        if len(category_names) < 2:
+            print("N03 category not found")
+            return {}
         sub_category_names = top_info.get_sub_category_names(category_names[1])
+        if len(sub_category_names) == 0:
+            print("N03 sub category not found")
+            return {}
         items = top_info.get_items(category_names[1], sub_category_names[0])
+        if len(items) == 0:
+            print("N03 item not found")
+            return {}
         name, url = items[0]
 
-        self._zip_files = self._parse_prefecture_urls(url)
+        return self._parse_prefecture_urls(url)
+
+    def _get_zip_files(self, allow_stale: bool = True) -> dict[str, ZipFileInfo]:
+        if self._zip_files is not None and (allow_stale or self._catalog_cache.is_fresh()):
+            return self._zip_files
+
+        data = self._catalog_cache.load(allow_stale)
+        if data is not None:
+            self._zip_files = {prec_name: self.ZipFileInfo(**item) for prec_name, item in data.items()}
+            return self._zip_files
+
+        try:
+            zip_files = self._fetch_zip_files()
+        except requests.RequestException as e:
+            print(f"Failed to fetch N03 catalog: {e}")
+            zip_files = {}
+        if len(zip_files) > 0:
+            self._catalog_cache.save({prec_name: asdict(item) for prec_name, item in zip_files.items()})
+            self._zip_files = zip_files
+        elif self._zip_files is None:
+            # stale cache is better than nothing
+            data = self._catalog_cache.load(allow_stale=True) or {}
+            self._zip_files = {prec_name: self.ZipFileInfo(**item) for prec_name, item in data.items()}
+
+        return self._zip_files
 
     def get_prec_names(self) -> list[str]:
-        return list(self._zip_files.keys())
+        return list(self._get_zip_files().keys())
 
     def _download_file(self, zip_info: ZipFileInfo, save_path: str) -> bool:
 
@@ -172,25 +366,44 @@ class AdministrativeDivisionInfo:
 
         print("start downloading file: " + zip_info.filename + ": " + zip_info.size_str)
 
-        response = requests.get(zip_info.url)
-        if response.status_code != 200:
+        if not http_client.download(zip_info.url, save_path):
             print("failed to download: ", zip_info.url)
             return False
 
-        with open(save_path, "wb") as f:
-            f.write(response.content)
-
         return True
 
-    def _extract_file(self, zip_path: str, extract_path: str) -> bool:
-
-        if not os.path.exists(zip_path):
-            print("zip file doesn't exist: " + zip_path)
-            return False
+    def _get_manifest(self) -> dict[str, dict[str, str]]:
+        if self._manifest is None:
+            if os.path.exists(self._manifest_path):
+                with open(self._manifest_path, "r", encoding="utf-8") as f:
+                    self._manifest = json.load(f)
+            else:
+                self._manifest = {}
+        return self._manifest
+
+    def _save_manifest_item(self, prec_name: str, filename: str, shp_path: str) -> None:
+        self._save_manifest_items([(prec_name, filename, shp_path)])
+
+    def _save_manifest_items(self, items: list[tuple[str, str, str]]) -> None:
+        manifest = self._get_manifest()
+        for prec_name, filename, shp_path in items:
+            manifest[prec_name] = {"filename": filename, "shp_path": shp_path}
+
+        temp_path = self._manifest_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=4)
+        os.replace(temp_path, self._manifest_path)
+
+    def _get_manifest_shp_path(self, prec_name: str, filename: str) -> str:
+        item = self._get_manifest().get(prec_name)
+        if item is None or item["filename"] != filename:
+            return ""
 
-        with zipfile.ZipFile(zip_path, "r") as zip:
-            zip.extractall(extract_path)
-        return True
+        shp_path = item["shp_path"]
+        if shp_path.startswith("/vsizip/"):
+            zip_path = os.path.join(self._download_dir, filename)
+            return shp_path if os.path.exists(zip_path) else ""
+        return shp_path if os.path.exists(shp_path) else ""
 
     def _find_files_in_dir(self, directory: str, extension: str):
         matches = []
@@ -200,31 +413,125 @@ class AdministrativeDivisionInfo:
                     matches.append(os.path.join(root, file))
         return matches
 
+    def _get_extracted_shp_path(self, prec_name: str, zip_file_info: ZipFileInfo) -> str:
+        # recorded path, no need to walk directories
+        shp_path = self._get_manifest_shp_path(prec_name, zip_file_info.filename)
+        if len(shp_path) > 0:
+            return shp_path
+
+        # extracted by older versions
+        target_path = os.path.join(self._workspace_dir, os.path.splitext(zip_file_info.filename)[0])
+        if os.path.exists(target_path):
+            shp_paths = self._find_files_in_dir(target_path, ".shp")
+            if len(shp_paths) == 0:
+                print("doesn't contain shp file: " + target_path)
+                return ""
+            self._save_manifest_item(prec_name, zip_file_info.filename, shp_paths[0])
+            return shp_paths[0]
+
+        return ""
+
     def get_administrative_division(self, prec_name: str) -> AdministrativeDivision:
-        if not prec_name in self._zip_files:
+        zip_files = self._get_zip_files()
+        if not prec_name in zip_files:
             print("prec_name not found: " + prec_name)
             return ""
 
-        zip_file_info = self._zip_files[prec_name]
+        zip_file_info = zip_files[prec_name]
+
+        shp_path = self._get_extracted_shp_path(prec_name, zip_file_info)
+        if len(shp_path) > 0:
+            return AdministrativeDivision(prec_name, shp_path)
+
+        zip_download_path = os.path.join(self._download_dir, zip_file_info.filename)
+
+        # the catalog is refreshed only when something has to be downloaded
+        if not os.path.exists(zip_download_path) and not self._catalog_cache.is_fresh():
+            zip_files = self._get_zip_files(allow_stale=False)
+            if prec_name in zip_files:
+                zip_file_info = zip_files[prec_name]
+                zip_download_path = os.path.join(self._download_dir, zip_file_info.filename)
+
+        if not self._download_file(zip_file_info, zip_download_path):
+            return None
+
+        target_path = os.path.join(self._workspace_dir, os.path.splitext(zip_file_info.filename)[0])
+        shp_path = extract_shp_members(zip_download_path, target_path, self._extract_mode)
+        if len(shp_path) == 0:
+            return None
+
+        self._save_manifest_item(prec_name, zip_file_info.filename, shp_path)
+
+        return AdministrativeDivision(prec_name, shp_path)
+
+    def get_administrative_divisions(
+        self,
+        prec_names: list[str] | str = "all",
+        max_download_workers: int = 4,
+        max_extract_workers: int = None,
+    ) -> dict[str, AdministrativeDivision]:
+        # downloads in threads, extraction in processes, returns after all are ready
+
+        zip_files = self._get_zip_files()
+        if prec_names == "all":
+            prec_names = list(zip_files.keys())
+
+        result: dict[str, AdministrativeDivision] = {}
+        targets: list[str] = []
+        for prec_name in prec_names:
+            if not prec_name in zip_files:
+                print("prec_name not found: " + prec_name)
+                continue
+
+            shp_path = self._get_extracted_shp_path(prec_name, zip_files[prec_name])
+            if len(shp_path) > 0:
+                result[prec_name] = AdministrativeDivision(prec_name, shp_path)
+            else:
+                targets.append(prec_name)
+
+        if len(targets) == 0:
+            return result
+
+        # the catalog is refreshed only when something has to be downloaded
+        if not self._catalog_cache.is_fresh():
+            if any(not os.path.exists(os.path.join(self._download_dir, zip_files[prec_name].filename)) for prec_name in targets):
+                zip_files = self._get_zip_files(allow_stale=False)
+                targets = [prec_name for prec_name in targets if prec_name in zip_files]
+
+        manifest_items: list[tuple[str, str, str]] = []
+        with ThreadPoolExecutor(max_workers=max_download_workers) as download_executor, ProcessPoolExecutor(max_workers=max_extract_workers) as extract_executor:
+
+            def download(prec_name: str) -> tuple[str, bool]:
+                zip_file_info = zip_files[prec_name]
+                zip_download_path = os.path.join(self._download_dir, zip_file_info.filename)
+                return zip_download_path, self._download_file(zip_file_info, zip_download_path)
+
+            download_futures = {download_executor.submit(download, prec_name): prec_name for prec_name in targets}
 
-        directory_name = os.path.splitext(zip_file_info.filename)[0]
-        target_path = os.path.join(self._workspace_dir, directory_name)
+            # extract as soon as each download finishes
+            extract_futures = {}
+            for future in as_completed(download_futures):
+                prec_name = download_futures[future]
+                zip_download_path, downloaded = future.result()
+                if not downloaded:
+                    continue
 
-        if not os.path.exists(target_path):
-            zip_download_path = os.path.join(self._download_dir, zip_file_info.filename)
+                target_path = os.path.join(self._workspace_dir, os.path.splitext(zip_files[prec_name].filename)[0])
+                extract_future = extract_executor.submit(extract_shp_members, zip_download_path, target_path, self._extract_mode)
+                extract_futures[extract_future] = prec_name
 
-            if not self._download_file(zip_file_info, zip_download_path):
-                return None
+            for future in as_completed(extract_futures):
+                prec_name = extract_futures[future]
+                shp_path = future.result()
+                if len(shp_path) == 0:
+                    continue
 
-            if not self._extract_file(zip_download_path, target_path):
-                return None
+                manifest_items.append((prec_name, zip_files[prec_name].filename, shp_path))
+                result[prec_name] = AdministrativeDivision(prec_name, shp_path)
 
-        # target to shp
-        shp_paths = self._find_files_in_dir(target_path, ".shp")
-        if len(shp_paths) == 0:
-            print("doesn't contain shp file: " + target_path)
+        self._save_manifest_items(manifest_items)
 
-        return AdministrativeDivision(prec_name, shp_paths[0])
+        return result
 
 
 def test():
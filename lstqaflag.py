@@ -0,0 +1,88 @@
+import numpy as np
+
+# QA_flag bits of the GCOM-C SGLI LST product
+# https://suzaku.eorc.jaxa.jp/GCOM_C/data/update/Algorithm_LST_ja.html
+LST_QA_NO_INPUT_DATA = 0
+LST_QA_WATER = 1  # land(0)/water(1) flag
+LST_QA_SPARE = 2
+LST_QA_NO_CLFG = 3
+LST_QA_NO_VNR_SWR = 4
+LST_QA_SNOW = 5
+LST_QA_SENSOR_ZENITH_33 = 6  # sensor zenith angle > 33
+LST_QA_SENSOR_ZENITH_43 = 7  # sensor zenith angle > 43
+LST_QA_TR1_LOW = 8  # TR1 < 0.6
+LST_QA_RES_1K = 9  # (CNVERR > 1.0) && (CNVERR <= 2.0)
+LST_QA_RES_2K = 10  # CNVERR > 2.0
+LST_QA_PROBABLY_CLOUDY = 11
+LST_QA_CLOUDY = 12
+LST_QA_TS_OUT_OF_RANGE = 13
+
+# names used by the command line and excluded_flags
+LST_QA_FLAG_NAMES = {
+    "no input data": LST_QA_NO_INPUT_DATA,
+    "land(0)/water(1) flag": LST_QA_WATER,
+    "Spare": LST_QA_SPARE,
+    "no CLFG": LST_QA_NO_CLFG,
+    "no VNR/SWR": LST_QA_NO_VNR_SWR,
+    "Snow": LST_QA_SNOW,
+    "Sensor zenith angle > 33": LST_QA_SENSOR_ZENITH_33,
+    "Sensor zenith angle > 43": LST_QA_SENSOR_ZENITH_43,
+    "TR1 < 0.6": LST_QA_TR1_LOW,
+    "RES > 1[K] (CNVERR>1.0)&&(CNVERR<= 2.0)": LST_QA_RES_1K,
+    "RES > 2[K] CNVERR> 2.0": LST_QA_RES_2K,
+    "Probably Cloudy": LST_QA_PROBABLY_CLOUDY,
+    "Cloudy": LST_QA_CLOUDY,
+    "TS out of range": LST_QA_TS_OUT_OF_RANGE,
+}
+
+# default policy of analysis1
+LST_QA_DEFAULT_EXCLUDED_FLAGS = ["no input data", "Cloudy"]
+
+
+def get_flag_bit(flag: str | int) -> int:
+    # bit number from a name or a bit number
+    if isinstance(flag, str):
+        if not flag in LST_QA_FLAG_NAMES:
+            raise Exception("unknown QA flag: " + flag)
+        return LST_QA_FLAG_NAMES[flag]
+    return int(flag)
+
+
+def get_policy_mask(excluded_flags: list[str | int]) -> int:
+    # one integer with the bits of all excluded flags
+    mask = 0
+    for flag in excluded_flags:
+        mask |= 1 << get_flag_bit(flag)
+    return mask
+
+
+def _to_uint16(qa_values) -> np.ndarray:
+    # sampled values come as floats
+    return np.asarray(qa_values, dtype=np.float64).astype(np.int64).astype(np.uint16)
+
+
+def get_flag_mask(qa_values, flag: str | int) -> np.ndarray:
+    # True where the flag is set
+    return (_to_uint16(qa_values) >> np.uint16(get_flag_bit(flag))) & np.uint16(1) == 1
+
+
+def decode(qa_values, flags: list[str | int] = None) -> dict[str, np.ndarray]:
+    # {flag name: boolean mask}, all named flags if flags is None
+    values = _to_uint16(qa_values)
+    names = list(LST_QA_FLAG_NAMES.keys()) if flags is None else flags
+    return {str(name): (values >> np.uint16(get_flag_bit(name))) & np.uint16(1) == 1 for name in names}
+
+
+def get_usable_mask(qa_values, excluded_flags: list[str | int] = LST_QA_DEFAULT_EXCLUDED_FLAGS) -> np.ndarray:
+    # True where none of the excluded flags is set
+    return (_to_uint16(qa_values) & np.uint16(get_policy_mask(excluded_flags))) == 0
+
+
+def test():
+    values = np.array([0, 1, 1 << 12, (1 << 11) | (1 << 7), 65535], dtype=np.float32)
+    print(decode(values, ["no input data", "Cloudy", LST_QA_SENSOR_ZENITH_43]))
+    print(get_usable_mask(values))
+    print(get_usable_mask(values, ["Probably Cloudy", "Cloudy", "Sensor zenith angle > 43"]))
+
+
+# test()
@@ -1,14 +1,27 @@
-import os, math
-from datetime import datetime
-from dataclasses import dataclass
+import os, sys, math, argparse
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+import numpy as np
 
 from japanmeteorologicalagency import AmedasStation, AmedasStationInfo, AmedasStationJson
 from japanmeteorologicalagency import AmedasDaily, AmedasDailyInfo, AmedasDailyJson
+from amedastimematcher import AmedasTimeMatcher
+from amedasstationindex import AmedasStationIndex
+from lstqaflag import LST_QA_DEFAULT_EXCLUDED_FLAGS, get_usable_mask, decode
+from resultwriter import Matchup, ResultWriter, reserve_stdout
 from japanmlitnlftp import AdministrativeDivision
 from japanmlitnlftp import AdministrativeDivisionInfo
+from boundarycache import BoundaryCache
 
+from pipeline import Pipeline, StreamStage, run_streaming
+from instrumentation import metrics
 from qgiswrapper import QGisWrapper
 from gcom import CSWWrapper, GcomDownloader
+from seleniumchrome import SeleniumChromeWrapper
+from httpclient import http_client
+from granulefootprint import filter_footprints, get_points_geometry
+from gcomtile import get_tile_ids_from_points, get_tile_ids_from_rings, filter_by_tiles
 from hdf5togeotiff import GcomHdf5
 
 from qgis.core import QgsPointXY
@@ -20,237 +33,555 @@ def gportal_username_and_password_from_env() -> tuple[str, str]:
     return username, password
 
 
-def analysis1():
+# geotiff
+@dataclass
+class LSTGeoTiff:
+    lst_image_path: str
+    qa_flag_image_path: str
+    jst_average_date: datetime
 
-    # get point from meteorological agency
+
+@dataclass
+class GeoTiffTargetPointsValue:
+    lst_values: list[float]
+    qa_flag_values: list[float]
+    geotiff_date: datetime
+    pixel_distances: list[float] = field(default_factory=list)  # meter, nan if outside
+
+
+def get_distance_meter(lon1: float, lat1: float, lon2: float, lat2: float) -> float:
+    # haversine
+    r = 6371000
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    a = math.sin((phi2 - phi1) / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2
+    return 2 * r * math.asin(math.sqrt(a))
+
+
+def get_boundary_rings(prec_name: str) -> list[list[tuple[float, float]]]:
+    # rings of the prefecture boundary, simplified a little
+    boundary_cache = BoundaryCache("workspace")
+    geometry = boundary_cache.get_geometry(prec_name, boundary_cache.get_tolerance(0.002))
+    rings: list[list[tuple[float, float]]] = []
+    for i in range(geometry.GetGeometryCount()):
+        polygon = geometry.GetGeometryRef(i)
+        for j in range(polygon.GetGeometryCount()):
+            rings.append([(point[0], point[1]) for point in polygon.GetGeometryRef(j).GetPoints()])
+    return rings
+
+
+# degree, jma station coordinates are rounded to 0.1 minute (about 150 m)
+STATION_BOUNDARY_MARGIN = 0.002
+
+
+def stage_target_points(boundary: tuple[str, tuple[float, float, float, float]], station_selector: str) -> list[tuple[str, AmedasStation]]:
+
+    prec_name, (lon_min, lat_min, lon_max, lat_max) = boundary
+
+    # get point from meteorological agency, active temperature stations of the prefecture
     amedas_station_info = AmedasStationInfo("workspace")
-    amedas_stations_in_aichi = amedas_station_info.get_amedas_stations("愛知県")
+    amedas_station_index = AmedasStationIndex.from_station_info(amedas_station_info)
+
+    # jma's own listing where the prefecture names match (not hokkaido, which jma splits into regions)
+    stations: dict[tuple[int, int], tuple[str, AmedasStation]] = {}
+    if prec_name in amedas_station_info.get_all_amedas_stations():
+        for name, station in amedas_station_info.get_amedas_stations(prec_name).items():
+            if station.is_valid and station.has_temperature:
+                stations[(station.prec_no, station.block_no)] = (name, station)
+
+    # and stations on the original boundary widened by the rounding, capes and ports stay in
+    margin = STATION_BOUNDARY_MARGIN
+    candidates = amedas_station_index.query_bbox(lon_min - margin, lat_min - margin, lon_max + margin, lat_max + margin, active_temperature=True)
+    boundary_cache = BoundaryCache("workspace")
+    inside = boundary_cache.contains_points(prec_name, [(station.lon, station.lat) for name, station in candidates], 0.0, margin)
+    for (name, station), is_inside in zip(candidates, inside):
+        if is_inside:
+            stations.setdefault((station.prec_no, station.block_no), (name, station))
 
     # enumulate amedas stations as target points
     target_points: list[tuple[str, AmedasStation]] = []
-    for name, station in amedas_stations_in_aichi.items():
-        if not station.is_valid:
-            continue
-        if not station.has_temperature:
-            continue
-
-        if "名古屋" in name:
+    for name, station in stations.values():
+        if station_selector in name:
             target_points.append((name, station))
 
-    # get aichi shp
+    return target_points
+
+
+def stage_boundary(prec_keyword: str) -> tuple[str, tuple[float, float, float, float]]:
+
+    # get shp
     administrative_division_info = AdministrativeDivisionInfo("download", "workspace")
     prec_names = administrative_division_info.get_prec_names()
-    aichi_prec_name = ""
+    target_prec_name = ""
     for prec_name in prec_names:
-        if "愛知" in prec_name:
-            aichi_prec_name = prec_name
+        if prec_keyword in prec_name:
+            target_prec_name = prec_name
             break
-    aichi_division = administrative_division_info.get_administrative_division(aichi_prec_name)
+    division = administrative_division_info.get_administrative_division(target_prec_name)
 
-    # get aichi extent
-    qgis_wrapper = QGisWrapper()
-    qgis_wrapper.add_shp(aichi_division.shp_path)
-    aichi_extent = qgis_wrapper.get_shp_layers_extent()
+    # get extent
+    boundary_cache = BoundaryCache("workspace")
+    boundary_cache.build(division)
+    return target_prec_name, boundary_cache.get_extent(target_prec_name)
 
-    # get gcom hdf5 urls
-    # https://gportal.jaxa.jp/gpr/assets/mng_upload/COMMON/upload/GCOM-C_FAQ_datasetID_jp.pdf
-    dataset_id = str("10002019")  # LST
-    utc_start = datetime(2024, 1, 1)
-    utc_end = datetime(2024, 2, 1)
+
+def stage_hdf5_urls(
+    boundary: tuple[str, tuple[float, float, float, float]],
+    target_points: list[tuple[str, AmedasStation]],
+    dataset_id: str,
+    utc_start: datetime,
+    utc_end: datetime,
+    footprint_filter: str = "stations",
+) -> list[str]:
+
+    prec_name, (lon_min, lat_min, lon_max, lat_max) = boundary
     bbox = [
-        math.floor(aichi_extent.xMinimum()),
-        math.floor(aichi_extent.yMinimum()),
-        math.ceil(aichi_extent.xMaximum()),
-        math.ceil(aichi_extent.yMaximum()),
+        math.floor(lon_min),
+        math.floor(lat_min),
+        math.ceil(lon_max),
+        math.ceil(lat_max),
     ]
     csw_wrapper = CSWWrapper()
-    hdf5_urls = csw_wrapper.get_hdf5_urls(dataset_id, utc_start, utc_end, bbox)
+    footprints = csw_wrapper.get_hdf5_footprints(dataset_id, utc_start, utc_end, bbox)
+
+    # the integer bbox returns granules which barely touch the prefecture, only those covering the targets are downloaded
+    # "stations": target points, "boundary": prefecture polygon, "none": every granule
+    # tiles in the file names are checked first, footprints catch what is left (scene products, tile margins)
+    if footprint_filter == "stations":
+        points = [(station.lon, station.lat) for name, station in target_points]
+        tile_ids = get_tile_ids_from_points(points)
+        target = get_points_geometry(points)
+    elif footprint_filter == "boundary":
+        rings = get_boundary_rings(prec_name)
+        tile_ids = get_tile_ids_from_rings(rings)
+        boundary_cache = BoundaryCache("workspace")
+        target = boundary_cache.get_geometry(prec_name, boundary_cache.get_tolerance(0.002))
+    elif footprint_filter != "none":
+        raise Exception("unknown footprint filter: " + footprint_filter)
+
+    if footprint_filter != "none":
+        tile_urls = set(filter_by_tiles([footprint.url for footprint in footprints], tile_ids))
+        metrics.count("granules_skipped", len(footprints) - len(tile_urls), reason="tile")
+        footprints = filter_footprints([footprint for footprint in footprints if footprint.url in tile_urls], target)
+        print(f"granules: {len(footprints)} covering {footprint_filter}, tiles: {', '.join(tile_ids)}")
+
+    return [footprint.url for footprint in footprints]
+
+
+def stage_hdf5_file_paths(hdf5_urls: list[str]) -> list[str]:
 
     # download hdf5 files
     username, password = gportal_username_and_password_from_env()
     gcom_downloader = GcomDownloader("download", "workspace", username, password)
-    hdf5_file_paths = gcom_downloader.get_downloaded_file_paths(hdf5_urls)
+    return gcom_downloader.get_downloaded_file_paths(hdf5_urls)
 
-    # geotiff
-    @dataclass
-    class LSTGeoTiff:
-        lst_image_path: str
-        qa_flag_image_path: str
-        jst_average_date: datetime
 
-    # convert to geotiff
-    geo_tiffs: list[LSTGeoTiff] = []
-    for path in hdf5_file_paths:
-
-        # filepath to extract path
-        filename_without_extension = os.path.splitext(os.path.basename(path))[0]
-        lst_path = os.path.join("workspace", filename_without_extension + "_LST.tif")
-        qa_flag_path = os.path.join("workspace", filename_without_extension + "_QA_flag.tif")
-
-        gcom_hdf5 = GcomHdf5(path)
-        # https://suzaku.eorc.jaxa.jp/GCOM_C/data/update/Algorithm_LST_ja.html
-        gcom_hdf5.get_sub_image_path("Image_data/LST", lst_path)
-        gcom_hdf5.get_sub_image_path("Image_data/QA_flag", qa_flag_path)
-        jst_start, jst_end = gcom_hdf5.get_jst_start_end()
-
-        # averaging
-        difference = jst_end - jst_start
-        half_difference = difference / 2
-        jst_average = jst_start + half_difference
-
-        geo_tiffs.append(LSTGeoTiff(lst_path, qa_flag_path, jst_average))
-
-    @dataclass
-    class GeoTiffTargetPointsValue:
-        lst_values: list[float]
-        qa_flag_values: list[float]
-        geotiff_date: datetime
-
-    def parse_lst_qa_flag(value: float) -> dict[str, str]:
-
-        int_value = int(value) & 0xFFFF
-        bits = [(int_value >> i) & 1 for i in range(16)]
-
-        flags = {}
-        flags["no input data"] = "yes" if bits[0] else "no"
-        flags["land(0)/water(1) flag"] = "water" if bits[1] else "land"
-        flags["Spare"] = "yes" if bits[2] else "no"
-        flags["no CLFG"] = "yes" if bits[3] else "no"
-        flags["no VNR/SWR"] = "yes" if bits[4] else "no"
-        flags["Snow"] = "yes" if bits[5] else "no"
-        flags["Sensor zenith angle > 33"] = "yes" if bits[6] else "no"
-        flags["Sensor zenith angle > 43"] = "yes" if bits[7] else "no"
-        flags["TR1 < 0.6"] = "yes" if bits[8] else "no"
-        flags["RES > 1[K] (CNVERR>1.0)&&(CNVERR<= 2.0)"] = "yes" if bits[9] else "no"
-        flags["RES > 2[K] CNVERR> 2.0"] = "yes" if bits[10] else "no"
-        flags["Probably Cloudy"] = "yes" if bits[11] else "no"
-        flags["Cloudy"] = "yes" if bits[12] else "no"
-        flags["TS out of range"] = "yes" if bits[13] else "no"
-        # flags["land/water flag"] = "water" if bits[14] else "land"
-        # flags["no input data"] = "no data" if bits[15] else "valid data"
-
-        return flags
+def convert_hdf5_to_geo_tiff(hdf5_file_path: str) -> LSTGeoTiff:
 
-    # apply to qgis
-    geotiff_target_points_values: list[GeoTiffTargetPointsValue] = []
-    for geo_tiff in geo_tiffs:
-        lst_index = qgis_wrapper.add_geotiff(geo_tiff.lst_image_path)
-        qa_flag_index = qgis_wrapper.add_geotiff(geo_tiff.qa_flag_image_path)
+    # filepath to extract path
+    filename_without_extension = os.path.splitext(os.path.basename(hdf5_file_path))[0]
+    lst_path = os.path.join("workspace", filename_without_extension + "_LST.tif")
+    qa_flag_path = os.path.join("workspace", filename_without_extension + "_QA_flag.tif")
 
-        # get values against target points
-        lst_values: list[float] = []
-        qa_flag_values: list[float] = []
-        hit = False
-        for name, station in target_points:
-            point = QgsPointXY(station.lon, station.lat)
-            lst_value, lst_flag = qgis_wrapper.get_geotiff_layer_value(point, lst_index)
-            qa_flag_value, qa_flag_flag = qgis_wrapper.get_geotiff_layer_value(point, qa_flag_index)
-            lst_values.append(lst_value if lst_flag else 0.0)
-            qa_flag_values.append(qa_flag_value if qa_flag_flag else 0.0)
-
-            if lst_flag or qa_flag_flag:
-                hit = True
-
-        # check if hitting all target points
-        if not hit:
-            print("no station hit: " + str(geo_tiff.jst_average_date))
-            continue
-
-        geotiff_target_points_values.append(
-            GeoTiffTargetPointsValue(
-                lst_values,
-                qa_flag_values,
-                geo_tiff.jst_average_date,
-            )
-        )
+    gcom_hdf5 = GcomHdf5(hdf5_file_path)
+    # https://suzaku.eorc.jaxa.jp/GCOM_C/data/update/Algorithm_LST_ja.html
+    gcom_hdf5.get_sub_image_path("Image_data/LST", lst_path)
+    gcom_hdf5.get_sub_image_path("Image_data/QA_flag", qa_flag_path)
+    jst_start, jst_end = gcom_hdf5.get_jst_start_end()
 
-    # get index
-    def get_daily_heading_index(daily: AmedasDaily, heading_name: str) -> int:
-        target_index = -1
-        for index, heading in enumerate(daily.table_headings):
-            if heading_name in heading:
-                target_index = index
-                break
-        return target_index
+    # averaging
+    difference = jst_end - jst_start
+    half_difference = difference / 2
+    jst_average = jst_start + half_difference
 
-    # get precise value
-    def get_daily_hour_minute_value(daily: AmedasDaily, heading_index: int, hour: int, minute: int) -> str:
-        # 10 minute interval
-        value_index = int((hour * 60 + minute) / 10)
+    return LSTGeoTiff(lst_path, qa_flag_path, jst_average)
 
-        if value_index >= len(daily.table_lines):
-            print("failed to get daily value")
-            return 0.0
 
-        return daily.table_lines[value_index][heading_index]
+def sample_geo_tiff(qgis_wrapper: QGisWrapper, geo_tiff: LSTGeoTiff, target_points: list[tuple[str, AmedasStation]]) -> GeoTiffTargetPointsValue:
+    # None if no target point is on the scene
 
-    # show stations
+    with metrics.span("sample_scene", item=os.path.basename(geo_tiff.lst_image_path)):
+        return _sample_geo_tiff(qgis_wrapper, geo_tiff, target_points)
+
+
+def _sample_geo_tiff(qgis_wrapper: QGisWrapper, geo_tiff: LSTGeoTiff, target_points: list[tuple[str, AmedasStation]]) -> GeoTiffTargetPointsValue:
+
+    lst_index = qgis_wrapper.add_geotiff(geo_tiff.lst_image_path)
+    qa_flag_index = qgis_wrapper.add_geotiff(geo_tiff.qa_flag_image_path)
+
+    # get values against target points
+    lst_values: list[float] = []
+    qa_flag_values: list[float] = []
+    pixel_distances: list[float] = []
+    hit = False
     for name, station in target_points:
-        print(name + ",", end="")
-    print("")
+        point = QgsPointXY(station.lon, station.lat)
+        lst_value, lst_flag = qgis_wrapper.get_geotiff_layer_value(point, lst_index)
+        qa_flag_value, qa_flag_flag = qgis_wrapper.get_geotiff_layer_value(point, qa_flag_index)
+        lst_values.append(lst_value if lst_flag else 0.0)
+        qa_flag_values.append(qa_flag_value if qa_flag_flag else 0.0)
 
-    # get temperatures from meteorological agency
-    amedas_daily_info = AmedasDailyInfo("workspace")
-    for value in geotiff_target_points_values:
+        pixel_center = qgis_wrapper.get_geotiff_pixel_center(point, lst_index) if lst_flag else None
+        if pixel_center is None:
+            pixel_distances.append(math.nan)
+        else:
+            pixel_distances.append(get_distance_meter(station.lon, station.lat, pixel_center.x(), pixel_center.y()))
 
-        if value.geotiff_date.hour > 19:
-            continue
+        if lst_flag or qa_flag_flag:
+            hit = True
 
-        print(value.geotiff_date.strftime("%Y-%m-%d %H:%M:%S") + ", ", end="")
+    # check if hitting all target points
+    if not hit:
+        print("no station hit: " + str(geo_tiff.jst_average_date))
+        return None
 
-        for i in range(len(target_points)):
-            name, station = target_points[i]
-            daily: AmedasDaily = amedas_daily_info.get_amedas_daily(
-                station.as_type,
-                station.prec_no,
-                station.block_no,
-                value.geotiff_date.year,
-                value.geotiff_date.month,
-                value.geotiff_date.day,
-            )
-            heading_index = get_daily_heading_index(daily, "気温")
-            if heading_index < 0:
-                continue
-            temperature_str = get_daily_hour_minute_value(
-                daily,
-                heading_index,
-                value.geotiff_date.hour,
-                value.geotiff_date.minute,
-            )
+    return GeoTiffTargetPointsValue(
+        lst_values,
+        qa_flag_values,
+        geo_tiff.jst_average_date,
+        pixel_distances,
+    )
 
-            # str to float
-            try:
-                temperature = float(temperature_str)
-            except (ValueError, TypeError):
-                temperature = 10000.0
 
-            # compare values
-            lst_temperature = value.lst_values[i] * 0.02 - 273
-            lst_qa_flag = value.qa_flag_values[i]
+def stage_geo_tiffs(hdf5_file_paths: list[str]) -> list[LSTGeoTiff]:
 
-            # parse flag
-            flag_info = parse_lst_qa_flag(lst_qa_flag)
+    # convert to geotiff
+    return [convert_hdf5_to_geo_tiff(path) for path in hdf5_file_paths]
 
-            if flag_info["no input data"] == "yes" or flag_info["Cloudy"] == "yes":
-                continue
-            if temperature > 100:
-                continue
 
-            # print
-            print(str(temperature) + ", " + str(lst_temperature) + ", ", end="")
+def stage_target_points_values(geo_tiffs: list[LSTGeoTiff], target_points: list[tuple[str, AmedasStation]]) -> list[GeoTiffTargetPointsValue]:
 
-            if flag_info["no input data"] == "yes":
-                print("(no data), ", end="")
+    # apply to qgis
+    qgis_wrapper = QGisWrapper()
+    geotiff_target_points_values: list[GeoTiffTargetPointsValue] = []
+    for geo_tiff in geo_tiffs:
+        value = sample_geo_tiff(qgis_wrapper, geo_tiff, target_points)
+        if value is not None:
+            geotiff_target_points_values.append(value)
+
+    return geotiff_target_points_values
 
-            if flag_info["Cloudy"] == "yes":
-                print("(Cloudy), ", end="")
 
-            # print(str(int(lst_qa_flag)))
-            # for key, val in flag_info.items():
-            #     print(f"  {key}: {val}")
+def stage_streaming_target_points_values(
+    hdf5_urls: list[str],
+    target_points: list[tuple[str, AmedasStation]],
+    convert_workers: int,
+    queue_size: int,
+) -> list[GeoTiffTargetPointsValue]:
+    # download, conversion and sampling overlap, a granule is converted as soon as it is downloaded
+    # and sampled as soon as it is converted
+
+    # one browser session downloads in order, sampling stays on this thread which owns qgis
+    username, password = gportal_username_and_password_from_env()
+    gcom_downloader = GcomDownloader("download", "workspace", username, password)
+    qgis_wrapper = QGisWrapper()
 
-        # newline
-        print("")
+    def download(item: tuple[int, str]) -> tuple[int, str]:
+        index, url = item
+        return index, gcom_downloader.get_downloaded_file_paths([url])[0]
 
+    def convert(item: tuple[int, str]) -> tuple[int, LSTGeoTiff]:
+        index, hdf5_file_path = item
+        return index, convert_hdf5_to_geo_tiff(hdf5_file_path)
 
-analysis1()
+    indexed_values: list[tuple[int, GeoTiffTargetPointsValue]] = []
+    stages = [
+        StreamStage("download", download, 1),
+        StreamStage("convert", convert, convert_workers),
+    ]
+    for index, geo_tiff in run_streaming(enumerate(hdf5_urls), stages, queue_size):
+        value = sample_geo_tiff(qgis_wrapper, geo_tiff, target_points)
+        if value is not None:
+            indexed_values.append((index, value))
+
+    # same order as the batch stages
+    indexed_values.sort(key=lambda indexed_value: indexed_value[0])
+    return [value for index, value in indexed_values]
+
+
+def stage_matchups(
+    geotiff_target_points_values: list[GeoTiffTargetPointsValue],
+    target_points: list[tuple[str, AmedasStation]],
+    boundary: tuple[str, tuple[float, float, float, float]],
+    dataset_id: str,
+    max_hour: int,
+    excluded_flags: list[str],
+) -> list[Matchup]:
+    # all (scene, station) pairs, dropped pairs have the reason
+
+    # get temperatures from meteorological agency, interpolated at overpass time of all pairs at once
+    amedas_time_matcher = AmedasTimeMatcher(AmedasDailyInfo("workspace"))
+    target_values = [value for value in geotiff_target_points_values if value.geotiff_date.hour <= max_hour]
+    pair_stations: list[AmedasStation] = []
+    pair_timestamps: list[datetime] = []
+    for value in target_values:
+        for name, station in target_points:
+            pair_stations.append(station)
+            pair_timestamps.append(value.geotiff_date)
+    temperatures = amedas_time_matcher.match(pair_stations, pair_timestamps, "気温", "linear")
+    temperatures = temperatures.reshape(len(target_values), len(target_points))
+
+    # QA policy for all scenes and stations at once
+    shape = (len(target_values), len(target_points))
+    lst_values = np.array([value.lst_values for value in target_values], dtype=np.float64).reshape(shape)
+    qa_flag_values = np.array([value.qa_flag_values for value in target_values], dtype=np.float64).reshape(shape)
+    pixel_distances = np.array([value.pixel_distances for value in target_values], dtype=np.float64).reshape(shape)
+    lst_temperatures = lst_values * 0.02 - 273
+    qa_usable = get_usable_mask(qa_flag_values, excluded_flags)
+    excluded_flag_masks = decode(qa_flag_values, excluded_flags)
+
+    prec_name, extent = boundary
+    matchups: list[Matchup] = []
+
+    def append(value: GeoTiffTargetPointsValue, i: int, temperature: float, lst_temperature: float, qa_flag: int, pixel_distance: float, drop_reason: str):
+        name, station = target_points[i]
+        matchups.append(
+            Matchup(
+                value.geotiff_date.isoformat(),
+                dataset_id,
+                prec_name,
+                name,
+                station.prec_no,
+                station.block_no,
+                station.lon,
+                station.lat,
+                temperature,
+                lst_temperature,
+                qa_flag,
+                pixel_distance,
+                len(drop_reason) == 0,
+                drop_reason,
+            )
+        )
+
+    for value_index, value in enumerate(target_values):
+        for i in range(len(target_points)):
+            temperature = float(temperatures[value_index, i])
+            pixel_distance = float(pixel_distances[value_index, i])
+
+            drop_reason = ""
+            if math.isnan(pixel_distance):
+                drop_reason = "outside scene"
+            elif not qa_usable[value_index, i]:
+                drop_reason = "qa: " + "|".join(flag for flag, mask in excluded_flag_masks.items() if mask[value_index, i])
+            elif math.isnan(temperature):
+                drop_reason = "no amedas value"
+            elif temperature > 100:
+                drop_reason = "amedas value out of range"
+
+            append(value, i, temperature, float(lst_temperatures[value_index, i]), int(qa_flag_values[value_index, i]), pixel_distance, drop_reason)
+
+    # scenes after max_hour are not matched
+    for value in geotiff_target_points_values:
+        if value.geotiff_date.hour > max_hour:
+            for i in range(len(target_points)):
+                pixel_distance = value.pixel_distances[i] if i < len(value.pixel_distances) else math.nan
+                append(value, i, math.nan, value.lst_values[i] * 0.02 - 273, int(value.qa_flag_values[i]), pixel_distance, "after max hour")
+
+    return matchups
+
+
+def analysis1(
+    prec_keyword: str = "愛知",
+    dataset_id: str = "10002019",
+    utc_start: datetime = datetime(2024, 1, 1),
+    utc_end: datetime = datetime(2024, 2, 1),
+    station_selector: str = "名古屋",
+    max_hour: int = 19,
+    excluded_flags: list[str] = LST_QA_DEFAULT_EXCLUDED_FLAGS,
+    streaming: bool = False,
+    convert_workers: int = 2,
+    footprint_filter: str = "stations",
+) -> tuple[list[tuple[str, AmedasStation]], list[Matchup]]:
+    # returns (target points, matchups)
+
+    # each stage is re-run only if its params or outputs of its inputs change
+    pipeline = Pipeline(os.path.join("workspace", "pipeline"))
+
+    def files_exist(paths: list[str]) -> bool:
+        return all(os.path.exists(path) for path in paths)
+
+    def boundary_exists(boundary: tuple[str, tuple[float, float, float, float]]) -> bool:
+        # later stages read the layers of workspace/boundary.gpkg, not the cached extent
+        prec_name, extent = boundary
+        return BoundaryCache("workspace").has_division(prec_name)
+
+    pipeline.add_stage("boundary", stage_boundary, params={"prec_keyword": prec_keyword}, validate=boundary_exists)
+    pipeline.add_stage("target_points", stage_target_points, inputs=["boundary"], version=2, params={"station_selector": station_selector})
+
+    # https://gportal.jaxa.jp/gpr/assets/mng_upload/COMMON/upload/GCOM-C_FAQ_datasetID_jp.pdf
+    pipeline.add_stage(
+        "hdf5_urls",
+        stage_hdf5_urls,
+        inputs=["boundary", "target_points"],
+        params={
+            "dataset_id": dataset_id,  # 10002019: LST
+            "utc_start": utc_start,
+            "utc_end": utc_end,
+            "footprint_filter": footprint_filter,
+        },
+    )
+    if streaming:
+        # same output as the batch stages, without caching the intermediate files lists
+        pipeline.add_stage(
+            "target_points_values",
+            stage_streaming_target_points_values,
+            inputs=["hdf5_urls", "target_points"],
+            version=2,
+            params={"convert_workers": convert_workers, "queue_size": 2},
+        )
+    else:
+        pipeline.add_stage("hdf5_file_paths", stage_hdf5_file_paths, inputs=["hdf5_urls"], validate=files_exist)
+        pipeline.add_stage(
+            "geo_tiffs",
+            stage_geo_tiffs,
+            inputs=["hdf5_file_paths"],
+            validate=lambda geo_tiffs: files_exist([path for geo_tiff in geo_tiffs for path in [geo_tiff.lst_image_path, geo_tiff.qa_flag_image_path]]),
+        )
+        pipeline.add_stage("target_points_values", stage_target_points_values, inputs=["geo_tiffs", "target_points"], version=2)
+    pipeline.add_stage(
+        "matchups",
+        stage_matchups,
+        inputs=["target_points_values", "target_points", "boundary"],
+        params={"dataset_id": dataset_id, "max_hour": max_hour, "excluded_flags": excluded_flags},
+    )
+
+    outputs = pipeline.run()
+    return outputs["target_points"], outputs["matchups"]
+
+
+def run_job(job: dict) -> tuple[dict, list[tuple[str, AmedasStation]], list[Matchup], dict]:
+    # runs in a worker process, job is kwargs of analysis1, metrics of the job go back to the parent
+    with metrics.span("job", item=f"{job['prec_keyword']} {job['dataset_id']} {job['utc_start']:%Y-%m-%d}"):
+        target_points, matchups = analysis1(**job)
+    return job, target_points, matchups, metrics.get_snapshot(reset=True)
+
+
+def init_worker(workers: int) -> None:
+    # the per host caps of httpclient.HOST_POLICIES hold for all workers together
+    http_client.divide_host_policies(workers)
+
+
+def get_periods(utc_start: datetime, utc_end: datetime, period_days: int) -> list[tuple[datetime, datetime]]:
+    # whole range if period_days is 0
+    period = timedelta(days=period_days) if period_days > 0 else utc_end - utc_start
+
+    periods: list[tuple[datetime, datetime]] = []
+    current = utc_start
+    while current < utc_end:
+        periods.append((current, min(current + period, utc_end)))
+        current += period
+    return periods
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+
+    def parse_date(date_str: str) -> datetime:
+        return datetime.strptime(date_str, "%Y-%m-%d")
+
+    parser = argparse.ArgumentParser(description="compare GCOM-C LST with AMeDAS temperatures")
+    parser.add_argument("--prefecture", action="append", help='prefecture name or keyword like 愛知, repeatable, "all" for every prefecture')
+    parser.add_argument("--dataset-id", action="append", help="G-Portal dataset id, repeatable (default: 10002019, LST)")
+    parser.add_argument("--start", type=parse_date, default=datetime(2024, 1, 1), help="utc start date, YYYY-MM-DD")
+    parser.add_argument("--end", type=parse_date, default=datetime(2024, 2, 1), help="utc end date, YYYY-MM-DD, exclusive")
+    parser.add_argument("--period-days", type=int, default=0, help="split the date range into periods of this many days")
+    parser.add_argument("--station", default="", help="substring of amedas station names, all stations in the prefecture if empty")
+    parser.add_argument("--max-hour", type=int, default=19, help="scenes later than this jst hour are ignored")
+    parser.add_argument("--exclude-flag", action="append", help='QA flag excluding pixels, repeatable (default: "no input data", "Cloudy")')
+    parser.add_argument("--output", default=os.path.join("workspace", "matchups.csv"), help='output path, .csv or .parquet (directory of parts), "-" for csv on stdout')
+    parser.add_argument("--append", action="store_true", help="append to an existing output instead of replacing it")
+    parser.add_argument("--usable-only", action="store_true", help="skip dropped matchups")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of worker processes, they share the per host request rate, each downloading worker runs its own browser and G-Portal login",
+    )
+    parser.add_argument("--metrics", default="", help="save timings, cache hit rates and bytes, .json or .prom (prometheus text)")
+    parser.add_argument("--streaming", action="store_true", help="overlap download, conversion and sampling of granules")
+    parser.add_argument("--convert-workers", type=int, default=2, help="number of conversion threads in streaming mode")
+    parser.add_argument(
+        "--footprint-filter", choices=["stations", "boundary", "none"], default="stations", help="download only granules whose tile and footprint cover the stations or the prefecture"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] = None):
+
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if args.output == "-":
+        # progress of this process and the workers must not end up in the csv
+        reserve_stdout()
+    prec_keywords = args.prefecture or ["愛知"]
+    dataset_ids = args.dataset_id or ["10002019"]
+    excluded_flags = args.exclude_flag or LST_QA_DEFAULT_EXCLUDED_FLAGS
+
+    # resolve keywords to prefecture names like stage_boundary does
+    administrative_division_info = AdministrativeDivisionInfo("download", "workspace")
+    all_prec_names = administrative_division_info.get_prec_names()
+    if "all" in prec_keywords:
+        prec_names = all_prec_names
+    else:
+        prec_names = []
+        for prec_keyword in prec_keywords:
+            matched = [prec_name for prec_name in all_prec_names if prec_keyword in prec_name]
+            if len(matched) == 0:
+                print("prefecture not found: " + prec_keyword, file=sys.stderr)
+                continue
+            prec_names.append(matched[0])
+
+    # shared caches are filled once here, workers only read them
+    AmedasStationInfo("workspace")
+    boundary_cache = BoundaryCache("workspace")
+    for division in administrative_division_info.get_administrative_divisions(prec_names).values():
+        boundary_cache.build(division)
+
+    jobs: list[dict] = []
+    for prec_name in prec_names:
+        for dataset_id in dataset_ids:
+            for utc_start, utc_end in get_periods(args.start, args.end, args.period_days):
+                jobs.append(
+                    {
+                        "prec_keyword": prec_name,
+                        "dataset_id": dataset_id,
+                        "utc_start": utc_start,
+                        "utc_end": utc_end,
+                        "station_selector": args.station,
+                        "max_hour": args.max_hour,
+                        "excluded_flags": excluded_flags,
+                        "streaming": args.streaming,
+                        "convert_workers": args.convert_workers,
+                        "footprint_filter": args.footprint_filter,
+                    }
+                )
+
+    def write(writer: ResultWriter, job: dict, target_points: list[tuple[str, AmedasStation]], matchups: list[Matchup]):
+        print(f"{job['prec_keyword']} {job['dataset_id']} {job['utc_start']:%Y-%m-%d}: {len(target_points)} stations, {len(matchups)} matchups", file=sys.stderr)
+        writer.write_many([matchup for matchup in matchups if matchup.usable or not args.usable_only])
+
+    # caches filled above are part of the report
+    parent_snapshot = metrics.get_snapshot(reset=True)
+
+    with ResultWriter(args.output, append=args.append) as writer:
+        if args.workers <= 1:
+            for job, target_points, matchups, snapshot in map(run_job, jobs):
+                write(writer, job, target_points, matchups)
+                metrics.merge(snapshot)
+        else:
+            # chrome is downloaded and extracted once here, not by each worker at the same time
+            SeleniumChromeWrapper("download", "workspace")
+
+            # results are written in job order
+            with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=(args.workers,)) as executor:
+                for job, target_points, matchups, snapshot in executor.map(run_job, jobs):
+                    write(writer, job, target_points, matchups)
+                    metrics.merge(snapshot)
+
+    if len(args.metrics) > 0:
+        metrics.merge(parent_snapshot)
+        metrics.save(args.metrics)
+        print("metrics saved: " + args.metrics, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+import sys, argparse
+
+from mockserver.server import MockServer, MockServerConfig
+
+# python -m mockserver [--port 8080] [--latency 0.2] [--jitter 0.1] [--error-rate 0.05] [--throughput 1000000]
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="local stand-in of the jma, mlit and g-portal servers on recorded fixtures")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra seconds up to this")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="ratio of requests answered with 503")
+    parser.add_argument("--throughput", type=float, default=0.0, help="bytes per second of each response, 0 is unlimited")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    config = MockServerConfig(args.latency, args.jitter, args.error_rate, args.throughput, seed=args.seed)
+    server = MockServer(args.host, args.port, config)
+    print("jma:     " + server.get_jma_base_url())
+    print("mlit:    " + server.get_ksj_base_url())
+    print("gportal: " + server.base_url)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+sys.exit(main())
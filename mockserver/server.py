@@ -0,0 +1,319 @@
+import os, io, re, json, glob, time, random, zipfile, tempfile, threading
+from dataclasses import dataclass
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from benchmark.make_fixtures import FIXTURE_DIR, ensure_hdf5
+
+# local stand-in for www.data.jma.go.jp, nlftp.mlit.go.jp and gportal.jaxa.jp replaying benchmark/fixtures.
+# paths are the same as on the real sites so one server covers all of them:
+#   AmedasStationInfo("workspace", server.get_jma_base_url())
+#   AmedasDailyInfo("workspace", server.get_jma_base_url())
+#   AdministrativeDivisionInfo("download", "workspace", base_url=server.get_ksj_base_url())
+#   CSWWrapper(server.base_url), GcomDownloader(..., base_url=server.base_url)
+
+
+@dataclass
+class MockServerConfig:
+    latency: float = 0.0  # seconds before every response
+    jitter: float = 0.0  # up to this many seconds are added to the latency at random
+    error_rate: float = 0.0  # ratio of requests answered with 503
+    throughput: float = 0.0  # bytes per second of each response, 0 is unlimited
+    granule_size: int = 4 * 1024 * 1024  # size of granules when h5py is not installed
+    fixture_dir: str = FIXTURE_DIR
+    seed: int = None
+
+
+class _MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], config: MockServerConfig) -> None:
+        super().__init__(address, _MockRequestHandler)
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.lock = threading.Lock()
+        self.request_counts: dict[str, int] = {}
+        self.zip_cache: dict[str, bytes] = {}
+        self.granule: bytes = None
+        self.temp_dir = tempfile.mkdtemp(prefix="mockserver_")
+
+    def get_base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class _MockRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: _MockHTTPServer
+
+    def log_message(self, format: str, *args) -> None:
+        # quiet, request counts are in get_request_counts()
+        pass
+
+    def _read_fixture(self, *names: str) -> bytes:
+        path = os.path.join(self.server.config.fixture_dir, *names)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+
+    def _rewrite(self, body: bytes) -> bytes:
+        # absolute urls in the recorded responses point to this server
+        return body.replace(b"https://gportal.jaxa.jp", self.server.get_base_url().encode("ascii"))
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: dict[str, str] = {}) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+
+        throughput = self.server.config.throughput
+        if throughput <= 0:
+            self.wfile.write(body)
+            return
+
+        # paced in chunks
+        chunk_size = 64 * 1024
+        for offset in range(0, len(body), chunk_size):
+            chunk = body[offset : offset + chunk_size]
+            self.wfile.write(chunk)
+            time.sleep(len(chunk) / throughput)
+
+    def _send_html(self, body: bytes) -> None:
+        self._send(200, self._rewrite(body), "text/html; charset=UTF-8")
+
+    def _send_not_found(self) -> None:
+        self._send(404, b"not found", "text/plain")
+
+    def _count(self, route: str) -> None:
+        with self.server.lock:
+            self.server.request_counts[route] = self.server.request_counts.get(route, 0) + 1
+
+    def _delay_or_fail(self) -> bool:
+        # True if the request was answered with an error
+        config = self.server.config
+        with self.server.lock:
+            delay = config.latency + self.server.random.uniform(0, config.jitter)
+            fail = self.server.random.random() < config.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            self._send(503, b"service unavailable", "text/plain")
+        return fail
+
+    def do_GET(self) -> None:
+        self._handle("GET")
+
+    def do_POST(self) -> None:
+        # login form
+        length = int(self.headers.get("Content-Length", "0"))
+        if length > 0:
+            self.rfile.read(length)
+        self._handle("POST")
+
+    def _handle(self, method: str) -> None:
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        routes = [
+            ("jma_prefecture00", r"^/obd/stats/etrn/select/prefecture00\.php$", self._jma_prefecture00),
+            ("jma_prefecture", r"^/obd/stats/etrn/select/prefecture\.php$", self._jma_prefecture),
+            ("jma_10min", r"^/obd/stats/etrn/view/10min_([sa])1\.php$", self._jma_10min),
+            ("ksj_index", r"^/ksj/index\.html$", self._ksj_index),
+            ("ksj_datalist", r"^/ksj/gml/datalist/(.+\.html)$", self._ksj_datalist),
+            ("ksj_zip", r"^/ksj/data/N03/[^/]+/(N03-(\d{4})\d{4}_(\d{2})_GML\.zip)$", self._ksj_zip),
+            ("csw", r"^/csw/csw$", self._csw),
+            ("gportal_login", r"^/gpr/auth$", self._gportal_login),
+            ("gportal_granule", r"^/download/.+/([^/]+\.h5)$", self._gportal_granule),
+        ]
+        for route, pattern, handler in routes:
+            match = re.match(pattern, url.path)
+            if match is None:
+                continue
+
+            self._count(route)
+            if self._delay_or_fail():
+                return
+            handler(method, match, query)
+            return
+
+        self._count("not_found")
+        self._send_not_found()
+
+    def _jma_prefecture00(self, method: str, match: re.Match, query: dict[str, str]) -> None:
+        self._send_html(self._read_fixture("jma", "prefecture00.html"))
+
+    def _jma_prefecture(self, method: str, match: re.Match, query: dict[str, str]) -> None:
+        # prefectures without a recording replay aichi
+        body = self._read_fixture("jma", f"prefecture_{query.get('prec_no', '')}.html")
+        if body is None:
+            body = self._read_fixture("jma", "prefecture_51.html")
+        self._send_html(body)
+
+    def _jma_10min(self, method: str, match: re.Match, query: dict[str, str]) -> None:
+        as_type = match.group(1)
+        keys = [query.get(key, "") for key in ["prec_no", "block_no", "year", "month", "day"]]
+        body = self._read_fixture("jma", f"10min_{as_type}1_{'_'.join(keys)}.html")
+        if body is None:
+            # any recorded day of the same station type
+            paths = sorted(glob.glob(os.path.join(self.server.config.fixture_dir, "jma", f"10min_{as_type}1_*.html")))
+            if len(paths) == 0:
+                self._send_not_found()
+                return
+            with open(paths[0], "rb") as f:
+                body = f.read()
+        self._send_html(body)
+
+    def _ksj_index(self, method: str, match: re.Match, query: dict[str, str]) -> None:
+        self._send_html(self._read_fixture("mlit", "ksj_index.html"))
+
+    def _ksj_datalist(self, method: str, match: re.Match, query: dict[str, str]) -> None:
+        body = self._read_fixture("mlit", match.group(1))
+        if body is None:
+            self._send_not_found()
+            return
+        self._send_html(body)
+
+    def _ksj_zip(self, method: str, match: re.Match, query: dict[str, str]) -> None:
+        # the recorded shapefile under the name of the requested prefecture
+        zip_filename = match.group(1)
+        with self.server.lock:
+            body = self.server.zip_cache.get(zip_filename)
+        if body is None:
+            stem = zip_filename[: -len("_GML.zip")]
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
+                for path in sorted(glob.glob(os.path.join(self.server.config.fixture_dir, "shp", "N03-20240101_23.*"))):
+                    extension = os.path.splitext(path)[1]
+                    zip_file.write(path, stem + extension)
+                zip_file.writestr(f"KS-META-{stem}.xml", "<metadata/>")
+            body = buffer.getvalue()
+            with self.server.lock:
+                self.server.zip_cache[zip_filename] = body
+
+        self._send(200, body, "application/zip", {"Content-Disposition": f'attachment; filename="{zip_filename}"'})
+
+    def _csw(self, method: str, match: re.Match, query: dict[str, str]) -> None:
+        body = self._read_fixture("gportal", f"csw_{query.get('datasetId', '')}.json")
+        data = json.loads(self._rewrite(body)) if body is not None else {"type": "FeatureCollection", "features": []}
+
+        def parse_time(time_str: str) -> datetime:
+            return datetime.strptime(time_str, "%Y-%m-%dT%H:%M:%S.%fZ")
+
+        # the same filters as the real service, time overlap and bbox intersection
+        features = data["features"]
+        if "startTime" in query and "endTime" in query:
+            start = parse_time(query["startTime"])
+            end = parse_time(query["endTime"])
+            features = [
+                feature for feature in features if parse_time(feature["properties"]["beginPosition"]) < end and parse_time(feature["properties"]["endPosition"]) > start
+            ]
+        if "bbox" in query:
+            # corners in any order, see CSWWrapper.get_hdf5_urls
+            lon1, lat1, lon2, lat2 = [float(value) for value in query["bbox"].split(",")]
+            lon_min, lon_max = min(lon1, lon2), max(lon1, lon2)
+            lat_min, lat_max = min(lat1, lat2), max(lat1, lat2)
+
+            def intersects(feature: dict) -> bool:
+                points = [point for ring in feature["geometry"]["coordinates"] for point in ring]
+                return min(x for x, y in points) <= lon_max and max(x for x, y in points) >= lon_min and min(y for x, y in points) <= lat_max and max(y for x, y in points) >= lat_min
+
+            features = [feature for feature in features if intersects(feature)]
+
+        data["features"] = features
+        data["properties"] = {"totalResults": len(features), "startIndex": 1, "itemsPerPage": len(features)}
+        self._send(200, json.dumps(data, ensure_ascii=False).encode("utf-8"), "application/json")
+
+    def _gportal_login(self, method: str, match: re.Match, query: dict[str, str]) -> None:
+        # JPortalLogin fills the form, the title after submitting tells success
+        if method == "POST":
+            body = "<html><head><title>G-PortalTop</title></head><body>logged in</body></html>"
+        else:
+            body = (
+                "<html><head><title>G-Portal Login</title></head><body>"
+                '<form method="post" action="/gpr/auth">'
+                '<input type="text" id="auth_account" name="account">'
+                '<input type="password" id="auth_password" name="password">'
+                '<button type="submit" id="auth_login_submit">login</button>'
+                "</form></body></html>"
+            )
+        self._send(200, body.encode("utf-8"), "text/html; charset=UTF-8")
+
+    def _gportal_granule(self, method: str, match: re.Match, query: dict[str, str]) -> None:
+        with self.server.lock:
+            if self.server.granule is None:
+                # synthetic gcom-c tile, zeros of the same size class without h5py
+                path = ensure_hdf5(self.server.temp_dir)
+                if len(path) > 0:
+                    with open(path, "rb") as f:
+                        self.server.granule = f.read()
+                else:
+                    self.server.granule = bytes(self.server.config.granule_size)
+            body = self.server.granule
+
+        self._send(200, body, "application/octet-stream", {"Content-Disposition": f'attachment; filename="{match.group(1)}"'})
+
+
+class MockServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, config: MockServerConfig = None) -> None:
+        # port 0 picks a free port
+        self._server = _MockHTTPServer((host, port), config if config is not None else MockServerConfig())
+        self._thread: threading.Thread = None
+
+    def __enter__(self) -> "MockServer":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.stop()
+
+    @property
+    def base_url(self) -> str:
+        return self._server.get_base_url()
+
+    def get_jma_base_url(self) -> str:
+        return self.base_url + "/obd/stats/etrn"
+
+    def get_ksj_base_url(self) -> str:
+        return self.base_url + "/ksj"
+
+    def get_config(self) -> MockServerConfig:
+        # changes apply to the following requests
+        return self._server.config
+
+    def get_request_counts(self) -> dict[str, int]:
+        with self._server.lock:
+            return dict(self._server.request_counts)
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mockserver", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+
+
+def test():
+    from japanmeteorologicalagency import AmedasStationInfo, AmedasDailyInfo
+
+    with MockServer(config=MockServerConfig(latency=0.05, error_rate=0.1, seed=0)) as server:
+        workspace = tempfile.mkdtemp()
+        station_info = AmedasStationInfo(workspace, server.get_jma_base_url())
+        nagoya = station_info.get_amedas_station("愛知県", "名古屋")
+        daily_info = AmedasDailyInfo(workspace, server.get_jma_base_url())
+        print(daily_info.get_amedas_daily(nagoya.as_type, nagoya.prec_no, nagoya.block_no, 2024, 1, 15))
+        print(server.get_request_counts())
+
+
+# test()
@@ -0,0 +1,225 @@
+import os, json, pickle, hashlib, queue, threading
+from typing import Any, Callable, Iterable, Iterator
+
+from instrumentation import metrics
+
+
+class Stage:
+    def __init__(
+        self,
+        name: str,
+        func: Callable,
+        inputs: list[str],
+        params: dict,
+        version: int,
+        validate: Callable[[Any], bool],
+    ) -> None:
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.params = params
+        self.version = version
+        self.validate = validate
+
+
+class Pipeline:
+    # stages run in order, func(*outputs of inputs, **params)
+    # output is cached by the hash of the name, version, params and the contents of the inputs,
+    # so changing a stage re-runs only the stages downstream of it
+
+    def __init__(self, cache_dir: str) -> None:
+        self._cache_dir = cache_dir
+        self._stages: list[Stage] = []
+
+    def add_stage(
+        self,
+        name: str,
+        func: Callable,
+        inputs: list[str] = [],
+        params: dict = {},
+        version: int = 1,
+        validate: Callable[[Any], bool] = None,
+    ) -> None:
+        # validate(output) returns False if side effects of a cached output (files) are gone
+        stage_names = [stage.name for stage in self._stages]
+        if name in stage_names:
+            raise Exception("stage already exists: " + name)
+        for input_name in inputs:
+            if not input_name in stage_names:
+                raise Exception("input stage must be added before: " + input_name)
+
+        self._stages.append(Stage(name, func, list(inputs), dict(params), version, validate))
+
+    def _get_key(self, stage: Stage, input_hashes: list[str]) -> str:
+        key_source = json.dumps(
+            {
+                "name": stage.name,
+                "version": stage.version,
+                "params": stage.params,
+                "inputs": input_hashes,
+            },
+            sort_keys=True,
+            ensure_ascii=False,
+            default=str,
+        )
+        return hashlib.sha256(key_source.encode("utf-8")).hexdigest()
+
+    def _get_cache_path(self, stage: Stage, key: str) -> str:
+        return os.path.join(self._cache_dir, stage.name, key + ".pkl")
+
+    def _load(self, path: str) -> tuple[bytes, Any]:
+        with open(path, "rb") as f:
+            data = f.read()
+        return data, pickle.loads(data)
+
+    def _save(self, path: str, output: Any) -> bytes:
+        data = pickle.dumps(output, protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+        return data
+
+    def run(self, targets: list[str] = None) -> dict[str, Any]:
+        # runs stages needed for targets (all if None), returns {stage name: output}
+
+        needed: set[str] = set(stage.name for stage in self._stages) if targets is None else set(targets)
+        for stage in reversed(self._stages):
+            if stage.name in needed:
+                needed.update(stage.inputs)
+
+        outputs: dict[str, Any] = {}
+        output_hashes: dict[str, str] = {}
+        for stage in self._stages:
+            if not stage.name in needed:
+                continue
+
+            key = self._get_key(stage, [output_hashes[input_name] for input_name in stage.inputs])
+            cache_path = self._get_cache_path(stage, key)
+
+            output = None
+            data = None
+            if os.path.exists(cache_path):
+                data, output = self._load(cache_path)
+                if stage.validate is not None and not stage.validate(output):
+                    data = None
+                    output = None
+
+            metrics.cache("stage_" + stage.name, data is not None)
+            if data is None:
+                print("stage run: " + stage.name)
+                with metrics.span("stage", stage=stage.name):
+                    output = stage.func(*[outputs[input_name] for input_name in stage.inputs], **stage.params)
+                data = self._save(cache_path, output)
+            else:
+                print("stage cached: " + stage.name)
+
+            outputs[stage.name] = output
+            output_hashes[stage.name] = hashlib.sha256(data).hexdigest()
+
+        return outputs
+
+
+class StreamStage:
+    def __init__(self, name: str, func: Callable[[Any], Any], workers: int = 1) -> None:
+        # func(item) returns the item for the next stage, None drops it
+        self.name = name
+        self.func = func
+        self.workers = workers
+
+
+class _StreamEnd:
+    # end of a queue, error is set if a worker failed
+    def __init__(self, error: BaseException = None) -> None:
+        self.error = error
+
+
+def run_streaming(items: Iterable[Any], stages: list[StreamStage], queue_size: int = 2) -> Iterator[Any]:
+    # items flow through stages in worker threads connected by bounded queues, so an item moves on
+    # as soon as its stage is done and total time approaches the slowest stage instead of the sum.
+    # outputs of the last stage are yielded in completion order to the calling thread,
+    # which keeps thread bound work (qgis) on it
+
+    queues: list[queue.Queue] = [queue.Queue(maxsize=queue_size) for i in range(len(stages) + 1)]
+    stop = threading.Event()
+
+    def put(q: queue.Queue, item: Any) -> bool:
+        # False if the stream was stopped while waiting for space
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def feed() -> None:
+        try:
+            for item in items:
+                if not put(queues[0], item):
+                    return
+            put(queues[0], _StreamEnd())
+        except BaseException as e:
+            put(queues[0], _StreamEnd(e))
+
+    def work(stage: StreamStage, input_queue: queue.Queue, output_queue: queue.Queue, remaining: list[int], lock: threading.Lock) -> None:
+        error: BaseException = None
+        while not stop.is_set():
+            try:
+                item = input_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            if isinstance(item, _StreamEnd):
+                # let the other workers of this stage see the end too
+                put(input_queue, item)
+                error = item.error
+                break
+
+            try:
+                with metrics.span("stream_stage", stage=stage.name):
+                    output = stage.func(item)
+            except BaseException as e:
+                error = e
+                break
+            if output is not None and not put(output_queue, output):
+                return
+
+        # the last worker of a stage closes its output
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last or error is not None:
+            put(output_queue, _StreamEnd(error))
+
+    threads: list[threading.Thread] = [threading.Thread(target=feed, name="stream_feed", daemon=True)]
+    for i, stage in enumerate(stages):
+        remaining = [stage.workers]
+        lock = threading.Lock()
+        for j in range(stage.workers):
+            thread = threading.Thread(
+                target=work,
+                args=(stage, queues[i], queues[i + 1], remaining, lock),
+                name=f"stream_{stage.name}_{j}",
+                daemon=True,
+            )
+            threads.append(thread)
+
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            item = queues[-1].get()
+            if isinstance(item, _StreamEnd):
+                if item.error is not None:
+                    raise item.error
+                break
+            yield item
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
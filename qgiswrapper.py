@@ -22,6 +22,8 @@ from qgis.PyQt.QtGui import QColor
 from qgis.PyQt.QtCore import QSize
 from qgis.PyQt import QtGui
 
+from instrumentation import metrics
+
 
 class QGisWrapper:
 
@@ -91,7 +93,8 @@ class QGisWrapper:
     def add_geotiff(self, tif_path: str) -> int:  # output layer number
 
         layer_number = len(self._geotiff_layers)
-        layer = QgsRasterLayer(tif_path, "Geotiff Layer " + str(layer_number))
+        with metrics.span("qgis_add_geotiff", item=os.path.basename(tif_path)):
+            layer = QgsRasterLayer(tif_path, "Geotiff Layer " + str(layer_number))
 
         if not layer.isValid():
             print("Layer failed to load!")
@@ -108,7 +111,29 @@ class QGisWrapper:
             print("failed to refer index:" + str(geotiff_layer_index))
             return 0.0, False
 
-        return self._geotiff_layers[geotiff_layer_index].dataProvider().sample(point, 1)
+        with metrics.span("qgis_sample"):
+            return self._geotiff_layers[geotiff_layer_index].dataProvider().sample(point, 1)
+
+    def get_geotiff_pixel_center(self, point: QgsPointXY, geotiff_layer_index: int) -> QgsPointXY:
+        # center of the pixel containing point, None if outside
+
+        if geotiff_layer_index >= len(self._geotiff_layers):
+            print("failed to refer index:" + str(geotiff_layer_index))
+            return None
+
+        layer = self._geotiff_layers[geotiff_layer_index]
+        extent = layer.extent()
+        if not extent.contains(point):
+            return None
+
+        pixel_width = layer.rasterUnitsPerPixelX()
+        pixel_height = layer.rasterUnitsPerPixelY()
+        column = math.floor((point.x() - extent.xMinimum()) / pixel_width)
+        row = math.floor((extent.yMaximum() - point.y()) / pixel_height)
+        return QgsPointXY(
+            extent.xMinimum() + (column + 0.5) * pixel_width,
+            extent.yMaximum() - (row + 0.5) * pixel_height,
+        )
 
     def get_shp_layers_extent(self) -> QgsRectangle:
         shp_layers_len = len(self._shp_layers)
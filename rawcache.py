@@ -0,0 +1,138 @@
+import os, gzip, time, sqlite3, hashlib, threading
+from dataclasses import dataclass
+
+from httpclient import http_client
+from instrumentation import metrics
+
+# raw bodies of scraped pages, so a parser fix can re-parse them without the network
+# - one gzip file per url under directory/xx/, named by the sha1 of the url
+# - index.sqlite3 keeps url, encoding and the validators (etag, last-modified) of each body
+# - fetch() answers from disk while younger than max_age, otherwise asks the server
+#   with If-None-Match / If-Modified-Since and keeps the body on 304
+
+
+@dataclass
+class RawResponse:
+    url: str
+    content: bytes
+    encoding: str
+    etag: str
+    last_modified: str
+    fetched_at: float  # unix time of the last download or revalidation
+
+    def get_text(self) -> str:
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+
+class RawResponseCache:
+    def __init__(self, directory: str, compress_level: int = 6) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._compress_level = compress_level
+
+        # shared by download threads
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(os.path.join(directory, "index.sqlite3"), timeout=60, check_same_thread=False)
+        self._connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS raw_responses (
+                url TEXT PRIMARY KEY,
+                filename TEXT NOT NULL,
+                encoding TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                size INTEGER NOT NULL
+            )
+            """
+        )
+        self._connection.commit()
+
+    def _get_filename(self, url: str) -> str:
+        digest = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        return os.path.join(digest[:2], digest + ".gz")
+
+    def load(self, url: str) -> RawResponse:
+        with self._lock:
+            row = self._connection.execute("SELECT filename, encoding, etag, last_modified, fetched_at FROM raw_responses WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return None
+
+        filename, encoding, etag, last_modified, fetched_at = row
+        path = os.path.join(self._directory, filename)
+        if not os.path.exists(path):
+            return None
+        with gzip.open(path, "rb") as f:
+            content = f.read()
+
+        return RawResponse(url, content, encoding, etag, last_modified, fetched_at)
+
+    def save(self, response: RawResponse) -> None:
+        filename = self._get_filename(response.url)
+        path = os.path.join(self._directory, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # the body is in place before the index points to it, temp names are unique per process and thread
+        temp_path = f"{path}.{os.getpid()}_{threading.get_ident()}.tmp"
+        with gzip.open(temp_path, "wb", compresslevel=self._compress_level) as f:
+            f.write(response.content)
+        os.replace(temp_path, path)
+
+        with self._lock:
+            with self._connection:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO raw_responses (url, filename, encoding, etag, last_modified, fetched_at, size) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (response.url, filename, response.encoding, response.etag, response.last_modified, response.fetched_at, len(response.content)),
+                )
+
+    def _touch(self, url: str, fetched_at: float) -> None:
+        with self._lock:
+            with self._connection:
+                self._connection.execute("UPDATE raw_responses SET fetched_at = ? WHERE url = ?", (fetched_at, url))
+
+    def get_urls(self, prefix: str = "") -> list[str]:
+        # prefix of the url, e.g. base_url + "/view/10min_"
+        with self._lock:
+            rows = self._connection.execute("SELECT url FROM raw_responses WHERE substr(url, 1, ?) = ? ORDER BY url", (len(prefix), prefix)).fetchall()
+        return [row[0] for row in rows]
+
+    def fetch(self, url: str, max_age: float = 0.0) -> tuple[int, str]:
+        # (status code, text), text is None unless 200
+        # max_age None uses the cached body whatever its age, 0 always revalidates
+        cached = self.load(url)
+        if cached is not None and (max_age is None or time.time() - cached.fetched_at < max_age):
+            metrics.cache("raw_response", True)
+            return 200, cached.get_text()
+
+        headers: dict[str, str] = {}
+        if cached is not None:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+
+        response = http_client.get(url, headers=headers)
+        if response.status_code == 304 and cached is not None:
+            metrics.cache("raw_response", True)
+            self._touch(url, time.time())
+            return 200, cached.get_text()
+
+        metrics.cache("raw_response", False)
+        if response.status_code != 200:
+            return response.status_code, None
+
+        raw_response = RawResponse(url, response.content, response.apparent_encoding, response.headers.get("ETag"), response.headers.get("Last-Modified"), time.time())
+        self.save(raw_response)
+        return 200, raw_response.get_text()
+
+
+def test():
+    raw_cache = RawResponseCache("workspace/raw")
+    url = "https://www.data.jma.go.jp/obd/stats/etrn/select/prefecture00.php"
+    status_code, text = raw_cache.fetch(url)
+    print(status_code, len(text))
+    status_code, text = raw_cache.fetch(url, 3600)
+    print(status_code, len(text), raw_cache.get_urls("https://www.data.jma.go.jp/"))
+
+
+# test()
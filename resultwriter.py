@@ -0,0 +1,179 @@
+import os, sys, csv, time
+from dataclasses import dataclass, fields, astuple
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+@dataclass
+class Matchup:
+    # one (scene, station) pair, dropped pairs are kept with the reason
+    scene_time: str  # jst, iso format
+    dataset_id: str
+    prec_name: str
+    station_name: str
+    prec_no: int
+    block_no: int
+    station_lon: float
+    station_lat: float
+    amedas_temperature: float  # nan if not observed
+    lst_temperature: float
+    qa_flag: int
+    pixel_distance: float  # meter from the station to the sampled pixel center
+    usable: bool
+    drop_reason: str  # empty if usable
+
+
+MATCHUP_FIELD_NAMES = [field.name for field in fields(Matchup)]
+
+
+_stdout_file = None
+
+
+def reserve_stdout():
+    # stdout only carries the csv of "-", everything else written to stdout goes to stderr from here on,
+    # on the file descriptor too, so worker processes, gdal and browsers started later inherit it
+    global _stdout_file
+    if _stdout_file is None:
+        sys.stdout.flush()
+        _stdout_file = os.fdopen(os.dup(sys.stdout.fileno()), "w", encoding="utf-8", newline="")
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+        sys.stdout = sys.stderr
+    return _stdout_file
+
+
+def _get_parquet_schema():
+    types = {
+        str: pyarrow.string(),
+        int: pyarrow.int64(),
+        float: pyarrow.float64(),
+        bool: pyarrow.bool_(),
+    }
+    return pyarrow.schema([(field.name, types[field.type]) for field in fields(Matchup)])
+
+
+class ResultWriter:
+    # batched matchup output
+    # csv: one file, append adds rows after the existing header
+    # parquet: a directory of part files, each writer adds one part with a row group per batch,
+    #          pyarrow.parquet.read_table(path) loads all parts
+    # "-" writes csv to stdout, see reserve_stdout()
+
+    def __init__(self, path: str, output_format: str = None, append: bool = False, batch_size: int = 10000) -> None:
+        if output_format is None:
+            output_format = "parquet" if path.endswith(".parquet") else "csv"
+        if not output_format in ["csv", "parquet"]:
+            raise Exception("unknown output format: " + output_format)
+        if output_format == "parquet" and pyarrow is None:
+            raise Exception("pyarrow is required for parquet output")
+
+        self._path = path
+        self._format = output_format
+        self._append = append
+        self._batch_size = batch_size
+        self._batch: list[Matchup] = []
+        self._number_of_rows = 0
+
+        self._csv_file = None
+        self._csv_writer = None
+        self._parquet_writer = None
+        self._closed = False
+
+    def __enter__(self) -> "ResultWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def _open_csv(self) -> None:
+        if self._path == "-":
+            self._csv_file = reserve_stdout()
+            write_header = True
+        else:
+            os.makedirs(os.path.dirname(self._path) or ".", exist_ok=True)
+            write_header = not (self._append and os.path.exists(self._path) and os.path.getsize(self._path) > 0)
+            self._csv_file = open(self._path, "a" if self._append else "w", encoding="utf-8", newline="")
+
+        self._csv_writer = csv.writer(self._csv_file)
+        if write_header:
+            self._csv_writer.writerow(MATCHUP_FIELD_NAMES)
+
+    def _open_parquet(self) -> None:
+        if os.path.isdir(self._path) and not self._append:
+            for filename in os.listdir(self._path):
+                if filename.endswith(".parquet"):
+                    os.remove(os.path.join(self._path, filename))
+        os.makedirs(self._path, exist_ok=True)
+
+        # unique per writer, so several processes can append to the same dataset
+        part_path = os.path.join(self._path, f"part-{time.time_ns()}-{os.getpid()}.parquet")
+        self._parquet_writer = pyarrow.parquet.ParquetWriter(part_path, _get_parquet_schema())
+
+    def _write_batch(self) -> None:
+        if len(self._batch) == 0:
+            return
+
+        if self._format == "csv":
+            if self._csv_writer is None:
+                self._open_csv()
+            self._csv_writer.writerows(astuple(matchup) for matchup in self._batch)
+            self._csv_file.flush()
+        else:
+            if self._parquet_writer is None:
+                self._open_parquet()
+            columns = {name: [getattr(matchup, name) for matchup in self._batch] for name in MATCHUP_FIELD_NAMES}
+            table = pyarrow.Table.from_pydict(columns, schema=_get_parquet_schema())
+            self._parquet_writer.write_table(table, row_group_size=len(self._batch))
+
+        self._number_of_rows += len(self._batch)
+        self._batch = []
+
+    def write(self, matchup: Matchup) -> None:
+        self._batch.append(matchup)
+        if len(self._batch) >= self._batch_size:
+            self._write_batch()
+
+    def write_many(self, matchups: list[Matchup]) -> None:
+        for matchup in matchups:
+            self.write(matchup)
+
+    def flush(self) -> None:
+        self._write_batch()
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._write_batch()
+
+        # header only or an empty part, so readers see the columns
+        if self._format == "csv" and self._csv_writer is None:
+            self._open_csv()
+        if self._format == "parquet" and self._parquet_writer is None:
+            self._open_parquet()
+
+        if self._csv_file is not None and self._path != "-":
+            self._csv_file.close()
+        self._csv_file = None
+        self._csv_writer = None
+
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+        self._parquet_writer = None
+        self._closed = True
+
+    def get_number_of_rows(self) -> int:
+        return self._number_of_rows
+
+
+def test():
+    matchup = Matchup("2024-01-01T10:30:00+09:00", "10002019", "愛知県", "名古屋", 51, 47636, 136.965, 35.166, 8.3, 10.1, 0, 120.5, True, "")
+    with ResultWriter("workspace/test_matchups.csv", batch_size=2) as writer:
+        writer.write_many([matchup] * 5)
+    with ResultWriter("workspace/test_matchups.csv", append=True) as writer:
+        writer.write(matchup)
+
+
+# test()
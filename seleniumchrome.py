@@ -1,20 +1,25 @@
-import os, requests, zipfile, time
+import os, zipfile, time
 from bs4 import BeautifulSoup
 
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
 
+from instrumentation import metrics
+from httpclient import http_client
+
+CHROME_LABS_URL = "https://googlechromelabs.github.io/chrome-for-testing/"
+
 
 class ChromeDownloader:
-    def __init__(self, download_dir: str) -> None:
+    def __init__(self, download_dir: str, chrome_labs_url: str = CHROME_LABS_URL) -> None:
 
         # prepare workspace
         os.makedirs(name=download_dir, exist_ok=True)
 
         # set properties
         self._download_dir = download_dir
-        self._chrome_labs_url = "https://googlechromelabs.github.io/chrome-for-testing/"
+        self._chrome_labs_url = chrome_labs_url
         self._chromedriver_zip_filename = "chromedriver-linux64.zip"
         self._chrome_zip_filename = "chrome-linux64.zip"
 
@@ -43,7 +48,7 @@ class ChromeDownloader:
         return url
 
     def _get_chrome_labs_page(self) -> BeautifulSoup:
-        response = requests.get(self._chrome_labs_url)
+        response = http_client.get(self._chrome_labs_url)
 
         if response.status_code != 200:
             print(f"Failed to access page: {self._chrome_labs_url} {response.status_code}")
@@ -58,18 +63,17 @@ class ChromeDownloader:
 
     def _download_file(self, url: str, save_path: str) -> bool:
 
+        metrics.cache("chrome_download", os.path.exists(save_path))
         if os.path.exists(save_path):
             print("already exists: ", save_path)
             return True
 
-        response = requests.get(url)
-        if response.status_code != 200:
+        with metrics.span("chrome_download", item=self._get_filename_from_url(url)):
+            downloaded = http_client.download(url, save_path)
+        if not downloaded:
             print("failed to download: ", url)
             return False
 
-        with open(save_path, "wb") as f:
-            f.write(response.content)
-
         return True
 
     def get_chromedriver_zip_path(self) -> str:
@@ -150,8 +154,8 @@ class ChromeExtractor:
 
 class SeleniumChromeWrapper:
 
-    def _prepare(self, download_dir: str, workspace_dir: str) -> tuple[str, str]:
-        dl = ChromeDownloader(download_dir)
+    def _prepare(self, download_dir: str, workspace_dir: str, chrome_labs_url: str) -> tuple[str, str]:
+        dl = ChromeDownloader(download_dir, chrome_labs_url)
 
         if not dl.download():
             raise Exception("couldn't download files")
@@ -162,9 +166,9 @@ class SeleniumChromeWrapper:
 
         return ex.get_chromedriver_path(), ex.get_chrome_path()
 
-    def __init__(self, download_dir: str, workspace_dir: str) -> None:
+    def __init__(self, download_dir: str, workspace_dir: str, chrome_labs_url: str = CHROME_LABS_URL) -> None:
 
-        chromedriver_dir, chrome_dir = self._prepare(download_dir, workspace_dir)
+        chromedriver_dir, chrome_dir = self._prepare(download_dir, workspace_dir, chrome_labs_url)
 
         self._download_path = download_dir
         self._chromedriver_path = os.path.join(chromedriver_dir, "chromedriver")
@@ -203,28 +207,73 @@ class SeleniumChromeWrapper:
         filename = url.split("/")[-1]
         return filename
 
+    def _try_lock(self, lock_path: str) -> bool:
+        # lock file with the pid of the holder, a lock of a dead process is removed
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                with open(lock_path, "r") as f:
+                    pid = int(f.read() or 0)
+            except (OSError, ValueError):
+                return False
+            if pid > 0 and not _is_process_alive(pid):
+                try:
+                    os.remove(lock_path)
+                except FileNotFoundError:
+                    pass
+            return False
+
+        with os.fdopen(fd, "w") as f:
+            f.write(str(os.getpid()))
+        return True
+
     def download_sync(self, driver: webdriver.Chrome, url) -> str:
 
         # target path
         filename = self._get_filename_from_url(url)
         path = os.path.join(self._download_path, filename)
 
+        metrics.cache("gcom_download", os.path.exists(path))
         if os.path.exists(path):
             print("file already exists: ", path)
             return path
 
-        # download
-        driver.get(url)
-        print("start downloading: ", url)
-
-        # check if file exists
-        while not os.path.exists(path):
+        # worker processes share the download directory, neighbouring prefectures need the same tiles
+        lock_path = path + ".lock"
+        while not self._try_lock(lock_path):
             time.sleep(1)
-        time.sleep(1)
+        try:
+            if os.path.exists(path):
+                print("file already exists: ", path)
+                return path
+
+            # download
+            with metrics.span("gcom_download", item=filename):
+                driver.get(url)
+                print("start downloading: ", url)
+
+                # check if file exists
+                while not os.path.exists(path):
+                    time.sleep(1)
+                time.sleep(1)
+            metrics.count("download_bytes", os.path.getsize(path), source="gcom")
+        finally:
+            os.remove(lock_path)
 
         return path
 
 
+def _is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
 def test():
 
     dl = ChromeDownloader("download")